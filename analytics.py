@@ -0,0 +1,288 @@
+"""Cross-user task analytics over the task_events log, behind the admin /stats.
+
+Each shard's events of the period are read events.BATCH_SIZE at a time,
+straight from the cursor into integer columns; the aggregates are then
+whole-column NumPy operations (bincount, unique, searchsorted) instead of
+a Python loop over the rows. NumPy is optional: without it the same
+numbers are computed row by row, much more slowly
+(benchmarks/bench_event_stats.py compares both).
+
+A user's events all live in one shard (see storage.py), so per-user and
+distinct-user counts are finished per shard and the shard totals add up.
+Given a jobs.JobPool, each shard big enough is summarized in a worker
+process, which reads the shard file with its own connection: the bot's
+event loop and reader threads stay free meanwhile. Days are UTC days.
+"""
+import asyncio
+import bisect
+import itertools
+import math
+import sqlite3
+import time
+
+import events
+from storage import get_pool
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+DAY = 86400
+# Completion times are counted in buckets 2^(1/8) apart (about 9%), from
+# one second up to 2^25 seconds (over a year)
+STEPS_PER_DOUBLING = 8
+DURATION_BINS = 25 * STEPS_PER_DOUBLING + 1
+# Users by tasks created in the period: 1, 2-5, 6-10, 11-50, 51-100, 101-500, more
+TASK_COUNT_EDGES = (1, 2, 6, 11, 51, 101, 501)
+TASK_COUNT_LABELS = ("1", "2-5", "6-10", "11-50", "51-100", "101-500", "500+")
+# (day, user) keys: user ids take the low 52 bits, as Telegram guarantees
+USER_BITS = 52
+# Per-batch unique keys kept before they are merged
+MERGE_AFTER = 2_000_000
+COLUMNS = 4
+
+
+def duration_bin(seconds):
+    """Bucket of a completion time, see DURATION_BINS"""
+    if seconds < 1:
+        return 0
+    return min(int(math.log2(seconds) * STEPS_PER_DOUBLING), DURATION_BINS - 1)
+
+
+class Summary:
+    """Aggregates of the task events of the last `days` days, from origin (epoch seconds) on"""
+
+    def __init__(self, origin, days):
+        self.origin = origin
+        self.days = days
+        # Events per kind, indexed by the kind number
+        self.kinds = [0] * (max(events.KINDS) + 1)
+        # Distinct active users per day, and over the whole period
+        self.active = [0] * days
+        self.users = 0
+        # Completions per duration_bin() of their time to complete
+        self.durations = [0] * DURATION_BINS
+        # Users per TASK_COUNT_EDGES bucket of tasks created
+        self.task_counts = [0] * len(TASK_COUNT_EDGES)
+        # Time spent reading the events and aggregating them, not compared by ==
+        self.read_seconds = 0.0
+        self.aggregate_seconds = 0.0
+
+    def merge(self, other):
+        for name in ("kinds", "active", "durations", "task_counts"):
+            setattr(self, name, [a + b for a, b in zip(getattr(self, name), getattr(other, name))])
+        self.users += other.users
+        self.read_seconds += other.read_seconds
+        self.aggregate_seconds += other.aggregate_seconds
+        return self
+
+    @property
+    def events(self):
+        return sum(self.kinds)
+
+    def completion_time(self, fraction):
+        """Time to complete (seconds) that `fraction` of the completions took at most, or None"""
+        total = sum(self.durations)
+        if not total:
+            return None
+        seen = 0
+        for index, count in enumerate(self.durations):
+            seen += count
+            if seen >= fraction * total:
+                # The middle of the bucket
+                return 2 ** ((index + 0.5) / STEPS_PER_DOUBLING) if index else 0.0
+        return None
+
+    def __eq__(self, other):
+        fields = ("origin", "days", "kinds", "active", "users", "durations", "task_counts")
+        return all(getattr(self, name) == getattr(other, name) for name in fields)
+
+
+class _RowShard:
+    """One shard's aggregates, a row at a time"""
+
+    load = list
+
+    def __init__(self, origin, days):
+        self.summary = Summary(origin, days)
+        self._pairs = set()
+        self._created = {}
+
+    def add(self, rows):
+        summary = self.summary
+        origin, last_day = summary.origin, summary.days - 1
+        for at, user_id, kind, created_at in rows:
+            if at < origin or kind >= len(summary.kinds):
+                continue
+            summary.kinds[kind] += 1
+            self._pairs.add((min((at - origin) // DAY, last_day), user_id))
+            if kind == events.COMPLETED:
+                summary.durations[duration_bin(at - created_at)] += 1
+            elif kind == events.CREATED:
+                self._created[user_id] = self._created.get(user_id, 0) + 1
+
+    def finish(self):
+        summary = self.summary
+        for day, _ in self._pairs:
+            summary.active[day] += 1
+        summary.users = len({user_id for _, user_id in self._pairs})
+        for count in self._created.values():
+            summary.task_counts[bisect.bisect_right(TASK_COUNT_EDGES, count) - 1] += 1
+        return summary
+
+
+class _KeyCounts:
+    """Counts per int64 key, gathered batch by batch and merged now and then"""
+
+    def __init__(self):
+        self._parts = []
+        self._merged = 0
+        self._pending = 0
+
+    def add(self, keys):
+        keys, counts = np.unique(keys, return_counts=True)
+        self._parts.append((keys, counts))
+        self._pending += len(keys)
+        # Merging once the new keys outnumber the merged ones keeps the total work n log n
+        if self._pending > max(MERGE_AFTER, self._merged):
+            self.merge()
+
+    def merge(self):
+        if not self._parts:
+            return np.empty(0, np.int64), np.empty(0, np.int64)
+        keys = np.concatenate([keys for keys, _ in self._parts])
+        counts = np.concatenate([counts for _, counts in self._parts])
+        keys, inverse = np.unique(keys, return_inverse=True)
+        counts = np.bincount(inverse, weights=counts, minlength=len(keys)).astype(np.int64)
+        self._parts = [(keys, counts)]
+        self._merged, self._pending = len(keys), 0
+        return keys, counts
+
+
+class _VectorShard:
+    """One shard's aggregates, a batch of columns at a time"""
+
+    def __init__(self, origin, days):
+        self.summary = Summary(origin, days)
+        self._kinds = np.zeros(len(self.summary.kinds), np.int64)
+        self._durations = np.zeros(DURATION_BINS, np.int64)
+        self._pairs = _KeyCounts()
+        self._created = _KeyCounts()
+
+    @staticmethod
+    def load(cursor):
+        """A batch of events as an (events, COLUMNS) array, without a Python list of rows in between"""
+        return np.fromiter(itertools.chain.from_iterable(cursor), np.int64).reshape(-1, COLUMNS)
+
+    def add(self, columns):
+        at, user_id, kind, created_at = columns.T
+        keep = (at >= self.summary.origin) & (kind < len(self._kinds))
+        at, user_id, kind, created_at = at[keep], user_id[keep], kind[keep], created_at[keep]
+
+        self._kinds += np.bincount(kind, minlength=len(self._kinds))
+        day = np.minimum((at - self.summary.origin) // DAY, self.summary.days - 1)
+        self._pairs.add((day << USER_BITS) | user_id)
+
+        completed = kind == events.COMPLETED
+        seconds = (at[completed] - created_at[completed]).astype(np.float64)
+        bins = np.zeros(len(seconds), np.int64)
+        positive = seconds >= 1
+        bins[positive] = np.minimum(
+            (np.log2(seconds[positive]) * STEPS_PER_DOUBLING).astype(np.int64), DURATION_BINS - 1
+        )
+        self._durations += np.bincount(bins, minlength=DURATION_BINS)
+
+        self._created.add(user_id[kind == events.CREATED])
+
+    def finish(self):
+        summary = self.summary
+        summary.kinds = self._kinds.tolist()
+        summary.durations = self._durations.tolist()
+        pairs, _ = self._pairs.merge()
+        summary.active = np.bincount(pairs >> USER_BITS, minlength=summary.days).tolist()
+        summary.users = len(np.unique(pairs & ((1 << USER_BITS) - 1)))
+        _, created = self._created.merge()
+        buckets = np.searchsorted(TASK_COUNT_EDGES, created, side="right") - 1
+        summary.task_counts = np.bincount(buckets, minlength=len(TASK_COUNT_EDGES)).tolist()
+        return summary
+
+
+def summarize_file(db_file, origin, days, vectorized, batch_size=events.BATCH_SIZE):
+    """Summary of one shard file's events from origin on, read with a connection of its own.
+
+    Blocking: the job summarize() hands to a worker process.
+    """
+    part = (_VectorShard if vectorized else _RowShard)(origin, days)
+    summary = part.summary
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True)
+    try:
+        next_id = events.first_id_since.__wrapped__(conn, origin)
+        while next_id is not None:
+            started = time.perf_counter()
+            batch, next_id = events.get_batch.__wrapped__(conn, next_id, batch_size, part.load)
+            summary.read_seconds += time.perf_counter() - started
+            started = time.perf_counter()
+            if len(batch):
+                part.add(batch)
+            summary.aggregate_seconds += time.perf_counter() - started
+    finally:
+        conn.close()
+    started = time.perf_counter()
+    part.finish()
+    summary.aggregate_seconds += time.perf_counter() - started
+    return summary
+
+
+async def _summarize_shard(shard, origin, days, vectorized, batch_size):
+    part = (_VectorShard if vectorized else _RowShard)(origin, days)
+    summary = part.summary
+    next_id = await events.first_id_since.on_shard(shard, origin)
+    while next_id is not None:
+        started = time.perf_counter()
+        batch, next_id = await events.get_batch.on_shard(shard, next_id, batch_size, part.load)
+        summary.read_seconds += time.perf_counter() - started
+        started = time.perf_counter()
+        if len(batch):
+            await asyncio.to_thread(part.add, batch)
+        summary.aggregate_seconds += time.perf_counter() - started
+    started = time.perf_counter()
+    await asyncio.to_thread(part.finish)
+    summary.aggregate_seconds += time.perf_counter() - started
+    return summary
+
+
+async def summarize(days=30, now=None, vectorized=None, batch_size=events.BATCH_SIZE, jobs=None):
+    """Summary of the events of the last `days` UTC days (today included), over every shard.
+
+    vectorized defaults to whether NumPy is installed. With a JobPool in
+    jobs, every shard with at least its threshold of events is summarized
+    by summarize_file() in a worker process. Otherwise batches are read by
+    the pool's reader threads and aggregated in a worker thread, off the
+    event loop.
+    """
+    if vectorized is None:
+        vectorized = np is not None
+    now = int(time.time() if now is None else now)
+    origin = (now // DAY - days + 1) * DAY
+    summary = Summary(origin, days)
+    pool = get_pool()
+    if jobs is None:
+        for shard in range(len(pool.shards)):
+            summary.merge(await _summarize_shard(shard, origin, days, vectorized, batch_size))
+        return summary
+
+    async def offload(shard):
+        first_id = await events.first_id_since.on_shard(shard, origin)
+        if first_id is None:
+            return Summary(origin, days)
+        # Ids are dense (see events.get_batch), so this is the shard's event count
+        size = await events.last_id.on_shard(shard) - first_id + 1
+        return await jobs.run(
+            summarize_file, pool.shards[shard].db_file, origin, days, vectorized, batch_size, size=size
+        )
+
+    # Shards run side by side, one per worker process
+    for part in await asyncio.gather(*(offload(shard) for shard in range(len(pool.shards)))):
+        summary.merge(part)
+    return summary
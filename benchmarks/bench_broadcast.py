@@ -0,0 +1,171 @@
+"""/broadcast to 1M synthetic users through a local fake Bot API.
+
+Fills a fresh sharded database with users, then runs broadcast.Broadcaster
+with a real PTB bot and the bot's outbox (with the global rate limit
+lifted) against benchmarks/fake_bot_api.py. The fake is called in process
+(FakeBotRequest): over localhost HTTP a single process manages only a few
+hundred requests a second, which would make 1M users take an hour; pass
+--http to go through HTTP anyway. One user in 100 has blocked
+the bot (403) and every FLOOD_EVERY-th request is answered with 429. A
+third of the way through, the broadcaster is stopped like the bot would
+be on a restart, and a new one resumes from the checkpoints.
+
+Reports the throughput of both runs and the process memory at 10% and at
+the end, and checks that:
+
+- every user who hasn't blocked the bot got the message, blocked ones none
+- only chunks in flight at the stop were sent twice
+- the sent and failed totals match
+- memory did not grow with the number of users
+
+Exits non-zero if a check fails.
+
+Usage: python benchmarks/bench_broadcast.py [users] [--shards N] [--http]
+"""
+import argparse
+import asyncio
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram.ext import ExtBot
+from telegram.request import HTTPXRequest
+
+import broadcast
+from fake_bot_api import FakeBotAPI, FakeBotRequest
+from migrations import migrate
+from outbox import OutboxRateLimiter, PRIORITY_BULK
+from storage import close_pool, init_pool, shard_index
+
+BASE_ID = 100_000_000
+FLOOD_EVERY = 100_000
+# Growth of the resident set from 10% to 100% of the users that still counts as flat
+MAX_GROWTH = 32 * 2 ** 20
+
+
+def fill(conn, users, shard, shards):
+    conn.executemany(
+        "INSERT INTO users (user_id, name, username, registered_on) VALUES (?, ?, ?, ?)",
+        ((str(user_id), f"User {user_id}", None, 0) for user_id in range(BASE_ID, BASE_ID + users)
+         if shard_index(str(user_id), shards) == shard)
+    )
+
+
+def rss():
+    """Current resident set size in bytes"""
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def blocked(chat_id):
+    return chat_id % 100 == 0
+
+
+def check(failures, ok, message):
+    print(f"{'ok  ' if ok else 'FAIL'} {message}")
+    if not ok:
+        failures.append(message)
+
+
+async def run(users, shards, chunk_size, concurrency, port, http):
+    received = bytearray(users)
+
+    def on_send(chat_id, text):
+        received[chat_id - BASE_ID] = min(255, received[chat_id - BASE_ID] + 1)
+
+    api = FakeBotAPI(port=port, flood_every=FLOOD_EVERY, retry_after=1, blocked=blocked, on_send=on_send)
+    if http:
+        await api.start()
+        request = HTTPXRequest(connection_pool_size=concurrency)
+    else:
+        request = FakeBotRequest(api)
+    outbox = OutboxRateLimiter(global_rate=1e9, burst=concurrency)
+    bot = ExtBot("123:broadcast", base_url=api.base_url, rate_limiter=outbox, request=request)
+    ended = asyncio.Event()
+
+    async def send(chat_id, text):
+        await bot.send_message(chat_id=chat_id, text=text, rate_limit_args=PRIORITY_BULK)
+
+    async def notify(created_by, finished):
+        ended.set()
+
+    memory = {}
+    try:
+        async with bot:
+            first = broadcast.Broadcaster(chunk_size, concurrency)
+            await first.start(send, notify)
+            started = await first.broadcast("📣 Maintenance tonight at 22:00", created_by="1")
+            while started.done < users // 3:
+                await asyncio.sleep(0.05)
+                if "10%" not in memory and started.done >= users // 10:
+                    memory["10%"] = rss()
+            runs = [started.summary()]
+            # Stopped like on a restart, then picked up by a new broadcaster
+            await first.stop()
+
+            second = broadcast.Broadcaster(chunk_size, concurrency)
+            await second.start(send, notify)
+            resumed = second.current
+            await ended.wait()
+            runs.append(resumed.summary())
+            memory["end"] = rss()
+    finally:
+        if http:
+            await api.stop()
+
+    for name, summary in zip(("first run", "resumed run"), runs):
+        print(f"{name:<12} {summary['sent'] + summary['failed']:>9} users done so far, "
+              f"{summary['seconds']:>6.1f}s at {summary['per_second']:>6.0f} messages/s")
+    print(f"memory       {memory.get('10%', 0) / 2 ** 20:.0f} MiB at 10%, {memory['end'] / 2 ** 20:.0f} MiB at the end; "
+          f"{api.floods} flood answers, {outbox.retried} retries\n")
+
+    failures = []
+    missed = sum(1 for index, count in enumerate(received) if count == 0 and not blocked(BASE_ID + index))
+    reached_blocked = sum(1 for index, count in enumerate(received) if count and blocked(BASE_ID + index))
+    check(failures, missed == 0 and reached_blocked == 0,
+          f"every user got the message except those who blocked the bot ({missed} missed)")
+    twice = sum(1 for count in received if count > 1)
+    check(failures, twice <= shards * chunk_size,
+          f"only the chunks in flight at the stop were sent twice ({twice} users)")
+    blocked_users = sum(1 for user_id in range(BASE_ID, BASE_ID + users) if blocked(user_id))
+    final = runs[-1]
+    check(failures, final["sent"] == users - blocked_users and final["failed"] == blocked_users
+          and final["total"] == users, f"sent/failed totals match ({final['sent']}/{final['failed']})")
+    check(failures, memory["end"] - memory.get("10%", memory["end"]) < MAX_GROWTH,
+          "memory stays flat as the broadcast goes on")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("users", type=int, nargs="?", default=1_000_000)
+    parser.add_argument("--shards", type=int, default=2)
+    parser.add_argument("--chunk-size", type=int, default=broadcast.CHUNK_SIZE)
+    parser.add_argument("--concurrency", type=int, default=broadcast.CONCURRENCY)
+    parser.add_argument("--port", type=int, default=8085, help="port for the local fake Bot API")
+    parser.add_argument("--http", action="store_true", help="call the fake Bot API over HTTP")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = init_pool(os.path.join(tmp, "broadcast.db"), readers=2, shards=args.shards)
+        pool.run_write_all(migrate)
+        started = time.perf_counter()
+        for shard in range(args.shards):
+            pool.shards[shard].run_write(fill, args.users, shard, args.shards)
+        print(f"{args.users} users over {args.shards} shards created in {time.perf_counter() - started:.1f}s")
+        try:
+            failures = asyncio.run(run(args.users, args.shards, args.chunk_size, args.concurrency, args.port, args.http))
+        finally:
+            close_pool()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""Handler latency (p50/p99) as the number of concurrent users grows.
+
+Feeds synthetic updates through an update processor the same way PTB's
+update fetcher does, with simulated handlers: most take ~2 ms, a few
+(history-style queries) take 100 ms. Compares PTB's default sequential
+processing with UserOrderedUpdateProcessor, checks every user's updates ran
+in order, and shows a flooding user being throttled.
+
+Usage: python benchmarks/bench_dispatch.py [workers]
+"""
+import asyncio
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram import Update
+from telegram.ext import SimpleUpdateProcessor
+
+from dispatch import UserOrderedUpdateProcessor
+from fake_bot_api import make_update
+
+FAST = 0.002
+SLOW = 0.100
+SLOW_SHARE = 0.03
+DURATION = 5.0        # seconds of traffic per run
+USER_RATE = 1.0       # updates per second sent by each user
+
+
+def arrivals(users, flood=0):
+    """(offset, user_id) pairs: Poisson traffic per user, plus an optional flooder"""
+    events = []
+    for user_id in range(1, users + 1):
+        t = random.expovariate(USER_RATE)
+        while t < DURATION:
+            events.append((t, user_id))
+            t += random.expovariate(USER_RATE)
+    events += [(random.random() * 0.5, users + 1) for _ in range(flood)]
+    events.sort()
+    return events
+
+
+async def replay(processor, events):
+    queue = asyncio.Queue()
+    order = {}
+    latencies = []
+
+    async def handler(update, arrived, service):
+        await asyncio.sleep(service)
+        latencies.append(time.perf_counter() - arrived)
+        order.setdefault(update.effective_user.id, []).append(update.update_id)
+
+    async def producer():
+        started = time.perf_counter()
+        for update_id, (offset, user_id) in enumerate(events, 1):
+            delay = started + offset - time.perf_counter()
+            if delay > 0.001:
+                await asyncio.sleep(delay)
+            update = Update.de_json(make_update(update_id, user_id, "/history"), None)
+            await queue.put((update, time.perf_counter()))
+        await queue.put(None)
+
+    async def fetcher():
+        # Mirrors Application's update fetcher
+        tasks = []
+        while (item := await queue.get()) is not None:
+            update, arrived = item
+            service = SLOW if random.random() < SLOW_SHARE else FAST
+            coroutine = handler(update, arrived, service)
+            if processor.max_concurrent_updates > 1:
+                tasks.append(asyncio.create_task(processor.process_update(update, coroutine)))
+            else:
+                await processor.process_update(update, coroutine)
+        await asyncio.gather(*tasks)
+
+    await asyncio.gather(producer(), fetcher())
+    in_order = all(ids == sorted(ids) for ids in order.values())
+    latencies.sort()
+    p50 = latencies[len(latencies) // 2] * 1000
+    p99 = latencies[int(len(latencies) * 0.99) - 1] * 1000
+    return p50, p99, in_order
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+
+    print(f"{'users':>6} {'processor':<22}{'p50 ms':>9}{'p99 ms':>9}  in order")
+    for users in (1, 10, 100, 250, 500):
+        events = arrivals(users)
+        for name, processor in (
+            ("sequential (default)", SimpleUpdateProcessor(1)),
+            (f"user-ordered x{workers}", UserOrderedUpdateProcessor(workers)),
+        ):
+            p50, p99, in_order = asyncio.run(replay(processor, events))
+            print(f"{users:>6} {name:<22}{p50:9.1f}{p99:9.1f}  {in_order}")
+
+    processor = UserOrderedUpdateProcessor(workers)
+    p50, p99, in_order = asyncio.run(replay(processor, arrivals(100, flood=2000)))
+    print("\nflood of 2000 updates from one user next to 100 normal users:")
+    print(f"p50 {p50:.1f} ms, p99 {p99:.1f} ms, dropped {processor.dropped}, in order {in_order}")
+
+
+if __name__ == "__main__":
+    main()
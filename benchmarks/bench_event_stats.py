@@ -0,0 +1,188 @@
+"""Admin /stats (analytics.py) over 10M synthetic task events.
+
+Fills a fresh sharded database with events spread over the last DAYS days:
+tasks created, completed some minutes to weeks later, edited, reopened,
+deleted. Then it builds the /stats summary twice, with the vectorized
+NumPy path and row by row, and reports for each the time taken, split into
+reading the events and aggregating them, the events per second and the
+longest event-loop stall meanwhile. A third run summarizes the shards in
+worker processes (jobs.JobPool), as the bot's /stats does. Also reports
+the space the log takes per event.
+
+Checks that:
+
+- both paths, and the worker processes, give the same summary
+- the totals match SQL counts over the table
+- the vectorized aggregation is at least MIN_SPEEDUP times faster (reading
+  the rows out of SQLite costs both paths the same)
+
+Without NumPy installed only the row path runs. Exits non-zero if a check
+fails.
+
+Usage: python benchmarks/bench_event_stats.py [events] [--users N] [--shards N]
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import analytics
+import events
+import reports
+from jobs import JobPool
+from migrations import migrate
+from storage import close_pool, init_pool, shard_index
+
+DAYS = 30
+BASE_ID = 100_000_000
+MIN_SPEEDUP = 5
+# Users creating a fifth of the tasks; the rest are spread over everyone
+HEAVY_USERS = 100
+# Share of the events of each kind after the one creating the task
+FOLLOW_UPS = ((events.COMPLETED, 0.5), (events.EDITED, 0.15), (events.DUE_SET, 0.1),
+              (events.REOPENED, 0.05), (events.DELETED, 0.2))
+
+
+def synthetic_events(count, users, now, seed=7):
+    """(at, user_id, task_id, kind, created_at) rows in time order, about half of them task creations"""
+    rng = random.Random(seed)
+    start = now - DAYS * 86400 + 1
+    step = (now - start) / count
+    kinds, weights = zip(*FOLLOW_UPS)
+    open_tasks = []
+    for index in range(count):
+        at = int(start + index * step)
+        if open_tasks and rng.random() < 0.5:
+            task_id, user_id, created_at = open_tasks[rng.randrange(len(open_tasks))]
+            kind = rng.choices(kinds, weights)[0]
+            # Completions come minutes to weeks later: pretend the task is that old
+            if kind == events.COMPLETED:
+                created_at = at - int(rng.lognormvariate(10, 1.5))
+            yield at, user_id, task_id, kind, created_at
+        else:
+            # A few very active users, a long tail of occasional ones
+            user_id = BASE_ID + (rng.randrange(HEAVY_USERS) if rng.random() < 0.2 else rng.randrange(users))
+            open_tasks.append((index, user_id, at))
+            if len(open_tasks) > 100_000:
+                open_tasks = open_tasks[50_000:]
+            yield at, user_id, index, events.CREATED, at
+
+
+def fill(conn, rows):
+    conn.executemany(
+        "INSERT INTO task_events (at, user_id, task_id, kind, created_at) VALUES (?, ?, ?, ?, ?)", rows
+    )
+
+
+def sql_totals(conn, since):
+    kinds = dict(conn.execute("SELECT kind, count(*) FROM task_events WHERE at >= ? GROUP BY kind", (since,)))
+    users = conn.execute("SELECT count(DISTINCT user_id) FROM task_events WHERE at >= ?", (since,)).fetchone()[0]
+    size = conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0]
+    return kinds, users, size
+
+
+async def timed_summary(now, vectorized, workers=0):
+    """(summary, seconds, longest event-loop stall in seconds)"""
+    stalls = []
+
+    async def ticker():
+        while True:
+            before = time.perf_counter()
+            await asyncio.sleep(0.01)
+            stalls.append(time.perf_counter() - before - 0.01)
+
+    jobs = JobPool(workers, threshold=0) if workers else None
+    if jobs is not None:
+        # Start the worker processes before timing
+        await jobs.run(reports.format_duration, 1, size=1)
+    probe = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    summary = await analytics.summarize(DAYS, now=now, vectorized=vectorized, jobs=jobs)
+    elapsed = time.perf_counter() - started
+    probe.cancel()
+    if jobs is not None:
+        await jobs.shutdown()
+    return summary, elapsed, max(stalls, default=0.0)
+
+
+def check(failures, ok, message):
+    print(f"{'ok  ' if ok else 'FAIL'} {message}")
+    if not ok:
+        failures.append(message)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("events", type=int, nargs="?", default=10_000_000)
+    parser.add_argument("--users", type=int, default=100_000)
+    parser.add_argument("--shards", type=int, default=2)
+    parser.add_argument("--workers", type=int, default=2, help="worker processes for the third run, 0 to skip it")
+    args = parser.parse_args()
+
+    now = int(time.time())
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = init_pool(os.path.join(tmp, "events.db"), readers=2, shards=args.shards)
+        try:
+            pool.run_write_all(migrate)
+            started = time.perf_counter()
+            batches = [[] for _ in range(args.shards)]
+            for row in synthetic_events(args.events, args.users, now):
+                batch = batches[shard_index(row[1], args.shards)]
+                batch.append(row)
+                if len(batch) >= 100_000:
+                    pool.shards[shard_index(row[1], args.shards)].run_write(fill, batch)
+                    batch.clear()
+            for shard, batch in enumerate(batches):
+                pool.shards[shard].run_write(fill, batch)
+            print(f"{args.events:,} events of {args.users:,} users over {args.shards} shards "
+                  f"written in {time.perf_counter() - started:.1f}s")
+
+            since = (now // analytics.DAY - DAYS + 1) * analytics.DAY
+            kinds, users, size = {}, 0, 0
+            for shard in pool.shards:
+                shard_kinds, shard_users, shard_size = shard.run_read(sql_totals, since)
+                for kind, count in shard_kinds.items():
+                    kinds[kind] = kinds.get(kind, 0) + count
+                users += shard_users
+                size += shard_size
+            print(f"{size / args.events:.1f} bytes per event on disk\n")
+
+            paths = ([True] if analytics.np is not None else []) + [False]
+            if analytics.np is None:
+                print("NumPy is not installed: only the row-by-row path runs\n")
+            results = {}
+            runs = [(vectorized, 0) for vectorized in paths] + ([(paths[0], args.workers)] if args.workers else [])
+            for vectorized, workers in runs:
+                summary, elapsed, stall = asyncio.run(timed_summary(now, vectorized, workers))
+                results[vectorized, workers] = (summary, elapsed)
+                name = f"{workers} workers" if workers else "vectorized" if vectorized else "row by row"
+                print(f"{name:<11} {elapsed:>6.2f}s "
+                      f"(read {summary.read_seconds:.2f}s, aggregate {summary.aggregate_seconds:.2f}s)  "
+                      f"{summary.events / elapsed:>10,.0f} events/s  longest loop stall {stall * 1000:.0f} ms")
+        finally:
+            close_pool()
+
+    summary = results[paths[0], 0][0]
+    print("\n" + reports.render_event_stats(summary, events.KINDS, analytics.TASK_COUNT_LABELS))
+    check(failures, summary.kinds[1:] == [kinds.get(kind, 0) for kind in range(1, len(summary.kinds))]
+          and summary.users == users, f"totals match SQL counts ({summary.events:,} events, {users:,} users)")
+    if args.workers:
+        check(failures, results[paths[0], args.workers][0] == summary,
+              f"{args.workers} worker processes give the same summary")
+    if len(paths) == 2:
+        fast, slow = results[True, 0][0], results[False, 0][0]
+        check(failures, fast == slow, "the vectorized and row-by-row summaries are the same")
+        speedup = slow.aggregate_seconds / fast.aggregate_seconds
+        check(failures, speedup >= MIN_SPEEDUP,
+              f"vectorized aggregation is {speedup:.1f}x faster (at least {MIN_SPEEDUP}x)")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
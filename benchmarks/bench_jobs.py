@@ -0,0 +1,81 @@
+"""Event-loop lag while a heavy report is rendered, inline vs in jobs.JobPool.
+
+A ticker coroutine wakes every TICK seconds and records how late it woke,
+which is the delay every other update would see. Meanwhile a history
+report over many rows is rendered, once on the loop and once through a
+worker process. Also shows why small jobs stay inline: the round trip to
+a worker costs more than rendering a 30-row /history.
+
+Usage: python benchmarks/bench_jobs.py [rows]
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import reports
+from jobs import JobPool
+
+TICK = 0.005
+
+
+def history_rows(count):
+    return [(f"2024-{i % 12 + 1:02d}-{i % 28 + 1:02d}#{i}", 10 + i % 7, i % 10) for i in range(count)]
+
+
+async def measure(pool, rows):
+    lags = []
+    done = asyncio.Event()
+
+    async def ticker():
+        while not done.is_set():
+            expected = time.perf_counter() + TICK
+            await asyncio.sleep(TICK)
+            lags.append(max(0.0, time.perf_counter() - expected))
+
+    task = asyncio.create_task(ticker())
+    await asyncio.sleep(0.05)
+    started = time.perf_counter()
+    await pool.run(reports.render_history, "Bench", 366, rows, size=len(rows))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await task
+    lags.sort()
+    return elapsed, lags[int(len(lags) * 0.99) - 1] if len(lags) > 1 else lags[-1], lags[-1]
+
+
+async def round_trip(pool, rows, repeat=200):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        await pool.run(reports.render_history, "Bench", 30, rows, size=len(rows))
+    return (time.perf_counter() - started) / repeat * 1000
+
+
+async def run(count):
+    rows = history_rows(count)
+    inline = JobPool(workers=0)
+    offloaded = JobPool(workers=2, threshold=0)
+    # Start the worker processes before timing
+    await offloaded.run(reports.render_history, "Bench", 1, rows[:1], size=1)
+
+    print(f"history report over {count} rows, ticker every {TICK * 1000:.0f} ms:")
+    print(f"{'':<10}{'job ms':>9}{'lag p99 ms':>12}{'lag max ms':>12}")
+    for name, pool in (("inline", inline), ("process", offloaded)):
+        elapsed, p99, worst = await measure(pool, rows)
+        print(f"{name:<10}{elapsed * 1000:9.0f}{p99 * 1000:12.1f}{worst * 1000:12.1f}")
+
+    small = rows[:30]
+    print(f"\n30-row /history: {await round_trip(inline, small):.3f} ms inline, "
+          f"{await round_trip(offloaded, small):.3f} ms through a worker")
+    await offloaded.shutdown()
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300_000
+    asyncio.run(run(count))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""Query latency on a synthetic 1M-task database before and after migrations.
+
+Builds a database at schema version 2 (the original tables, no indexes,
+string timestamps), times the task-list and history queries, applies the
+remaining migrations and times them again.
+
+Usage: python benchmarks/bench_migrations.py [tasks] [users]
+"""
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import migrate
+
+QUERIES = 200
+
+# The queries as they looked before the epoch migration ...
+BEFORE = {
+    "get_user_tasks": "SELECT id, task, status, created_at FROM tasks WHERE user_id = ? ORDER BY created_at DESC",
+    "get_task_history": """
+        SELECT date(created_at) as day, count(*),
+               sum(case when status = 'completed' then 1 else 0 end)
+        FROM tasks WHERE user_id = ? AND created_at >= date('now', '-30 day')
+        GROUP BY date(created_at) ORDER BY day""",
+}
+# ... and after it
+AFTER = {
+    "get_user_tasks": BEFORE["get_user_tasks"],
+    "get_task_history": """
+        SELECT date(created_at, 'unixepoch', 'localtime') as day, count(*),
+               sum(case when status = 'completed' then 1 else 0 end)
+        FROM tasks WHERE user_id = ?
+          AND created_at >= CAST(strftime('%s', 'now', 'localtime', 'start of day', '-30 day', 'utc') AS INTEGER)
+        GROUP BY day ORDER BY day""",
+}
+
+
+def build(path, tasks, users):
+    conn = sqlite3.connect(path)
+    migrate(conn, target=2)
+    now = time.time()
+
+    def rows():
+        for i in range(tasks):
+            created = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now - random.random() * 90 * 86400))
+            yield (str(random.randrange(users)), f"task {i}", created, created,
+                   "completed" if random.random() < 0.4 else "pending")
+
+    conn.executemany(
+        "INSERT INTO tasks (user_id, task, created_at, updated_at, status) VALUES (?, ?, ?, ?, ?)", rows())
+    conn.commit()
+    return conn
+
+
+def measure(conn, queries, users):
+    results = {}
+    for name, sql in queries.items():
+        timings = []
+        for _ in range(QUERIES):
+            user_id = str(random.randrange(users))
+            start = time.perf_counter()
+            conn.execute(sql, (user_id,)).fetchall()
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        results[name] = (statistics.median(timings), timings[int(len(timings) * 0.99) - 1])
+    return results
+
+
+def main():
+    tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 10_000
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"building {tasks} tasks for {users} users ...")
+        conn = build(os.path.join(tmp, "bench.db"), tasks, users)
+        before = measure(conn, BEFORE, users)
+
+        start = time.perf_counter()
+        migrate(conn)
+        print(f"migrations applied in {time.perf_counter() - start:.1f}s")
+        after = measure(conn, AFTER, users)
+        conn.close()
+
+    print(f"{'query':<18}{'before p50':>12}{'p99':>10}{'after p50':>12}{'p99':>10}  (ms)")
+    for name in BEFORE:
+        print(f"{name:<18}{before[name][0]:12.2f}{before[name][1]:10.2f}{after[name][0]:12.2f}{after[name][1]:10.2f}")
+
+
+if __name__ == "__main__":
+    main()
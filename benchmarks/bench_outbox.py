@@ -0,0 +1,90 @@
+"""Outbox rate limiter against a local fake Bot API.
+
+Sends a burst of low-priority reminders and, while it drains, interactive
+replies, through a real ExtBot using OutboxRateLimiter. The fake API answers
+some requests with 429. Reports delivery, retries, the highest send rate
+seen overall and per chat, and latency per priority.
+
+Limits are scaled up (100 msg/s overall, 5 msg/s per chat) to keep the run
+short; the shape is the same as with Telegram's real limits.
+
+Usage: python benchmarks/bench_outbox.py [reminders] [interactive]
+"""
+import asyncio
+import collections
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from telegram.ext import ExtBot
+
+from fake_bot_api import FakeBotAPI
+from outbox import OutboxRateLimiter, PRIORITY_INTERACTIVE, PRIORITY_REMINDER
+
+GLOBAL_RATE = 100.0
+CHAT_RATE = 5.0
+CHATS = 200
+
+
+def max_rate(timestamps, window=1.0):
+    timestamps = sorted(timestamps)
+    best, start = 0, 0
+    for end, ts in enumerate(timestamps):
+        while ts - timestamps[start] > window:
+            start += 1
+        best = max(best, end - start + 1)
+    return best / window
+
+
+async def run(reminders, interactive):
+    api = FakeBotAPI(port=8082, flood_every=400, retry_after=1)
+    await api.start()
+    limiter = OutboxRateLimiter(global_rate=GLOBAL_RATE, private_rate=CHAT_RATE, group_rate=CHAT_RATE)
+    bot = ExtBot("123:fake", base_url=api.base_url, rate_limiter=limiter)
+    latencies = collections.defaultdict(list)
+
+    async def send(chat_id, priority):
+        started = time.perf_counter()
+        await bot.send_message(chat_id=chat_id, text="x", rate_limit_args=priority)
+        latencies[priority].append(time.perf_counter() - started)
+
+    async with bot:
+        started = time.perf_counter()
+        burst = [asyncio.create_task(send(random.randrange(CHATS) + 1, PRIORITY_REMINDER))
+                 for _ in range(reminders)]
+        replies = []
+        for _ in range(interactive):
+            await asyncio.sleep(reminders / GLOBAL_RATE / interactive / 2)
+            replies.append(asyncio.create_task(send(CHATS + random.randrange(CHATS) + 1, PRIORITY_INTERACTIVE)))
+        await asyncio.gather(*burst, *replies)
+        elapsed = time.perf_counter() - started
+        stats = limiter.stats()
+    await api.stop()
+
+    per_chat = collections.defaultdict(list)
+    for ts, chat_id, _ in api.sent:
+        per_chat[chat_id].append(ts)
+
+    print(f"delivered    : {len(api.sent)}/{reminders + interactive} in {elapsed:.1f}s, "
+          f"{api.floods} x 429 answered")
+    print(f"outbox stats : {stats}")
+    print(f"max rate     : {max_rate([ts for ts, _, _ in api.sent]):.0f}/s overall "
+          f"(limit {GLOBAL_RATE:.0f}), {max(max_rate(t) for t in per_chat.values()):.0f}/s "
+          f"per chat (limit {CHAT_RATE:.0f} + burst)")
+    for priority, name in ((PRIORITY_INTERACTIVE, "interactive"), (PRIORITY_REMINDER, "reminder")):
+        values = sorted(latencies[priority])
+        print(f"{name:<13}: p50 {values[len(values) // 2] * 1000:7.0f} ms, "
+              f"p99 {values[int(len(values) * 0.99) - 1] * 1000:7.0f} ms")
+
+
+def main():
+    reminders = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    interactive = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    asyncio.run(run(reminders, interactive))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Load test for the reminder scheduler with many pending reminders.
+
+Stores N reminders due over the next few seconds in a temp database (built
+by migrations.py, like the bot's), starts the scheduler against it with a
+fake send, and reports scheduler memory, firing throughput and lateness.
+
+Usage: python benchmarks/bench_reminders.py [reminders] [spread_seconds]
+"""
+import asyncio
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from migrations import migrate
+from scheduler import ReminderScheduler
+from storage import init_pool, close_pool
+
+
+def add_reminders(conn, n, spread):
+    now = time.time()
+    start = now + 1
+    conn.executemany(
+        "INSERT INTO reminders (user_id, chat_id, reminder_text, reminder_time, created_at, due_at) "
+        "VALUES (?, ?, ?, 0, ?, ?)",
+        ((str(i % 5000), str(i % 5000), f"reminder number {i}", int(now), int(start + random.random() * spread))
+         for i in range(n)),
+    )
+
+
+async def run(n):
+    lateness = []
+    done = asyncio.Event()
+    sent = 0
+
+    async def send(chat_id, text):
+        nonlocal sent
+        sent += 1
+        if sent == n:
+            done.set()
+
+    scheduler = ReminderScheduler()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    await scheduler.start(send)
+    pending_bytes = tracemalloc.get_traced_memory()[0] - before
+    print(f"pending      : {len(scheduler)} reminders")
+    print(f"start memory : {pending_bytes / 1024 / 1024:.1f} MiB ({pending_bytes / max(n, 1):.0f} B/reminder)")
+
+    # Sample lateness while the scheduler drains the due reminders: how long
+    # ago the earliest one still pending was due
+    async def sample():
+        while not done.is_set():
+            due_at = scheduler.next_due
+            if due_at is not None:
+                lateness.append(max(0.0, time.time() - due_at))
+            await asyncio.sleep(0.05)
+
+    started = time.perf_counter()
+    sampler = asyncio.create_task(sample())
+    await done.wait()
+    elapsed = time.perf_counter() - started
+    await sampler
+    peak = tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    await scheduler.stop()
+
+    print(f"fired        : {scheduler.fired} in {elapsed:.1f}s")
+    print(f"peak memory  : {peak / 1024 / 1024:.1f} MiB")
+    if lateness:
+        lateness.sort()
+        print(f"lateness p50 : {lateness[len(lateness) // 2] * 1000:.0f} ms, "
+              f"max {lateness[-1] * 1000:.0f} ms")
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    spread = float(sys.argv[2]) if len(sys.argv) > 2 else 5.0
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "reminders.db")
+        pool = init_pool(db_file)
+        try:
+            pool.run_write_all(migrate)
+            pool.shards[0].run_write(add_reminders, n, spread)
+            asyncio.run(run(n))
+            remaining = sqlite3.connect(db_file).execute(
+                "SELECT count(*) FROM reminders WHERE completed = 0").fetchone()[0]
+            print(f"not completed: {remaining}")
+        finally:
+            close_pool()
+
+
+if __name__ == "__main__":
+    main()
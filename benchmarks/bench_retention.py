@@ -0,0 +1,159 @@
+"""One maintenance pass (retention.py) over a bloated database, under write load.
+
+Fills a fresh database with tasks, most of them completed months ago, and
+reminders that fired long ago. Then it runs MaintenanceJob.run_once() while
+a stream of add_task writes keeps going, and reports:
+
+- what was archived and purged, and the space reclaimed
+- the latency of those writes, against the same stream with no maintenance
+  running (how much the job stalls the bot)
+
+It also checks that:
+
+- nothing old is left in `tasks`
+- the archive holds what moved
+- the /history rollup is unchanged
+- fewer free pages than one incremental_vacuum call are left in the file
+  (the writes running alongside may free a few after the last call)
+
+Exits non-zero if a check fails.
+
+Usage: python benchmarks/bench_retention.py [tasks]
+"""
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import retention
+import stats
+from migrations import migrate
+from storage import close_pool, get_pool, init_pool
+
+USERS = 1000
+OLD = 120 * 86400
+# Writes per second of the background load
+WRITE_RATE = 200
+
+
+def fill(conn, tasks):
+    now = int(time.time())
+    conn.executemany(
+        "INSERT INTO tasks (user_id, task, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+        ((str(i % USERS), f"task number {i} with some words to take up space",
+          "completed" if i % 10 < 7 else "pending", now - OLD - i % 86400, now - OLD)
+         for i in range(tasks))
+    )
+    conn.executemany(
+        "INSERT INTO reminders (user_id, reminder_text, reminder_time, created_at, due_at, completed) "
+        "VALUES (?, ?, ?, ?, ?, 1)",
+        ((str(i % USERS), f"reminder {i}", 5, now - OLD, now - OLD + 300) for i in range(tasks // 2))
+    )
+    stats.backfill(conn)
+
+
+def add_task(conn, user_id, text):
+    now = int(time.time())
+    conn.execute(
+        "INSERT INTO tasks (user_id, task, created_at, updated_at) VALUES (?, ?, ?, ?)",
+        (user_id, text, now, now)
+    )
+    stats.bump(conn, user_id, now, created=1)
+
+
+def counts(conn):
+    return {
+        "old completed": conn.execute(
+            "SELECT count(*) FROM tasks WHERE status = 'completed' AND updated_at < ?",
+            (int(time.time()) - retention.ARCHIVE_AFTER,)
+        ).fetchone()[0],
+        "tasks": conn.execute("SELECT count(*) FROM tasks").fetchone()[0],
+        "archived": conn.execute("SELECT count(*) FROM tasks_archive").fetchone()[0],
+        "reminders": conn.execute("SELECT count(*) FROM reminders").fetchone()[0],
+        "rollup": conn.execute(
+            "SELECT sum(created_count), sum(completed_count) FROM user_daily_stats"
+        ).fetchone(),
+        "free pages": conn.execute("PRAGMA freelist_count").fetchone()[0],
+        "bytes": conn.execute("PRAGMA page_count").fetchone()[0] * conn.execute("PRAGMA page_size").fetchone()[0],
+    }
+
+
+async def write_load(done):
+    """add_task latencies at WRITE_RATE per second until done is set"""
+    latencies = []
+    index = 0
+    while not done.is_set():
+        started = time.perf_counter()
+        await get_pool().write(add_task, str(index % USERS), f"new task {index}")
+        latencies.append(time.perf_counter() - started)
+        index += 1
+        await asyncio.sleep(max(0.0, 1 / WRITE_RATE - (time.perf_counter() - started)))
+    return latencies
+
+
+async def measure(job=None, seconds=3.0):
+    done = asyncio.Event()
+    load = asyncio.create_task(write_load(done))
+    report = None
+    if job is not None:
+        report = await job.run_once()
+    else:
+        await asyncio.sleep(seconds)
+    done.set()
+    latencies = sorted(await load)
+    pick = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))] * 1000
+    return report, (len(latencies), pick(0.5), pick(0.99), latencies[-1] * 1000)
+
+
+def check(failures, ok, message):
+    print(f"{'ok  ' if ok else 'FAIL'} {message}")
+    if not ok:
+        failures.append(message)
+
+
+def main():
+    tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    failures = []
+    with tempfile.TemporaryDirectory() as tmp:
+        db_file = os.path.join(tmp, "retention.db")
+        init_pool(db_file, readers=1)
+        # A single shard: run the setup on its ConnectionPool directly
+        pool = get_pool().shards[0]
+        pool.run_write(migrate)
+        pool.run_write(fill, tasks)
+        before = pool.run_read(counts)
+        print(f"{before['tasks']} tasks ({before['old completed']} completed > 90 days ago), "
+              f"{before['reminders']} fired reminders, {before['bytes'] / 2 ** 20:.1f} MiB")
+
+        _, idle = asyncio.run(measure())
+        report, busy = asyncio.run(measure(retention.MaintenanceJob(interval=0)))
+        after = pool.run_read(counts)
+        close_pool()
+
+    print(f"archived {report['archived']} tasks, purged {report['purged']} reminders, "
+          f"reclaimed {report['reclaimed_bytes'] / 2 ** 20:.1f} MiB in {report['seconds']:.1f}s; "
+          f"database {before['bytes'] / 2 ** 20:.1f} -> {after['bytes'] / 2 ** 20:.1f} MiB "
+          f"(the archived rows stay in it)")
+    print(f"\nadd_task at {WRITE_RATE}/s  {'writes':>7}{'p50 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for name, (count, p50, p99, worst) in (("idle", idle), ("maintenance", busy)):
+        print(f"{name:<19}{count:>7}{p50:>9.2f}{p99:>9.2f}{worst:>9.2f}")
+    print()
+
+    check(failures, after["old completed"] == 0, "no old completed tasks left in tasks")
+    check(failures, after["archived"] == before["old completed"], "every old completed task is in tasks_archive")
+    check(failures, after["reminders"] == 0, "fired reminders past retention are purged")
+    added = after["tasks"] + after["archived"] - before["tasks"]
+    check(failures, tuple(after["rollup"]) == (before["rollup"][0] + added, before["rollup"][1]),
+          "/history rollup still counts archived tasks")
+    # Not exactly 0: the concurrent writes can free pages after the last
+    # incremental_vacuum call, and the job stops once a call makes no headway
+    check(failures, after["free pages"] < retention.VACUUM_PAGES and after["bytes"] < before["bytes"],
+          f"free pages handed back to the file system ({after['free pages']} left)")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
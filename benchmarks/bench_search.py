@@ -0,0 +1,108 @@
+"""/search latency: FTS5 index vs a LIKE scan, on a synthetic 1M-task database.
+
+Most users have ~100 tasks; a few power users have 50k each (or together
+half the tasks, on a smaller database). LIKE has the
+(user_id, created_at) index to narrow rows to one user but then has to scan
+every task text of that user; FTS5 only walks matching posting lists and
+the newest matches are ranked in Python.
+
+Usage: python benchmarks/bench_search.py [tasks]
+"""
+import os
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import search
+from migrations import migrate
+from storage import close_pool, init_pool
+
+WORDS = ("buy call email write read fix clean book pay plan review send check order cook "
+         "groceries report invoice dentist meeting taxes laundry garden car flight hotel "
+         "birthday gift homework project slides budget doctor gym rent insurance").split()
+POWER_USERS = 5
+POWER_TASKS = 50_000
+QUERIES = 100
+
+LIKE_SQL = """
+    SELECT id, task, status FROM tasks
+    WHERE user_id = ? AND {} ORDER BY created_at DESC LIMIT ?
+"""
+
+
+def build(path, tasks, power_tasks):
+    conn = sqlite3.connect(path)
+    migrate(conn)
+    users = max(1, (tasks - POWER_USERS * power_tasks) // 100)
+    now = int(time.time())
+
+    def rows():
+        for i in range(tasks):
+            if i < POWER_USERS * power_tasks:
+                user_id = f"p{i % POWER_USERS}"
+            else:
+                user_id = str(random.randrange(users))
+            text = " ".join(random.sample(WORDS, 4)) + f" {i}"
+            yield user_id, text, now - i, now - i
+
+    # The triggers keep tasks_fts in sync as rows go in
+    conn.executemany("INSERT INTO tasks (user_id, task, created_at, updated_at) VALUES (?, ?, ?, ?)", rows())
+    conn.commit()
+    return conn, users
+
+
+def timed(fn, cases):
+    timings = []
+    for args in cases:
+        start = time.perf_counter()
+        fn(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.99) - 1]
+
+
+def main():
+    tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 1_000_000
+    if tasks < 2 * POWER_USERS:
+        sys.exit(f"Need at least {2 * POWER_USERS} tasks")
+    # Leave regular users at least half the tasks on a small database
+    power_tasks = min(POWER_TASKS, tasks // (2 * POWER_USERS))
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"building {tasks} tasks ...")
+        started = time.perf_counter()
+        path = os.path.join(tmp, "bench.db")
+        conn, users = build(path, tasks, power_tasks)
+        init_pool(path, readers=1)
+        print(f"built in {time.perf_counter() - started:.0f}s")
+
+        def like(user_id, text):
+            words = text.split()
+            sql = LIKE_SQL.format(" AND ".join(["task LIKE ?"] * len(words)))
+            conn.execute(sql, (user_id, *(f"%{word}%" for word in words), search.PAGE_SIZE + 1)).fetchall()
+
+        def fts(user_id, text):
+            search.search_tasks.sync(user_id, text)
+
+        print(f"{'user kind':<14}{'query':<10}{'LIKE p50':>10}{'p99':>9}{'FTS p50':>10}{'p99':>9}  (ms)")
+        for kind, pick in (("normal", lambda: str(random.randrange(users))),
+                           (f"power ({power_tasks})", lambda: f"p{random.randrange(POWER_USERS)}")):
+            for label, word in (("word", lambda: random.choice(WORDS)),
+                                ("prefix", lambda: random.choice(WORDS)[:3]),
+                                ("two words", lambda: " ".join(random.sample(WORDS, 2))),
+                                ("no match", lambda: "zebra"),
+                                ("partial", lambda: random.choice(WORDS)[:5])):
+                cases = [(pick(), word()) for _ in range(QUERIES)]
+                like_p50, like_p99 = timed(like, cases)
+                fts_p50, fts_p99 = timed(fts, cases)
+                print(f"{kind:<14}{label:<10}{like_p50:10.2f}{like_p99:9.2f}{fts_p50:10.2f}{fts_p99:9.2f}")
+        conn.close()
+        close_pool()
+
+
+if __name__ == "__main__":
+    main()
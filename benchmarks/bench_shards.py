@@ -0,0 +1,128 @@
+"""Write throughput vs the number of database shards.
+
+Many users add tasks at once, each write being the same transaction as
+botfinal's add_task (task row, search index trigger, stats rollup upsert).
+With one shard every write queues for the single writer thread; with N
+shards users are spread over N files, each with its own writer.
+
+By default commits are as durable as the bot's (WAL, synchronous=NORMAL,
+so mostly CPU bound); --full also fsyncs every commit (synchronous=FULL),
+where the shards' fsyncs overlap.
+
+Within one process the GIL caps what extra writers can add, so the second
+table runs N worker processes at once: all on one database file (their
+writes serialize on its lock, with busy retries) vs one shard each.
+
+Usage: python benchmarks/bench_shards.py [writes] [--full]
+"""
+import asyncio
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stats
+from migrations import migrate
+from storage import ShardedPool
+
+USERS = 1000
+CONCURRENCY = 256
+SHARD_COUNTS = (1, 2, 4, 8)
+
+
+def add_task(conn, user_id, task_text):
+    # Same statements as botfinal._add_task
+    now = int(time.time())
+    conn.execute(
+        "INSERT INTO tasks (user_id, task, created_at, updated_at) VALUES (?, ?, ?, ?)",
+        (user_id, task_text, now, now)
+    )
+    stats.bump(conn, user_id, now, created=1)
+
+
+def synchronous_full(conn):
+    conn.execute("PRAGMA synchronous=FULL")
+
+
+async def run(pool, writes):
+    queue = asyncio.Queue()
+    for i in range(writes):
+        queue.put_nowait((str(i % USERS), f"write report {i}"))
+
+    async def worker():
+        while not queue.empty():
+            user_id, text = queue.get_nowait()
+            await pool.write(add_task, user_id, text)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    return writes / (time.perf_counter() - started)
+
+
+def process_writer(db_file, user_ids, writes, full):
+    pool = ShardedPool(db_file, shards=1, readers=1)
+    if full:
+        pool.run_write_all(synchronous_full)
+    for i in range(writes):
+        pool.run_write(add_task, user_ids[i % len(user_ids)], f"write report {i}")
+    pool.close()
+
+
+def run_processes(tmp, processes, writes, full, sharded):
+    """Aggregate writes/s of processes writing to one shared file or one shard each"""
+    files = [os.path.join(tmp, f"bench-{index}.db" if sharded else "bench.db") for index in range(processes)]
+    for path in set(files):
+        pool = ShardedPool(path, readers=1)
+        pool.run_write_all(migrate)
+        pool.close()
+    workers = [
+        multiprocessing.Process(
+            target=process_writer,
+            args=(path, [str(user) for user in range(index, USERS, processes)], writes // processes, full),
+        )
+        for index, path in enumerate(files)
+    ]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return writes / (time.perf_counter() - started)
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    writes = int(args[0]) if args else 20000
+    full = "--full" in sys.argv
+    if full:
+        writes //= 10
+
+    print(f"{writes} add_task writes from {USERS} users, {CONCURRENCY} at a time, "
+          f"synchronous={'FULL' if full else 'NORMAL'}")
+    print(f"{'shards':>6}{'writes/s':>11}{'speedup':>9}")
+    baseline = None
+    for shards in SHARD_COUNTS:
+        with tempfile.TemporaryDirectory() as tmp:
+            pool = ShardedPool(os.path.join(tmp, "bench.db"), shards=shards, readers=1)
+            pool.run_write_all(migrate)
+            if full:
+                pool.run_write_all(synchronous_full)
+            rate = asyncio.run(run(pool, writes))
+            pool.close()
+        baseline = baseline or rate
+        print(f"{shards:>6}{rate:>11.0f}{rate / baseline:>8.2f}x")
+
+    print(f"\n{'processes':>9}{'one file/s':>12}{'sharded/s':>11}  ({os.cpu_count()} CPUs)")
+    for processes in SHARD_COUNTS:
+        with tempfile.TemporaryDirectory() as tmp:
+            shared = run_processes(tmp, processes, writes, full, sharded=False)
+        with tempfile.TemporaryDirectory() as tmp:
+            sharded = run_processes(tmp, processes, writes, full, sharded=True)
+        print(f"{processes:>9}{shared:>12.0f}{sharded:>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
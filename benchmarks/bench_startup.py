@@ -0,0 +1,100 @@
+"""Cold-start time of the bot, against a budget.
+
+Every run is a fresh Python process in an empty directory, without
+BOT_TOKEN or file.env, timing:
+
+- import:  `import botfinal`; must succeed and must not create a database
+- init:    plus init_app() on a new database (creates and migrates it)
+- reopen:  plus init_app() on an already migrated database
+- ready:   plus build_application(), i.e. everything before polling starts
+
+Times are wall-clock seconds of the whole process, interpreter start
+included, as the median of several runs. Exits non-zero if a median is
+over its budget in BUDGETS or the import check fails.
+
+Usage: python benchmarks/bench_startup.py [runs]
+"""
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Seconds; generous enough for a slow CI machine, tight enough to catch
+# an import-time database open or a heavy new dependency
+BUDGETS = {"import": 0.6, "init": 0.8, "reopen": 0.8, "ready": 1.0}
+
+CHILD = """
+import json, os, sys, time
+sys.path.insert(0, {root!r})
+existed = os.path.exists("todo_bot.db")
+started = time.perf_counter()
+import botfinal
+from settings import Settings
+times = {{"import": time.perf_counter() - started}}
+created = os.path.exists("todo_bot.db") and not existed
+if {phase!r} != "import":
+    botfinal.init_app(Settings())
+    times["init_app"] = time.perf_counter() - started - times["import"]
+if {phase!r} == "ready":
+    botfinal.build_application(token="123:startup")
+    times["build"] = time.perf_counter() - started - times["import"] - times["init_app"]
+botfinal.close_pool()
+print(json.dumps({{"times": times, "created_db_on_import": created}}))
+"""
+
+
+def run(phase, directory):
+    env = {key: value for key, value in os.environ.items() if key != "BOT_TOKEN"}
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-c", CHILD.format(root=ROOT, phase=phase)],
+        cwd=directory, env=env, capture_output=True, text=True
+    )
+    elapsed = time.perf_counter() - started
+    if result.returncode:
+        raise SystemExit(f"{phase} run failed:\n{result.stderr}")
+    return elapsed, json.loads(result.stdout.splitlines()[-1])
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    failures = []
+    results = {}
+    for phase in BUDGETS:
+        walls, inner = [], []
+        for _ in range(runs):
+            with tempfile.TemporaryDirectory() as tmp:
+                if phase == "reopen":
+                    run("init", tmp)
+                elapsed, report = run("init" if phase == "reopen" else phase, tmp)
+                walls.append(elapsed)
+                inner.append(report["times"])
+                if report["created_db_on_import"]:
+                    failures.append(f"{phase}: importing botfinal created todo_bot.db")
+        results[phase] = (walls, inner)
+
+    print(f"{runs} cold starts each   {'median s':>9}{'max s':>8}{'budget':>8}   in-process medians")
+    for phase, (walls, inner) in results.items():
+        median = statistics.median(walls)
+        steps = "  ".join(
+            f"{step} {statistics.median(times[step] for times in inner) * 1000:.0f} ms" for step in inner[0]
+        )
+        print(f"{phase:<20}{median:>9.3f}{max(walls):>8.3f}{BUDGETS[phase]:>8.2f}   {steps}")
+        if median > BUDGETS[phase]:
+            failures.append(f"{phase}: median {median:.3f}s is over the {BUDGETS[phase]:.2f}s budget")
+
+    print()
+    for failure in failures:
+        print(f"FAIL {failure}")
+    print(f"{'ok  ' if not failures else 'FAIL'} importing botfinal needs no token and opens no database, "
+          f"every phase within budget")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
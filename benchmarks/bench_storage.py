@@ -0,0 +1,89 @@
+"""Compare task updates/sec: connect-per-call (old helpers) vs the storage pool.
+
+Usage: python benchmarks/bench_storage.py [updates]
+"""
+import asyncio
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage import ConnectionPool
+
+TASKS = 1000
+
+
+def create_db(path):
+    conn = sqlite3.connect(path)
+    conn.execute(
+        "CREATE TABLE tasks (id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, "
+        "task TEXT NOT NULL, created_at TIMESTAMP, updated_at TIMESTAMP, status TEXT DEFAULT 'pending')"
+    )
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.executemany(
+        "INSERT INTO tasks (user_id, task, created_at, updated_at) VALUES (?, ?, ?, ?)",
+        [(str(i % 50), f"task {i}", now, now) for i in range(TASKS)],
+    )
+    conn.commit()
+    conn.close()
+
+
+def update_per_call(db_file, task_id, status):
+    # Same shape as the original update_task_status helper
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    cursor.execute("UPDATE tasks SET status = ?, updated_at = ? WHERE id = ?", (status, now, task_id))
+    conn.commit()
+    conn.close()
+
+
+def update_pooled(conn, task_id, status):
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.execute("UPDATE tasks SET status = ?, updated_at = ? WHERE id = ?", (status, now, task_id))
+
+
+def bench_per_call(db_file, n):
+    start = time.perf_counter()
+    for i in range(n):
+        update_per_call(db_file, i % TASKS + 1, "completed" if i % 2 else "pending")
+    return n / (time.perf_counter() - start)
+
+
+async def bench_pooled(db_file, n, concurrency):
+    pool = ConnectionPool(db_file)
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(i):
+        async with sem:
+            await pool.write(update_pooled, i % TASKS + 1, "completed" if i % 2 else "pending")
+
+    await pool.write(update_pooled, 1, "pending")  # warm up the writer connection
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(n)))
+    rate = n / (time.perf_counter() - start)
+    pool.close()
+    return rate
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    with tempfile.TemporaryDirectory() as tmp:
+        per_call_db = os.path.join(tmp, "per_call.db")
+        pooled_db = os.path.join(tmp, "pooled.db")
+        create_db(per_call_db)
+        create_db(pooled_db)
+
+        print(f"{n} updates on {TASKS} tasks")
+        print(f"connect per call : {bench_per_call(per_call_db, n):10.0f} updates/sec")
+        for concurrency in (1, 16):
+            rate = asyncio.run(bench_pooled(pooled_db, n, concurrency))
+            print(f"pool (x{concurrency:<2})       : {rate:10.0f} updates/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+"""Check the contacts of database.py: legacy merge, bulk upsert and lookups.
+
+Writes an old-style users.db (the schema database.py used to create) with
+duplicate, mixed-case and blank emails, then starts the bot's storage with
+init_app(), which merges it into the sharded todo_bot.db. Then it:
+
+- upserts onboarding rows in bulk and one by one, and reports the rows/s
+- saves contacts from several threads at once, each with its own event loop
+- registers users and looks contacts and usernames up, timing the indexed
+  lookups against a full scan
+
+and checks that:
+
+- users.db is merged once and renamed, with one row per email, the
+  latest name winning
+- bulk upserts update existing contacts instead of adding rows
+- concurrent saves from many threads all land, without errors
+- email and username lookups use their index and ignore case
+
+Exits non-zero if a check fails.
+
+Usage: python benchmarks/check_contacts.py [rows] [--shards N]
+"""
+import argparse
+import asyncio
+import os
+import sqlite3
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from settings import Settings
+
+THREADS = 8
+LOOKUPS = 2000
+
+
+def write_legacy(path, rows):
+    """The users.db database.py used to write, with every 10th email repeated in upper case and every 50th blank"""
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT, email TEXT)")
+    conn.executemany(
+        "INSERT INTO users (name, email) VALUES (?, ?)",
+        ((f"Person {i}", "" if i % 50 == 0 else f"person{i}@example.com") for i in range(rows))
+    )
+    conn.executemany(
+        "INSERT INTO users (name, email) VALUES (?, ?)",
+        ((f"Renamed {i}", f" PERSON{i}@Example.com ") for i in range(1, rows, 10) if i % 50)
+    )
+    conn.commit()
+    conn.close()
+
+
+def contact_counts(conn):
+    return conn.execute("SELECT count(*), count(email), count(DISTINCT email) FROM contacts").fetchone()
+
+
+def plan(conn, sql, *params):
+    return " ".join(row[-1] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+
+
+def scan_contact(conn, email):
+    return conn.execute("SELECT id FROM contacts NOT INDEXED WHERE email = ?", (email,)).fetchone()
+
+
+def check(failures, ok, message):
+    print(f"{'ok  ' if ok else 'FAIL'} {message}")
+    if not ok:
+        failures.append(message)
+
+
+def totals(pool):
+    counts = [shard.run_read(contact_counts) for shard in pool.shards]
+    return tuple(sum(column) for column in zip(*counts))
+
+
+async def run(botfinal, database, rows, failures):
+    pool = botfinal.get_pool()
+    blanks = len(range(0, rows, 50))
+
+    # Onboarding import: half new contacts, half renames of merged ones
+    onboarding = [(f"New {i}", f"new{i}@example.com") for i in range(rows // 2)]
+    onboarding += [(f"Imported {i}", f"person{i}@example.com") for i in range(1, rows, 2) if i % 50]
+    before = totals(pool)
+    started = time.perf_counter()
+    written = await database.upsert_users(iter(onboarding))
+    bulk_rate = written / (time.perf_counter() - started)
+    after = totals(pool)
+    check(failures, after[0] - before[0] == rows // 2 and written == len(onboarding),
+          f"bulk upsert adds new emails and updates known ones ({after[0] - before[0]} rows added)")
+    check(failures, (await database.find_contact("PERSON3@example.com"))[1] == "Imported 3",
+          "an upsert renames the existing contact")
+
+    started = time.perf_counter()
+    for i in range(2000):
+        await database.save_user(f"Single {i}", f"single{i}@example.com")
+    single_rate = 2000 / (time.perf_counter() - started)
+    print(f"bulk upsert {bulk_rate:,.0f} rows/s, save_user one by one {single_rate:,.0f} rows/s")
+
+    # Several threads, each with its own loop, saving overlapping emails
+    errors = []
+
+    def saver(thread):
+        async def save_all():
+            await asyncio.gather(*(
+                database.save_user(f"Thread {thread}", f"shared{i}@example.com") for i in range(500)
+            ))
+        try:
+            asyncio.run(save_all())
+        except Exception as exc:
+            errors.append(exc)
+
+    threads = [threading.Thread(target=saver, args=(thread,)) for thread in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    shared = [await database.find_contact(f"shared{i}@example.com") for i in range(500)]
+    check(failures, not errors and all(row is not None for row in shared),
+          f"{THREADS} threads saving at once: no errors, every contact stored ({errors[:1]})")
+    final = totals(pool)
+    check(failures, final[1] == final[2] and final[0] == final[1] + blanks,
+          f"one row per email across {len(pool.shards)} shards ({final[1]} emails, {final[0] - final[1]} blank)")
+
+    # Lookups: registered users with usernames, and contacts by email
+    for i in range(0, rows, 4):
+        await botfinal.register_user(str(500_000_000 + i), f"User {i}", f"User_{i}")
+    found = await database.find_user_by_username("@user_40")
+    check(failures, found is not None and found[0] == str(500_000_040),
+          "username lookup ignores case and a leading @")
+    shard = pool.shards[0]
+    email_plan = shard.run_read(plan, "SELECT id FROM contacts WHERE email = ?", "x")
+    username_plan = shard.run_read(plan, "SELECT user_id FROM users WHERE username = ? COLLATE NOCASE", "x")
+    check(failures, "idx_contacts_email" in email_plan and "idx_users_username" in username_plan,
+          f"lookups use their index ({email_plan}; {username_plan})")
+
+    emails = [f"person{i}@example.com" for i in range(1, rows, max(1, rows // LOOKUPS))]
+    timings = {"indexed": [], "scan": []}
+    for email in emails[:LOOKUPS]:
+        started = time.perf_counter()
+        await database.find_contact(email)
+        timings["indexed"].append(time.perf_counter() - started)
+    for email in emails[:50]:
+        started = time.perf_counter()
+        await pool.pool_for(email).read(scan_contact, email)
+        timings["scan"].append(time.perf_counter() - started)
+    print(f"find_contact p50 {statistics.median(timings['indexed']) * 1000:.2f} ms, "
+          f"full scan p50 {statistics.median(timings['scan']) * 1000:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("rows", type=int, nargs="?", default=200_000)
+    parser.add_argument("--shards", type=int, default=2)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    os.chdir(tmp.name)
+    write_legacy("users.db", args.rows)
+    import botfinal
+    import database
+
+    failures = []
+    started = time.perf_counter()
+    botfinal.init_app(Settings(bot_token="123:contacts", db_shards=args.shards))
+    pool = botfinal.get_pool()
+    count, emails, distinct = totals(pool)
+    blanks = len(range(0, args.rows, 50))
+    print(f"{args.rows + len(range(1, args.rows, 10)) - len(range(1, args.rows, 50))} users.db rows "
+          f"merged at startup in {time.perf_counter() - started:.1f}s\n")
+    check(failures, not os.path.exists("users.db") and os.path.exists("users.db.merged"),
+          "users.db is renamed once merged")
+    check(failures, emails == distinct == args.rows - blanks and count == args.rows,
+          f"one contact per email, blank ones kept ({emails} emails, {count - emails} blank)")
+    check(failures, database.merge_legacy("users.db") == 0, "a second start merges nothing")
+    renamed = pool.pool_for("person11@example.com").run_read(
+        lambda conn: conn.execute("SELECT name FROM contacts WHERE email = 'person11@example.com'").fetchone()
+    )
+    check(failures, renamed == ("Renamed 11",), f"the later row of a repeated email wins ({renamed})")
+    try:
+        asyncio.run(run(botfinal, database, args.rows, failures))
+    finally:
+        botfinal.close_pool()
+        tmp.cleanup()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
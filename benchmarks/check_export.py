@@ -0,0 +1,175 @@
+"""Check /export and /import on a user with 500k tasks.
+
+Fills a temporary database with one user's tasks and reminders, and moves
+some of the completed tasks to tasks_archive as maintenance would. Exports
+them in both formats and checks every row, archived ones included, made it
+into the file, then imports the CSV for a second user and checks the copy
+and its /history rollup, and that rows with out-of-range timestamps are
+skipped rather than failing the import. Finally deletes all of the first user's tasks and
+checks the archive and the rollup are emptied too. The peak Python heap of the full export is compared with that of
+a user with a tenth of the rows: with chunked keyset reads it stays flat.
+
+Exits non-zero if a check fails.
+
+Usage: python benchmarks/check_export.py [tasks]
+"""
+import asyncio
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import botfinal
+import events
+import stats
+import transfer
+from migrations import migrate
+from storage import close_pool, get_pool, init_pool
+
+USER = "1001"
+SMALL_USER = "1002"
+COPY = "1003"
+BAD_ROWS = "1004"
+BASE_TIME = 1_700_000_000
+
+
+def fill(conn, user_id, tasks, reminders):
+    conn.executemany(
+        "INSERT INTO tasks (user_id, task, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+        ((user_id, f"task {i}, with \"quotes\"\nand a second line", "completed" if i % 3 == 0 else "pending",
+          BASE_TIME + i // 4, BASE_TIME + i // 4) for i in range(tasks))
+    )
+    conn.executemany(
+        "INSERT INTO reminders (user_id, reminder_text, reminder_time, created_at, due_at, completed) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        ((user_id, f"reminder {i}", 5, BASE_TIME + i, BASE_TIME + i + 300, 1) for i in range(reminders))
+    )
+
+
+def archive_some(conn, user_id):
+    """Move every other completed task to the archive, as retention.py does"""
+    where = "user_id = ? AND status = 'completed' AND id % 2 = 0"
+    conn.execute(
+        "INSERT INTO tasks_archive (id, user_id, task, created_at, updated_at, status, due_at, archived_at) "
+        f"SELECT id, user_id, task, created_at, updated_at, status, due_at, 0 FROM tasks WHERE {where}",
+        (user_id,)
+    )
+    conn.execute(f"DELETE FROM tasks WHERE {where}", (user_id,))
+    return conn.execute("SELECT count(*) FROM tasks_archive WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+def count_rows(path, fmt):
+    with open(path, "rb") as stream:
+        return sum(len(tasks) + len(reminders) for tasks, reminders, _ in transfer.read_batches(stream, fmt))
+
+
+async def export(path, fmt, user_id):
+    """(tasks, reminders, seconds, peak heap bytes) of one export"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    try:
+        with open(path, "wb") as out:
+            tasks, reminders = await transfer.export_user(user_id, out, fmt)
+        return tasks, reminders, time.perf_counter() - started, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def check(failures, ok, message):
+    print(f"{'ok  ' if ok else 'FAIL'} {message}")
+    if not ok:
+        failures.append(message)
+
+
+def table_counts(conn, user_id):
+    return (
+        conn.execute(
+            "SELECT count(*), sum(status = 'completed') FROM (SELECT status FROM tasks WHERE user_id = ?1 "
+            "UNION ALL SELECT status FROM tasks_archive WHERE user_id = ?1)",
+            (user_id,)
+        ).fetchone(),
+        conn.execute("SELECT count(*) FROM reminders WHERE user_id = ?", (user_id,)).fetchone()[0],
+        conn.execute("SELECT sum(created_count), sum(completed_count) FROM user_daily_stats WHERE user_id = ?",
+                     (user_id,)).fetchone(),
+    )
+
+
+async def run(tmp, tasks, reminders):
+    failures = []
+    peaks = {}
+    for fmt in transfer.FORMATS:
+        for user_id in (SMALL_USER, USER):
+            path = os.path.join(tmp, f"{user_id}.{fmt}")
+            got_tasks, got_reminders, elapsed, peak = await export(path, fmt, user_id)
+            peaks[fmt, user_id] = peak
+            if user_id != USER:
+                continue
+            print(f"{fmt:<6} export: {got_tasks + got_reminders} rows in {elapsed:.1f}s "
+                  f"({(got_tasks + got_reminders) / elapsed:.0f} rows/s), "
+                  f"{os.path.getsize(path) / 2 ** 20:.1f} MiB, peak heap {peak / 2 ** 20:.2f} MiB")
+            check(failures, (got_tasks, got_reminders) == (tasks, reminders),
+                  f"{fmt} export reports {tasks} tasks and {reminders} reminders")
+            check(failures, count_rows(path, fmt) == tasks + reminders,
+                  f"{fmt} file holds {tasks + reminders} rows")
+        # Ten times the rows should not need much more memory than a tenth
+        check(failures, peaks[fmt, USER] < peaks[fmt, SMALL_USER] * 2 + 2 ** 20,
+              f"{fmt} peak heap stays flat ({peaks[fmt, SMALL_USER] / 2 ** 20:.2f} MiB "
+              f"for a tenth of the rows)")
+
+    started = time.perf_counter()
+    with open(os.path.join(tmp, f"{USER}.csv"), "rb") as stream:
+        imported = await transfer.import_user(COPY, stream, "csv")
+    elapsed = time.perf_counter() - started
+    print(f"csv    import: {imported[0] + imported[1]} rows in {elapsed:.1f}s "
+          f"({(imported[0] + imported[1]) / elapsed:.0f} rows/s)")
+    check(failures, imported == (tasks, reminders, 0), f"import reports {tasks} tasks, {reminders} reminders")
+
+    original, copy = get_pool().run_read(table_counts, USER), get_pool().run_read(table_counts, COPY)
+    check(failures, copy[:2] == original[:2], "imported tasks, statuses and reminders match the original")
+    check(failures, tuple(copy[2]) == tuple(copy[0]), "imported tasks are counted in the /history rollup")
+
+    rows = [{"type": "task", "text": "fine", "created_at": BASE_TIME},
+            {"type": "task", "text": "huge", "created_at": 2 ** 64},
+            {"type": "task", "text": "huge due", "due_at": -(2 ** 70)},
+            {"type": "reminder", "text": "huge reminder", "due_at": 10 ** 30}]
+    data = io.BytesIO("".join(json.dumps(row) + "\n" for row in rows).encode())
+    imported = await transfer.import_user(BAD_ROWS, data, "jsonl")
+    check(failures, imported == (1, 0, 3), f"rows with out-of-range timestamps are skipped ({imported})")
+
+    await botfinal.delete_all_user_tasks(USER)
+    left = get_pool().run_read(table_counts, USER)
+    deleted = get_pool().run_read(
+        lambda conn, user_id: conn.execute("SELECT count(*) FROM task_events WHERE user_id = ? AND kind = ?",
+                                           (int(user_id), events.DELETED)).fetchone()[0],
+        USER
+    )
+    check(failures, left[0][0] == 0 and left[2] == (None, None) and deleted == tasks,
+          f"deleting all tasks empties the archive and the rollup too ({deleted} deletions logged)")
+    return failures
+
+
+def main():
+    tasks = int(sys.argv[1]) if len(sys.argv) > 1 else 500_000
+    reminders = tasks // 10
+    with tempfile.TemporaryDirectory() as tmp:
+        pool = init_pool(os.path.join(tmp, "export.db"))
+        pool.run_write_all(migrate)
+        pool.run_write(fill, USER, tasks, reminders)
+        pool.run_write(fill, SMALL_USER, tasks // 10, reminders // 10)
+        archived = pool.run_write(archive_some, USER)
+        pool.run_write_all(stats.backfill)
+        print(f"user with {tasks} tasks ({archived} archived) and {reminders} reminders")
+        try:
+            failures = asyncio.run(run(tmp, tasks, reminders))
+        finally:
+            close_pool()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""Check that conversations survive a restart and expire when idle.
+
+Builds the bot's Application (persistence.py) against a fresh sharded
+database. Some users are left halfway through /register, others in the
+middle of /addtask, and some have /search state in user_data. The
+Application is stopped and a new one built, like a restart; every user
+must carry on where they were. /import is started and cancelled with
+/end, which must end it and drop its stored state. Then the clock moves past the TTL: every
+conversation must end, user_data must be dropped from memory and every
+state row deleted.
+
+Also reports how many write transactions the state changes took (the
+persistence writes every PERSISTENCE_FLUSH_MS, not on every update).
+
+Exits non-zero if a check fails.
+
+Usage: python benchmarks/check_persistence.py [users] [--shards N]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from telegram import Update
+
+import persistence
+from fake_bot_api import FakeBotAPI, make_update
+from replay import RecordingBot
+from settings import Settings
+
+
+def count_imports(conn):
+    return conn.execute("SELECT count(*) FROM conversation_state WHERE name = 'import'").fetchone()[0]
+
+
+def count_rows(conn):
+    return tuple(
+        conn.execute(f"SELECT count(*) FROM {table}").fetchone()[0]
+        for table in ("conversation_state", "user_state")
+    )
+
+
+def check(failures, ok, message):
+    print(f"{'ok  ' if ok else 'FAIL'} {message}")
+    if not ok:
+        failures.append(message)
+
+
+async def send(app, bot, update_ids, user_id, text):
+    await app.process_update(Update.de_json(make_update(next(update_ids), user_id, text), bot))
+    return bot.last.get(user_id, ("", None))[0]
+
+
+async def run(botfinal, users, port):
+    failures = []
+    bot = RecordingBot()
+    update_ids = iter(range(1, 10 ** 9))
+    ids = [10_000 + index for index in range(users)]
+    # A third stop halfway through /register, a third in /addtask, a third search
+    registering, adding, searching = ids[0::3], ids[1::3], ids[2::3]
+
+    api = FakeBotAPI(port=port)
+    await api.start()
+    try:
+        app = botfinal.build_application(base_url=api.base_url)
+        await app.initialize()
+        await app.start()
+        writes_before = persistence.FLUSH_SECONDS.count()
+        updates = 0
+        started = time.perf_counter()
+        for user_id in registering:
+            await send(app, bot, update_ids, user_id, "/register")
+            updates += 1
+        for user_id in adding + searching:
+            for text in ("/register", f"User {user_id}", "/addtask", "buy milk", "/donetask"):
+                await send(app, bot, update_ids, user_id, text)
+            updates += 5
+        for user_id in adding:
+            await send(app, bot, update_ids, user_id, "/addtask")
+            updates += 1
+        for user_id in searching:
+            await send(app, bot, update_ids, user_id, "/search milk")
+            updates += 1
+        elapsed = time.perf_counter() - started
+        # Stopping writes out the last changes, like a deploy would
+        await app.stop()
+        await app.shutdown()
+        writes = persistence.FLUSH_SECONDS.count() - writes_before
+        rows = [pool.run_read(count_rows) for pool in botfinal.get_pool().shards]
+        print(f"{users} users, {updates} updates in {elapsed:.1f}s: {writes} state write transactions, "
+              f"{sum(r[0] for r in rows)} conversations and {sum(r[1] for r in rows)} user_data rows "
+              f"over {len(rows)} shards")
+
+        # The restart: a new Application reads the state back
+        app = botfinal.build_application(base_url=api.base_url)
+        await app.initialize()
+        await app.start()
+        restored = True
+        for user_id in registering:
+            reply = await send(app, bot, update_ids, user_id, f"Restored {user_id}")
+            restored &= reply.startswith("✅ Registration successful")
+        check(failures, restored, "users halfway through /register finish it after the restart")
+        restored = True
+        for user_id in adding:
+            reply = await send(app, bot, update_ids, user_id, "/donetask")
+            restored &= reply.startswith("🛑 Task entry stopped")
+        check(failures, restored, "users in /addtask are still in it after the restart")
+
+        for user_id in adding:
+            await send(app, bot, update_ids, user_id, "/import")
+        await app.update_persistence()
+        await app.persistence.flush()
+        started_imports = sum(pool.run_read(count_imports) for pool in botfinal.get_pool().shards)
+        ended = True
+        for user_id in adding:
+            reply = await send(app, bot, update_ids, user_id, "/end")
+            ended &= reply.startswith("🚫 Conversation ended")
+        await app.update_persistence()
+        await app.persistence.flush()
+        left = sum(pool.run_read(count_imports) for pool in botfinal.get_pool().shards)
+        check(failures, ended and started_imports == len(adding) and left == 0,
+              f"/end cancels /import and drops its state ({started_imports} stored, {left} left)")
+        check(failures, all(app.user_data.get(user_id, {}).get("search_query") == "milk" for user_id in searching),
+              "user_data (the last /search) is restored")
+
+        # Every user goes idle for longer than the TTL
+        for user_id in searching:
+            await send(app, bot, update_ids, user_id, "/register")
+        await app.update_persistence()
+        state = app.persistence
+        state.clock = lambda: time.time() + state.ttl + 60
+        conversations, dropped = state.expire(app)
+        await app.update_persistence()
+        await state.flush()
+        print(f"expired {conversations} conversations and {dropped} users' data")
+        check(failures, len(app.user_data) == 0, "no user_data left in memory after the TTL")
+        reply = await send(app, bot, update_ids, searching[0], "Too late")
+        check(failures, not reply.startswith("✅ Registration"), "an expired /register no longer takes a name")
+        state.clock = time.time
+        await app.update_persistence()
+        await state.flush()
+        rows = [pool.run_read(count_rows) for pool in botfinal.get_pool().shards]
+        check(failures, rows and all(row == (0, 0) for row in rows), f"no state rows left after the TTL ({rows})")
+        await app.stop()
+        await app.shutdown()
+    finally:
+        await api.stop()
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("users", type=int, nargs="?", default=3000)
+    parser.add_argument("--shards", type=int, default=2)
+    parser.add_argument("--port", type=int, default=8084, help="port for the local fake Bot API")
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    # init_app opens todo_bot.db in the working directory
+    os.chdir(tmp.name)
+    import botfinal
+
+    botfinal.init_app(Settings(bot_token="123:persistence", db_shards=args.shards))
+    try:
+        failures = asyncio.run(run(botfinal, args.users, args.port))
+    finally:
+        botfinal.close_pool()
+        tmp.cleanup()
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""A local stand-in for the Telegram Bot API used by the benchmarks.
+
+Point an Application at it with base_url=FakeBotAPI.base_url, or, without
+the HTTP round trip, build the bot with request=FakeBotRequest(api), for
+runs where localhost HTTP would be the bottleneck. Every method answers
+with a plausible result; sendMessage calls are counted and can be
+delayed, rejected with 429 (flood limit) responses, or refused with 403
+for chats that blocked the bot.
+"""
+import asyncio
+import collections
+import json
+import time
+
+from aiohttp import web
+from telegram.request import BaseRequest
+
+BOT_USER = {
+    "id": 1000000,
+    "is_bot": True,
+    "first_name": "Fake",
+    "username": "fake_todo_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": False,
+    "supports_inline_queries": False,
+}
+
+
+class FakeBotAPI:
+    def __init__(self, host="127.0.0.1", port=8081, latency=0.0, flood_every=0, retry_after=1,
+                 blocked=None, on_send=None):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        # Answer every Nth sendMessage with 429 Too Many Requests (0 = never)
+        self.flood_every = flood_every
+        self.retry_after = retry_after
+        # blocked(chat_id) -> True answers that chat with 403 Forbidden
+        self.blocked = blocked
+        # on_send(chat_id, text) is called for each message instead of
+        # keeping it in `sent`, for runs too long to keep them all
+        self.on_send = on_send
+        self.calls = collections.Counter()
+        self.sent = []
+        self.floods = 0
+        self._message_id = 0
+        self._runner = None
+        self.all_sent = asyncio.Event()
+        self.expected = None
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/bot"
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+    async def _params(self, request):
+        if request.content_type == "application/json":
+            return await request.json()
+        params = dict(await request.post())
+        for key, value in params.items():
+            if isinstance(value, str) and value[:1] in "{[":
+                try:
+                    params[key] = json.loads(value)
+                except ValueError:
+                    pass
+        return params
+
+    async def handle(self, request):
+        status, payload = await self.answer(request.match_info["method"], await self._params(request))
+        return web.json_response(payload, status=status)
+
+    async def answer(self, method, params):
+        """(HTTP status, response body) for one Bot API call"""
+        self.calls[method] += 1
+
+        if method == "getMe":
+            return 200, {"ok": True, "result": BOT_USER}
+        if method in ("sendMessage", "sendDocument"):
+            if self.latency:
+                await asyncio.sleep(self.latency)
+            if self.flood_every and self.calls[method] % self.flood_every == 0:
+                self.floods += 1
+                return 429, {"ok": False, "error_code": 429, "description": "Too Many Requests",
+                             "parameters": {"retry_after": self.retry_after}}
+            self._message_id += 1
+            chat_id = int(params.get("chat_id", 0))
+            if self.blocked is not None and self.blocked(chat_id):
+                return 403, {"ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"}
+            if self.on_send is not None:
+                self.on_send(chat_id, params.get("text", ""))
+            else:
+                self.sent.append((time.perf_counter(), chat_id, params.get("text", "")))
+                if self.expected is not None and len(self.sent) >= self.expected:
+                    self.all_sent.set()
+            message = {
+                "message_id": self._message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": params.get("text", ""),
+            }
+            return 200, {"ok": True, "result": message}
+        if method == "getUpdates":
+            return 200, {"ok": True, "result": []}
+        return 200, {"ok": True, "result": True}
+
+
+class FakeBotRequest(BaseRequest):
+    """PTB request backend that hands every call straight to a FakeBotAPI"""
+
+    def __init__(self, api):
+        self.api = api
+
+    @property
+    def read_timeout(self):
+        return 5.0
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None, write_timeout=None,
+                         connect_timeout=None, pool_timeout=None):
+        params = request_data.parameters if request_data is not None else {}
+        status, payload = await self.api.answer(url.rsplit("/", 1)[-1], params)
+        return status, json.dumps(payload).encode()
+
+
+def make_update(update_id, user_id, text):
+    """A minimal Telegram update dict for a private text message"""
+    message = {
+        "message_id": update_id,
+        "date": int(time.time()),
+        "chat": {"id": user_id, "type": "private", "first_name": f"User{user_id}"},
+        "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}", "username": f"user{user_id}"},
+        "text": text,
+    }
+    if text.startswith("/"):
+        command = text.split()[0]
+        message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return {"update_id": update_id, "message": message}
@@ -0,0 +1,110 @@
+"""Load test for webhook mode with the Bot API stubbed out.
+
+Starts the bot behind its local webhook endpoint (pointed at a fake Bot API
+and a temp database), then POSTs synthetic updates from many users,
+including redelivered duplicates, and reports throughput and how long it
+took until every reply had been sent. Updates the dispatcher drops from
+flooding users (see dispatch.py) get no reply and are not waited for.
+
+Replies go through the bot's real outbox, capped at outbox.GLOBAL_RATE
+messages a second like Telegram's limit, so sending them takes at least
+replies / GLOBAL_RATE seconds; the wait for them allows for that.
+
+Usage: python benchmarks/load_webhook.py [updates] [users] [concurrency]
+"""
+import asyncio
+import os
+import random
+import sys
+import tempfile
+import time
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fake_bot_api import FakeBotAPI, make_update
+from outbox import GLOBAL_RATE
+from settings import Settings
+
+WEBHOOK_PORT = 8444
+DUPLICATE_RATE = 0.05
+# Extra seconds to wait for the replies, beyond what the outbox's rate needs
+REPLY_SLACK = 30
+COMMANDS = ["/start", "/showtask", "/help", "/history", "hello"]
+
+
+async def run(botfinal, updates, users, concurrency):
+    from dispatch import UserOrderedUpdateProcessor
+    from webhook import run_webhook
+
+    api = FakeBotAPI()
+    await api.start()
+
+    processor = UserOrderedUpdateProcessor(workers=16)
+    app = botfinal.build_application(token="123:fake", update_processor=processor, base_url=api.base_url)
+    stop = asyncio.Event()
+    url = f"http://127.0.0.1:{WEBHOOK_PORT}/telegram"
+    server_task = asyncio.create_task(run_webhook(
+        app, processor, url, port=WEBHOOK_PORT, register=False, stop_event=stop))
+    await asyncio.sleep(0.5)
+
+    payloads = [make_update(i + 1, random.randrange(users) + 1, random.choice(COMMANDS)) for i in range(updates)]
+    payloads += random.sample(payloads, int(updates * DUPLICATE_RATE))
+    random.shuffle(payloads)
+    queue = iter(payloads)
+    statuses = {}
+
+    async def client(session):
+        for payload in queue:
+            while True:
+                async with session.post(url, json=payload) as response:
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+                    if response.status != 503:
+                        break
+                await asyncio.sleep(0.05)
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+    posted = time.perf_counter() - started
+    # Every update is in by now, so the flood drops are final
+    api.expected = updates - processor.dropped
+    if len(api.sent) >= api.expected:
+        api.all_sent.set()
+    await asyncio.wait_for(api.all_sent.wait(), timeout=api.expected / GLOBAL_RATE * 1.2 + REPLY_SLACK)
+    finished = time.perf_counter() - started
+
+    stop.set()
+    server = await server_task
+    await api.stop()
+
+    print(f"posted       : {len(payloads)} requests ({len(payloads) - updates} duplicates) in {posted:.2f}s "
+          f"= {len(payloads) / posted:.0f} req/s")
+    print(f"HTTP status  : {statuses}")
+    print(f"processed    : {server.received} updates, {server.duplicates} duplicates dropped, "
+          f"{processor.dropped} dropped from flooding users")
+    print(f"replies sent : {len(api.sent)} in {finished:.2f}s = {len(api.sent) / finished:.0f} updates/s "
+          f"(outbox limit {GLOBAL_RATE:.0f}/s)")
+
+
+def main():
+    updates = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 32
+
+    with tempfile.TemporaryDirectory() as tmp:
+        # botfinal keeps its database next to the working directory
+        os.chdir(tmp)
+        import botfinal
+
+        botfinal.init_app(Settings(bot_token="123:fake"))
+
+        try:
+            asyncio.run(run(botfinal, updates, users, concurrency))
+        finally:
+            botfinal.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+"""Offline replay of a mixed user workload through the bot's real handlers.
+
+Builds the Application from botfinal.build_application against a fresh
+SQLite database in a temp directory and feeds it synthetic Updates through
+UserOrderedUpdateProcessor, like PTB's update fetcher would. The Updates
+are bound to RecordingBot, so every reply lands in memory; a local
+FakeBotAPI only answers the getMe call made while initializing. Users register first and then mostly add, list, complete
+and delete tasks; a few very active users send most of the traffic.
+
+Reports throughput, per-command latency percentiles and peak memory, and
+writes the same numbers as JSON to diff between commits:
+
+    python benchmarks/replay.py --json before.json
+    git checkout <other commit>
+    python benchmarks/replay.py --json after.json --compare before.json
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from telegram import Update
+
+from dispatch import UserOrderedUpdateProcessor
+from fake_bot_api import BOT_USER, FakeBotAPI, make_update
+from settings import Settings
+
+# Share of actions per kind; each action is one or more updates
+MIX = {
+    "addtask": 0.30,
+    "showtask": 0.22,
+    "page": 0.05,
+    "complete": 0.15,
+    "deletetask": 0.05,
+    "remind": 0.08,
+    "history": 0.10,
+    "start": 0.05,
+}
+# Activity of the n-th most active user is proportional to 1 / n**SKEW
+SKEW = 1.1
+TASK_IDS = re.compile(r"^#(\d+) ", re.MULTILINE)
+TASK_WORDS = ("buy milk", "call mom", "pay rent", "write report", "book flight",
+              "fix bike", "email Anna", "clean kitchen", "read chapter 4", "plan trip")
+
+
+class RecordingBot:
+    """Stands in for the Bot the handlers reply through.
+
+    Only the methods the handlers use are provided; each call is counted
+    and the last text and keyboard sent to every chat are kept.
+    """
+
+    defaults = None
+    username = BOT_USER["username"]
+
+    def __init__(self):
+        self.calls = collections.Counter()
+        self.last = {}
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        self.calls["sendMessage"] += 1
+        self.last[chat_id] = (text, reply_markup)
+        return True
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, reply_markup=None, **kwargs):
+        self.calls["editMessageText"] += 1
+        self.last[chat_id] = (text, reply_markup)
+        return True
+
+    async def answer_callback_query(self, callback_query_id, **kwargs):
+        self.calls["answerCallbackQuery"] += 1
+        return True
+
+
+def callback_update(update_id, user_id, data):
+    return {
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": user_id, "is_bot": False, "first_name": f"User{user_id}"},
+            "chat_instance": str(user_id),
+            "data": data,
+            "message": {
+                "message_id": update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "text": "tasks",
+            },
+        },
+    }
+
+
+def workload(users, actions, rng):
+    """[(user_id, kind)] in arrival order; each user registers before acting"""
+    weights = [1 / rank ** SKEW for rank in range(1, users + 1)]
+    kinds, shares = zip(*MIX.items())
+    registered = set()
+    events = []
+    for user_index, kind in zip(rng.choices(range(users), weights, k=actions),
+                                rng.choices(kinds, shares, k=actions)):
+        user_id = 1000 + user_index
+        if user_id not in registered:
+            registered.add(user_id)
+            kind = "register"
+        events.append((user_id, kind))
+    return events
+
+
+def messages(kind, user_id, known, bot, rng):
+    """The updates (as "text" or ("callback", data)) one action sends, and its label"""
+    if kind == "register":
+        return "/register", ["/start", "/register", f"User {user_id}"]
+    if kind == "addtask":
+        lines = ["\n".join(rng.sample(TASK_WORDS, rng.randint(1, 4))) for _ in range(rng.randint(1, 3))]
+        return "/addtask", ["/addtask", *lines, "/donetask"]
+    if kind == "page":
+        _, markup = bot.last.get(user_id, (None, None))
+        if markup is not None and markup.inline_keyboard:
+            return "page", [("callback", markup.inline_keyboard[0][-1].callback_data)]
+        kind = "showtask"
+    if kind in ("complete", "deletetask"):
+        ids = known.get(user_id)
+        if ids:
+            return f"/{kind}", [f"/{kind} {ids.pop(rng.randrange(len(ids)))}"]
+        # Nothing listed yet: look at the tasks first, like a user would
+        kind = "showtask"
+    if kind == "showtask":
+        return "/showtask", [rng.choice(("/showtask", "/showtask", "/showtask pending"))]
+    if kind == "remind":
+        return "/remind", [f"/remind {rng.randint(5, 600)} {rng.choice(TASK_WORDS)}"]
+    if kind == "history":
+        return "/history", [rng.choice(("/history", "/history 7", "/history 90 week"))]
+    return "/start", ["/start"]
+
+
+async def replay(app, events, workers, in_flight, seed, shards=1):
+    rng = random.Random(seed)
+    bot = RecordingBot()
+    # The replay keeps every action: nobody is throttled as a flooder
+    processor = UserOrderedUpdateProcessor(workers, max_per_user=in_flight, shards=shards)
+    latencies = collections.defaultdict(list)
+    known = {}
+    update_ids = iter(range(1, 10 ** 9))
+    slots = asyncio.Semaphore(in_flight)
+    running = set()
+    sent = 0
+    errors = collections.Counter()
+
+    async def on_error(update, context):
+        errors[repr(context.error)] += 1
+
+    app.add_error_handler(on_error)
+
+    async def run(user_id, kind):
+        # Resolved when the user's turn comes, so ids and buttons are current
+        nonlocal sent
+        started = time.perf_counter()
+        label, sends = messages(kind, user_id, known, bot, rng)
+        sent += len(sends)
+        for item in sends:
+            if isinstance(item, tuple):
+                data = callback_update(next(update_ids), user_id, item[1])
+            else:
+                data = make_update(next(update_ids), user_id, item)
+            await app.process_update(Update.de_json(data, bot))
+        if label in ("/showtask", "page"):
+            known[user_id] = [int(task_id) for task_id in TASK_IDS.findall(bot.last[user_id][0])]
+        latencies[label].append(time.perf_counter() - started)
+
+    def done(task):
+        running.discard(task)
+        slots.release()
+
+    started = time.perf_counter()
+    for user_id, kind in events:
+        await slots.acquire()
+        # Only the user matters for ordering; the real updates are built in run()
+        key = Update.de_json(make_update(0, user_id, ""), bot)
+        task = asyncio.create_task(processor.process_update(key, run(user_id, kind)))
+        running.add(task)
+        task.add_done_callback(done)
+    await asyncio.gather(*running)
+    elapsed = time.perf_counter() - started
+    return elapsed, sent, latencies, bot.calls, errors
+
+
+async def session(botfinal, events, args):
+    api = FakeBotAPI(port=args.port)
+    await api.start()
+    try:
+        app = botfinal.build_application(base_url=api.base_url)
+        async with app:
+            return await replay(app, events, args.workers, args.in_flight, args.seed, botfinal.settings.db_shards)
+    finally:
+        await api.stop()
+
+
+def percentiles(values):
+    values = sorted(values)
+    pick = lambda q: round(values[min(len(values) - 1, int(len(values) * q))] * 1000, 3)
+    return {"count": len(values), "p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99),
+            "max": round(values[-1] * 1000, 3)}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(report, baseline):
+    def change(new, old):
+        return f"{(new - old) / old * 100:+6.1f}%" if old else "    n/a"
+
+    print(f"\nvs {baseline.get('commit')}:")
+    if baseline["params"] != report["params"]:
+        print(f"(different parameters: {baseline['params']})")
+    print(f"{'throughput':<12}{baseline['throughput']:>10.1f} -> {report['throughput']:>8.1f}/s "
+          f"{change(report['throughput'], baseline['throughput'])}")
+    for label, stats in sorted(report["latency_ms"].items()):
+        old = baseline["latency_ms"].get(label)
+        if old:
+            print(f"{label:<12}p50 {change(stats['p50'], old['p50'])}   p99 {change(stats['p99'], old['p99'])}")
+    print(f"{'peak rss':<12}{baseline['peak_rss_mib']:>10.1f} -> {report['peak_rss_mib']:>8.1f} MiB "
+          f"{change(report['peak_rss_mib'], baseline['peak_rss_mib'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--actions", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=16, help="handlers running at once")
+    parser.add_argument("--in-flight", type=int, default=256, help="actions submitted but not finished")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--port", type=int, default=8083, help="port for the local fake Bot API")
+    parser.add_argument("--tracemalloc", action="store_true", help="also report peak Python heap (slower)")
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--compare", help="print the change against an earlier --json report")
+    args = parser.parse_args()
+    json_path = args.json and os.path.abspath(args.json)
+    compare_path = args.compare and os.path.abspath(args.compare)
+
+    tmp = tempfile.TemporaryDirectory()
+    # init_app opens todo_bot.db in the working directory
+    os.chdir(tmp.name)
+    os.environ.setdefault("BOT_TOKEN", "123:replay")
+    import botfinal
+
+    botfinal.init_app(Settings.from_env())
+
+    events = workload(args.users, args.actions, random.Random(args.seed))
+    if args.tracemalloc:
+        tracemalloc.start()
+    elapsed, updates, latencies, calls, errors = asyncio.run(session(botfinal, events, args))
+    traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+    botfinal.close_pool()
+    tmp.cleanup()
+
+    report = {
+        "commit": git_commit(),
+        "params": {key: value for key, value in vars(args).items() if key not in ("json", "compare", "port")},
+        "actions": len(events),
+        "updates": updates,
+        "elapsed_s": round(elapsed, 3),
+        "throughput": round(len(events) / elapsed, 1),
+        "errors": sum(errors.values()),
+        "peak_rss_mib": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "peak_traced_mib": round(traced_peak / 2 ** 20, 1) if traced_peak is not None else None,
+        "bot_calls": dict(sorted(calls.items())),
+        "latency_ms": {label: percentiles(values) for label, values in sorted(latencies.items())},
+    }
+
+    print(f"{report['actions']} actions ({updates} updates) from {args.users} users in {elapsed:.1f}s: "
+          f"{report['throughput']:.0f} actions/s, peak RSS {report['peak_rss_mib']} MiB"
+          + (f", peak heap {report['peak_traced_mib']} MiB" if traced_peak is not None else ""))
+    for error, count in errors.most_common(3):
+        print(f"handler error x{count}: {error}")
+    print(f"{'action':<12}{'count':>7}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'max ms':>9}")
+    for label, stats in report["latency_ms"].items():
+        print(f"{label:<12}{stats['count']:>7}{stats['p50']:>9.2f}{stats['p95']:>9.2f}"
+              f"{stats['p99']:>9.2f}{stats['max']:>9.2f}")
+
+    if json_path:
+        with open(json_path, "w") as out:
+            json.dump(report, out, indent=2)
+    if compare_path:
+        with open(compare_path) as baseline:
+            compare(report, json.load(baseline))
+
+
+if __name__ == "__main__":
+    main()
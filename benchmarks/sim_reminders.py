@@ -0,0 +1,221 @@
+"""A week of reminders in virtual time, checked against independent expectations.
+
+Creates one-off, interval and cron reminders and task due dates through
+botfinal's helpers on a fresh sharded database, then drives the real
+ReminderScheduler with a virtual clock: the clock jumps straight to the
+next due time (or to the next user action, like cancelling a reminder or
+completing a task before it is due) and fire_due() runs the same range
+queries as in production. Every reminder must fire exactly at the times a
+brute-force minute-by-minute walk of the week predicts, and nothing else.
+
+Also checks that a recurring reminder fires once, not once per missed
+occurrence, after the bot was down, and keeps its original cadence.
+
+Exits non-zero if a check fails.
+
+Usage: python benchmarks/sim_reminders.py [users] [--shards N]
+"""
+import argparse
+import asyncio
+import collections
+import functools
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import recurrence
+from settings import Settings
+
+WEEK = 7 * 86400
+INTERVALS = ("every 1h", "every 2h", "every 3h", "every 6h", "every 12h", "every day", "every week")
+CRONS = ("0 9 * * 1-5", "*/15 9-17 * * *", "30 8 1,15 * 1", "0 20 * * 0", "45 23 * * *")
+
+
+class VirtualClock:
+    def __init__(self, now):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def cron_matches(expression, timestamp):
+    """Does a local minute match a cron expression (independent of recurrence.py)"""
+    local = time.localtime(timestamp)
+    fields = expression.split()
+    values = (local.tm_min, local.tm_hour, local.tm_mday, local.tm_mon, (local.tm_wday + 1) % 7)
+    lows = (0, 0, 1, 1, 0)
+    highs = (59, 23, 31, 12, 6)
+    matched = []
+    for field, value, low, high in zip(fields, values, lows, highs):
+        allowed = set()
+        for part in field.split(","):
+            span, _, step = part.partition("/")
+            if span == "*":
+                first, last = low, high
+            elif "-" in span:
+                first, last = map(int, span.split("-"))
+            else:
+                first, last = int(span), (high if step else int(span))
+            allowed.update(range(first, last + 1, int(step or 1)))
+        matched.append(value in allowed)
+    minute, hour, day, month, weekday = matched
+    days = (day or weekday) if fields[2] != "*" and fields[4] != "*" else (day and weekday)
+    return minute and hour and month and days
+
+
+@functools.lru_cache(maxsize=None)
+def cron_times(expression, start, end):
+    minute = (start // 60 + 1) * 60
+    return [at for at in range(minute, end, 60) if cron_matches(expression, at)]
+
+
+def expected_fires(kind, spec, first, start, end, cancel_at):
+    """Fire times of one reminder between start and end, stopping at cancel_at"""
+    stop = min(end, cancel_at or end)
+    if kind == "once":
+        return [first] if first < stop else []
+    if kind == "every":
+        return list(range(first, stop, spec))
+    return [at for at in cron_times(spec, start, end) if at < stop]
+
+
+async def simulate(botfinal, users, rng):
+    clock = VirtualClock(int(time.time()))
+    start = clock.now
+    end = start + WEEK
+    scheduler = botfinal.reminder_scheduler
+    scheduler.clock = clock
+    sent = collections.defaultdict(list)
+
+    async def send(chat_id, text):
+        sent[text.removeprefix("⏰ REMINDER: ")].append(clock.now)
+
+    scheduler._send = send
+    await scheduler.refresh()
+
+    # (label, kind, spec, first due, cancel at or None)
+    plans = []
+    # (virtual time, coroutine factory) of user actions during the week
+    actions = []
+    for user in range(users):
+        user_id = str(5000 + user)
+        label = f"once {user_id}"
+        due_at = start + rng.randrange(60, WEEK)
+        await botfinal.add_reminder(user_id, label, (due_at - start) // 60, chat_id=user_id, due_at=due_at)
+        scheduler.schedule(due_at, botfinal.get_pool().shard_for(user_id))
+        plans.append((label, "once", None, due_at, None))
+
+        for kind, words in (("every", rng.choice(INTERVALS).split()), ("cron", ["cron", *rng.choice(CRONS).split()])):
+            repeat, _ = recurrence.parse_rule(words)
+            label = f"{repeat} {user_id}"
+            _, _, spec = repeat.partition(" ")
+            due_at = start + int(spec) if kind == "every" else recurrence.next_after(repeat, start, start)
+            reminder_id = await botfinal.add_reminder(
+                user_id, label, 0, chat_id=user_id, due_at=due_at, repeat=repeat
+            )
+            scheduler.schedule(due_at, botfinal.get_pool().shard_for(user_id))
+            # A third are cancelled at an odd second somewhere in the week
+            cancel_at = start + rng.randrange(3600, WEEK) + 17 if rng.random() < 0.33 else None
+            if cancel_at:
+                actions.append((cancel_at, lambda u=user_id, r=reminder_id: botfinal.complete_reminder(u, r)))
+            plans.append((label, kind, int(spec) if kind == "every" else spec, due_at, cancel_at))
+
+        # A task with a due date; half are completed before it is due
+        task_id = await botfinal.add_task(user_id, f"task of {user_id}")
+        due_at = start + rng.randrange(3600, WEEK)
+        await botfinal.set_task_due(user_id, task_id, due_at, chat_id=user_id)
+        label = f"Task #{task_id} is due: task of {user_id}"
+        done_at = due_at - rng.randrange(60, 3600) - 1 if rng.random() < 0.5 else None
+        if done_at:
+            actions.append((done_at, lambda u=user_id, t=task_id: botfinal.update_task_status(u, t, "completed")))
+        plans.append((label, "once", None, due_at, done_at))
+
+    actions.sort(key=lambda action: action[0])
+    wakeups = 0
+    started = time.perf_counter()
+    while True:
+        next_due = scheduler.next_due
+        next_action = actions[0][0] if actions else None
+        candidates = [at for at in (next_due, next_action) if at is not None and at < end]
+        if not candidates:
+            break
+        clock.now = min(candidates)
+        if next_action == clock.now:
+            await actions.pop(0)[1]()
+        else:
+            await scheduler.fire_due()
+            wakeups += 1
+    elapsed = time.perf_counter() - started
+
+    failures = []
+    fired = 0
+    for label, kind, spec, first, cancel_at in plans:
+        expected = expected_fires(kind, spec, first, start, end, cancel_at)
+        actual = sent.pop(label, [])
+        fired += len(actual)
+        if actual != expected:
+            failures.append(f"{label}: fired {len(actual)}x {actual[:3]}..., expected {len(expected)}x {expected[:3]}...")
+    failures += [f"unexpected reminder {label}" for label in sent]
+    return failures, fired, wakeups, elapsed
+
+
+async def check_downtime(botfinal):
+    """An hourly reminder, bot down for 10 hours: one catch-up fire, same minute after"""
+    clock = VirtualClock(int(time.time()))
+    scheduler = botfinal.reminder_scheduler
+    scheduler.clock = clock
+    fires = []
+
+    async def send(chat_id, text):
+        fires.append(clock.now)
+
+    scheduler._send = send
+    user_id = "9999"
+    first = clock.now + 3600
+    await botfinal.add_reminder(user_id, "downtime", 60, chat_id=user_id, due_at=first, repeat="every 3600")
+    await scheduler.refresh()
+    clock.now = first + 10 * 3600 + 120
+    await scheduler.fire_due()
+    shard = botfinal.get_pool().shard_for(user_id)
+    return fires == [clock.now] and scheduler._next[shard] == first + 11 * 3600
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("users", type=int, nargs="?", default=200)
+    parser.add_argument("--shards", type=int, default=2)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    tmp = tempfile.TemporaryDirectory()
+    # init_app opens todo_bot.db in the working directory
+    os.chdir(tmp.name)
+    import botfinal
+
+    botfinal.init_app(Settings(bot_token="123:simulation", db_shards=args.shards))
+
+    try:
+        failures, fired, wakeups, elapsed = asyncio.run(simulate(botfinal, args.users, random.Random(args.seed)))
+        downtime_ok = asyncio.run(check_downtime(botfinal))
+    finally:
+        botfinal.close_pool()
+        tmp.cleanup()
+
+    print(f"{args.users} users over {args.shards} shards, one virtual week: {fired} reminders fired "
+          f"in {wakeups} wake-ups, {elapsed:.1f}s real time")
+    for failure in failures[:10]:
+        print(f"FAIL {failure}")
+    print(f"{'ok  ' if not failures else 'FAIL'} every reminder fired exactly at its expected times "
+          f"({len(failures)} mismatches)")
+    print(f"{'ok  ' if downtime_ok else 'FAIL'} after downtime a recurring reminder fires once and keeps its cadence")
+    sys.exit(1 if failures or not downtime_ok else 0)
+
+
+if __name__ == "__main__":
+    main()
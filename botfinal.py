@@ -1,575 +1,1294 @@
-import os
-import logging
-import asyncio
-import sqlite3
-from datetime import datetime
-from dotenv import load_dotenv
-from telegram import Update
-from telegram.ext import (
-    Application, CommandHandler, MessageHandler, filters,
-    ConversationHandler, ContextTypes
-)
-
-# Load environment variables from .env
-load_dotenv("file.env")
-
-# Fetch bot token from environment variables
-BOT_TOKEN = os.getenv("BOT_TOKEN")
-
-# Check if the token exists
-if not BOT_TOKEN:
-    raise ValueError("❌ ERROR: Bot token not found in environment variables.")
-
-print("✅ Bot token loaded successfully!")
-
-# Enable logging
-logging.basicConfig(
-    format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO
-)
-logger = logging.getLogger(__name__)
-
-# Conversation states
-ADDING_TODO = 1
-REGISTRATION = 2
-
-# Database setup
-DB_FILE = "todo_bot.db"
-
-def setup_database():
-    """Create database tables if they don't exist"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    
-    # Create users table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        user_id TEXT PRIMARY KEY,
-        name TEXT NOT NULL,
-        username TEXT,
-        registered_on TIMESTAMP
-    )
-    ''')
-    
-    # Create tasks table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS tasks (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT NOT NULL,
-        task TEXT NOT NULL,
-        created_at TIMESTAMP,
-        updated_at TIMESTAMP,
-        status TEXT DEFAULT 'pending',
-        FOREIGN KEY (user_id) REFERENCES users (user_id)
-    )
-    ''')
-    
-    # Create reminders table
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS reminders (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        user_id TEXT NOT NULL,
-        task_id INTEGER,
-        reminder_text TEXT NOT NULL,
-        reminder_time INTEGER NOT NULL,
-        created_at TIMESTAMP,
-        completed BOOLEAN DEFAULT 0,
-        FOREIGN KEY (user_id) REFERENCES users (user_id),
-        FOREIGN KEY (task_id) REFERENCES tasks (id)
-    )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    logger.info("Database setup complete")
-
-# Initialize the database
-setup_database()
-
-# Database helper functions
-def get_user(user_id):
-    """Get user from database"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-    user = cursor.fetchone()
-    conn.close()
-    return user
-
-def register_user(user_id, name, username):
-    """Register a new user"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute(
-        "INSERT OR REPLACE INTO users (user_id, name, username, registered_on) VALUES (?, ?, ?, ?)",
-        (user_id, name, username, now)
-    )
-    conn.commit()
-    conn.close()
-
-def add_task(user_id, task_text):
-    """Add a new task for user"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute(
-        "INSERT INTO tasks (user_id, task, created_at, updated_at) VALUES (?, ?, ?, ?)",
-        (user_id, task_text, now, now)
-    )
-    task_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return task_id
-
-def get_user_tasks(user_id):
-    """Get all tasks for a user"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute(
-        "SELECT id, task, status, created_at FROM tasks WHERE user_id = ? ORDER BY created_at DESC",
-        (user_id,)
-    )
-    tasks = cursor.fetchall()
-    conn.close()
-    return tasks
-
-def update_task_status(task_id, status):
-    """Update task status"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute(
-        "UPDATE tasks SET status = ?, updated_at = ? WHERE id = ?",
-        (status, now, task_id)
-    )
-    conn.commit()
-    conn.close()
-
-def update_task_text(task_id, new_text):
-    """Update task text"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute(
-        "UPDATE tasks SET task = ?, updated_at = ? WHERE id = ?",
-        (new_text, now, task_id)
-    )
-    conn.commit()
-    conn.close()
-
-def delete_task(task_id):
-    """Delete a task"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
-    conn.commit()
-    conn.close()
-
-def delete_all_user_tasks(user_id):
-    """Delete all tasks for a user"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("DELETE FROM tasks WHERE user_id = ?", (user_id,))
-    conn.commit()
-    conn.close()
-
-def add_reminder(user_id, reminder_text, minutes, task_id=None):
-    """Add a reminder"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    cursor.execute(
-        "INSERT INTO reminders (user_id, task_id, reminder_text, reminder_time, created_at) VALUES (?, ?, ?, ?, ?)",
-        (user_id, task_id, reminder_text, minutes, now)
-    )
-    reminder_id = cursor.lastrowid
-    conn.commit()
-    conn.close()
-    return reminder_id
-
-def complete_reminder(reminder_id):
-    """Mark a reminder as completed"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute("UPDATE reminders SET completed = 1 WHERE id = ?", (reminder_id,))
-    conn.commit()
-    conn.close()
-
-def get_task_history(user_id, days=30):
-    """Get task history for analytics"""
-    conn = sqlite3.connect(DB_FILE)
-    cursor = conn.cursor()
-    cursor.execute(
-        """
-        SELECT 
-            date(created_at) as day,
-            count(*) as task_count,
-            sum(case when status = 'completed' then 1 else 0 end) as completed_count
-        FROM tasks 
-        WHERE user_id = ? AND created_at >= date('now', '-30 day')
-        GROUP BY date(created_at)
-        ORDER BY day
-        """,
-        (user_id,)
-    )
-    history = cursor.fetchall()
-    conn.close()
-    return history
-
-# /start command
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    user = get_user(user_id)
-
-    if not user:
-        await update.message.reply_text("👋 Welcome! Please enter your full name to register:")
-        return REGISTRATION  # Directly move to the registration step
-    else:
-        await update.message.reply_text(
-            f"👋 Welcome back, {user[1]}!\n\n"
-            "Use /addtask to add a task, /showtask to view tasks, and /deletetask to remove them.\n"
-            "For more commands, use /help"
-        )
-
-async def process_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    name = update.message.text
-    username = update.effective_user.username or "Not provided"
-
-    # Register user in database
-    register_user(user_id, name, username)
-
-    await update.message.reply_text(
-        f"✅ Registration successful, {name}!\n\n"
-        "Use /addtask to add a task, /showtask to view tasks, and /help for all commands."
-    )
-    return ConversationHandler.END
-
-# Registration command
-async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "📝 Let's get you registered!\n"
-        "Please send your full name:"
-    )
-    return REGISTRATION
-
-# Handle registration info
-async def process_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    name = update.message.text
-    username = update.effective_user.username or "Not provided"
-    
-    # Register user in database
-    register_user(user_id, name, username)
-    
-    await update.message.reply_text(
-        f"✅ Registration successful, {name}!\n\n"
-        "Use /addtask to add a task, /showtask to view tasks, and /help for all commands."
-    )
-    return ConversationHandler.END
-
-# /addtask command - Start adding tasks
-async def addtask(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    user = get_user(user_id)
-    
-    # Check if user is registered
-    if not user:
-        await update.message.reply_text("⚠️ You need to register first. Please use /register")
-        return ConversationHandler.END
-    
-    await update.message.reply_text("📌 Send me tasks one by one. Type /donetask when finished.")
-    return ADDING_TODO
-
-# Handle task addition
-async def add_todo_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    task = update.message.text
-    
-    # Add task to database
-    task_id = add_task(user_id, task)
-    
-    await update.message.reply_text(f"✅ Task added: {task}")
-    return ADDING_TODO
-
-# /donetask command - Stop adding tasks
-async def donetask(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("🛑 Task entry stopped. Use /showtask to see your tasks.")
-    return ConversationHandler.END
-
-# /showtask command - Show all tasks
-async def showtask(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    user = get_user(user_id)
-    
-    # Check if user is registered
-    if not user:
-        await update.message.reply_text("⚠️ You need to register first. Please use /register")
-        return
-    
-    # Get tasks from database
-    tasks = get_user_tasks(user_id)
-    
-    if tasks:
-        task_list = "\n".join(
-            f"{idx+1}. {task[1]} - [{task[2]}]" 
-            for idx, task in enumerate(tasks)
-        )
-        await update.message.reply_text(f"📋 Your tasks:\n{task_list}")
-    else:
-        await update.message.reply_text("📭 No tasks available.")
-
-# /complete command - Mark a task as completed
-async def complete(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    user = get_user(user_id)
-    
-    # Check if user is registered
-    if not user:
-        await update.message.reply_text("⚠️ You need to register first. Please use /register")
-        return
-    
-    # Get task number from command
-    args = context.args
-    if not args:
-        await update.message.reply_text("⚠️ Usage: /complete [task_number]")
-        return
-    
-    try:
-        task_index = int(args[0]) - 1
-        
-        # Get tasks from database
-        tasks = get_user_tasks(user_id)
-        
-        # Check if task exists
-        if 0 <= task_index < len(tasks):
-            task_id = tasks[task_index][0]
-            task_text = tasks[task_index][1]
-            
-            # Update task status in database
-            update_task_status(task_id, "completed")
-            
-            await update.message.reply_text(f"✅ Marked task as completed: {task_text}")
-        else:
-            await update.message.reply_text("⚠️ Invalid task number.")
-    except ValueError:
-        await update.message.reply_text("❌ Please provide a valid task number.")
-
-# /deletetask command - Delete a specific task or all tasks
-async def deletetask(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    user = get_user(user_id)
-    
-    # Check if user is registered
-    if not user:
-        await update.message.reply_text("⚠️ You need to register first. Please use /register")
-        return
-    
-    args = context.args
-    if not args:
-        await update.message.reply_text("⚠️ Usage: /deletetask [task_number] or /deletetask all")
-        return
-
-    if args[0].lower() == "all":
-        # Delete all tasks from database
-        delete_all_user_tasks(user_id)
-        await update.message.reply_text("🗑️ All tasks deleted.")
-    else:
-        try:
-            task_index = int(args[0]) - 1
-            
-            # Get tasks from database
-            tasks = get_user_tasks(user_id)
-            
-            # Check if task exists
-            if 0 <= task_index < len(tasks):
-                task_id = tasks[task_index][0]
-                task_text = tasks[task_index][1]
-                
-                # Delete task from database
-                delete_task(task_id)
-                
-                await update.message.reply_text(f"🗑️ Deleted task: {task_text}")
-            else:
-                await update.message.reply_text("⚠️ Invalid task number.")
-        except ValueError:
-            await update.message.reply_text("❌ Please provide a valid task number.")
-
-# /remind command - Set a reminder
-async def remind(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    user = get_user(user_id)
-    
-    # Check if user is registered
-    if not user:
-        await update.message.reply_text("⚠️ You need to register first. Please use /register")
-        return
-    
-    args = context.args
-    if len(args) < 2:
-        await update.message.reply_text("⚠️ Usage: /remind [minutes] [message]")
-        return
-
-    try:
-        minutes = int(args[0])
-        reminder_text = " ".join(args[1:])
-        
-        # Add reminder to database
-        reminder_id = add_reminder(user_id, reminder_text, minutes)
-        
-        await update.message.reply_text(
-            f"⏳ Reminder set for {minutes} minutes: {reminder_text}"
-        )
-
-        # Schedule the reminder
-        asyncio.create_task(send_reminder(update, context, reminder_id, minutes, reminder_text))
-
-    except ValueError:
-        await update.message.reply_text("❌ Please provide a valid number for minutes.")
-
-# Function to send a reminder after a delay
-async def send_reminder(update: Update, context, reminder_id: int, minutes: int, message: str):
-    await asyncio.sleep(minutes * 60)  # Convert minutes to seconds
-    
-    # Mark reminder as completed
-    complete_reminder(reminder_id)
-    
-    # Send the reminder
-    await context.bot.send_message(
-        chat_id=update.effective_chat.id,
-        text=f"⏰ REMINDER: {message}"
-    )
-
-# /history command - Show task history
-async def history(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    user = get_user(user_id)
-    
-    # Check if user is registered
-    if not user:
-        await update.message.reply_text("⚠️ You need to register first. Please use /register")
-        return
-    
-    # Get history from database
-    history_data = get_task_history(user_id)
-    
-    if history_data:
-        history_text = "📊 Your task history (last 30 days):\n\n"
-        
-        for day, total, completed in history_data:
-            history_text += f"📅 {day}: {total} tasks ({completed} completed)\n"
-        
-        await update.message.reply_text(history_text)
-    else:
-        await update.message.reply_text("📭 No task history available for the last 30 days.")
-
-''' async def history(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    user_id = str(update.effective_user.id)
-    user = get_user(user_id)
-    
-    # Check if user is registered
-    if not user:
-        await update.message.reply_text("⚠️ You need to register first. Please use /register")
-        return
-    
-    # Get the user's name from the database
-    user_name = user[1]  # Index 1 contains the name field from the users table
-    
-    # Get history from database
-    history_data = get_task_history(user_id)
-    
-    if history_data:
-        history_text = f"📊 Task history for {user_name} (last 30 days):\n\n"
-        
-        for day, total, completed in history_data:
-            completion_rate = round((completed / total) * 100) if total > 0 else 0
-            history_text += f"📅 {day}: {total} tasks, {completed} completed ({completion_rate}%)\n"
-        
-        await update.message.reply_text(history_text)
-    else:
-        await update.message.reply_text(f"📭 No task history available for {user_name} in the last 30 days.")'''
-
-# /help command - Show available commands
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    help_text = (
-        "📚 **To-Do Bot Commands**\n\n"
-        "/register - Register with the bot\n"
-        "/addtask - Start adding tasks\n"
-        "/donetask - Finish adding tasks\n"
-        "/showtask - View all your tasks\n"
-        "/complete [#] - Mark a task as completed\n"
-        "/deletetask [#/all] - Delete a specific task or all tasks\n"
-        "/remind [min] [msg] - Set a reminder\n"
-        "/end - End of Conversation\n"
-        "/history - View your task history\n"
-        "/help - Show this help message\n\n"
-        "🌟 **Tips**:\n"
-        "• All your tasks are saved in the database\n"
-        "• Your task history is preserved for analytics\n"
-        "• You can see your productivity trends with /history"
-    )
-    await update.message.reply_text(help_text)
-
-# Handle unknown commands
-async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "🤖 Sorry, I didn't understand that command.\n"
-        "Use /help to see available commands."
-    )
-
-# Handle unknown text messages
-async def unknown_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text(
-        "❓ I'm not sure what you mean.\n"
-        "Use /help to see available commands."
-    )
-    # /end command - Ends any ongoing conversation
-async def end(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    await update.message.reply_text("🚫 Conversation ended. See you Again!!!")
-    return ConversationHandler.END
-
-# Main function to set up the bot
-def main():
-    app = Application.builder().token(BOT_TOKEN).build()
-
-    # Add command handlers
-    app.add_handler(CommandHandler("start", start))
-    app.add_handler(CommandHandler("showtask", showtask))
-    app.add_handler(CommandHandler("complete", complete))
-    app.add_handler(CommandHandler("deletetask", deletetask))
-    app.add_handler(CommandHandler("remind", remind))
-    app.add_handler(CommandHandler("history", history))
-    app.add_handler(CommandHandler("help", help_command))
-    app.add_handler(CommandHandler("end", end))
-
-    # Registration conversation handler
-    registration_handler = ConversationHandler(
-        entry_points=[CommandHandler("register", register)],
-        states={REGISTRATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_registration)]},
-        fallbacks=[CommandHandler("start", start),CommandHandler("end", end)],
-    )
-    app.add_handler(registration_handler)
-
-    # Task addition conversation handler
-    task_handler = ConversationHandler(
-        entry_points=[CommandHandler("addtask", addtask)],
-        states={ADDING_TODO: [MessageHandler(filters.TEXT & ~filters.COMMAND, add_todo_item)]},
-        fallbacks=[CommandHandler("donetask", donetask), CommandHandler("end", end)]
-    )
-    app.add_handler(task_handler)
-
-    # Handle unknown text messages
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, unknown_text))
-
-    # Handle unknown commands
-    app.add_handler(MessageHandler(filters.COMMAND, unknown))
-
-    #to end the conversation
-    app.add_handler(CommandHandler("end", end))
-
-    logging.info("🚀 Bot is now running...")
-    app.run_polling()
-
-
-if __name__ == "__main__":
+import logging
+import time
+import asyncio
+import tempfile
+from textwrap import shorten
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import (
+    Application, CommandHandler, MessageHandler, filters,
+    ConversationHandler, ContextTypes, CallbackQueryHandler
+)
+from storage import init_pool, get_pool, close_pool, reader, writer
+from scheduler import ReminderScheduler
+from cache import LRUCache
+from migrations import migrate
+from ingest import TaskBatcher, split_tasks
+from dispatch import UserOrderedUpdateProcessor
+from outbox import OutboxRateLimiter, PRIORITY_REMINDER, PRIORITY_BULK
+import metrics
+import stats
+import events
+import database
+import search
+import recurrence
+import reports
+from jobs import JobPool
+from retention import MaintenanceJob
+from persistence import SQLitePersistence
+from broadcast import Broadcaster
+from settings import ConfigError, Settings, load_settings
+
+# Importing this module has no side effects: configuration is read, the
+# database opened and its schema migrated by init_app(), which main() and
+# build_application() call once.
+logger = logging.getLogger(__name__)
+
+# The configuration in use, see settings.py; replaced by init_app()
+settings = Settings()
+
+# Conversation states
+ADDING_TODO = 1
+REGISTRATION = 2
+IMPORTING = 3
+
+# Task ingestion limits
+MAX_LISTED_TASKS = 10
+# Longest task text shown on a /showtask page
+MAX_TASK_PREVIEW = 200
+MAX_UPLOAD_BYTES = 1024 * 1024
+# Pending reminders shown by /reminders
+MAX_LISTED_REMINDERS = 20
+
+def setup_database():
+    """Bring every shard's schema up to date (see migrations.py)"""
+    versions = get_pool().run_write_all(migrate)
+    logger.info("Database setup complete (schema version %d)", max(versions))
+
+# Fires reminders from the reminders table, see scheduler.py
+reminder_scheduler = ReminderScheduler()
+
+# Admin announcements to every user, see broadcast.py
+broadcaster = Broadcaster()
+
+# Worker processes for big reports, see jobs.py; sized by init_app()
+jobs = JobPool()
+
+# In-process caches for the lookups almost every command starts with.
+# Writers below invalidate the affected user's entries.
+user_cache = LRUCache(maxsize=10000, ttl=600)
+task_list_cache = LRUCache(maxsize=2000, ttl=300)
+
+# /showtask pages: tasks per page and the status filters it understands
+PAGE_SIZE = 10
+TASK_FILTERS = (None, "pending", "completed")
+
+def invalidate_user_tasks(user_id):
+    """Drop every cached task view of a user: the first page of each filter"""
+    for status in TASK_FILTERS:
+        task_list_cache.invalidate((user_id, status))
+
+def invalidate_archived(user_ids):
+    """Archived tasks must disappear from cached pages too"""
+    for user_id in user_ids:
+        invalidate_user_tasks(user_id)
+
+# Archives old completed tasks, purges fired reminders and compacts the
+# database in the background, see retention.py; scheduled by init_app()
+maintenance = MaintenanceJob(0, on_archived=invalidate_archived)
+
+_initialized = False
+
+def init_app(config=None):
+    """Open the database, migrate its schema and size the background jobs.
+
+    config defaults to load_settings(). Runs once: later calls return the
+    settings already in use.
+    """
+    global settings, _initialized
+    if _initialized:
+        return settings
+    settings = config or load_settings()
+    slow_query = settings.slow_query_ms / 1000 if settings.slow_query_ms else None
+    init_pool(settings.db_file, slow_query=slow_query, shards=settings.db_shards)
+    setup_database()
+    database.merge_legacy(settings.legacy_users_db)
+    jobs.workers = settings.job_workers
+    jobs.threshold = settings.job_inline_threshold
+    maintenance.interval = settings.maintenance_interval_hours * 3600
+    maintenance.archive_after = settings.archive_after_days * 86400
+    maintenance.reminder_retention = settings.reminder_retention_days * 86400
+    _initialized = True
+    return settings
+
+# Database helper functions
+# Each helper receives a pooled connection and is awaited by the handlers;
+# the @reader/@writer decorators run it off the event loop.
+@reader
+def _fetch_user(conn, user_id):
+    cursor = conn.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
+    return cursor.fetchone()
+
+async def get_user(user_id):
+    """Get user from database (cached)"""
+    user = user_cache.get(user_id)
+    if user is None:
+        token = user_cache.token()
+        user = await _fetch_user(user_id)
+        if user is not None:
+            user_cache.set(user_id, user, token)
+    return user
+
+@writer
+def _register_user(conn, user_id, name, username):
+    now = int(time.time())
+    conn.execute(
+        "INSERT OR REPLACE INTO users (user_id, name, username, registered_on) VALUES (?, ?, ?, ?)",
+        (user_id, name, username, now)
+    )
+
+async def register_user(user_id, name, username):
+    """Register a new user"""
+    await _register_user(user_id, name, username)
+    user_cache.invalidate(user_id)
+
+@writer
+def _add_task(conn, user_id, task_text):
+    now = int(time.time())
+    cursor = conn.execute(
+        "INSERT INTO tasks (user_id, task, created_at, updated_at) VALUES (?, ?, ?, ?)",
+        (user_id, task_text, now, now)
+    )
+    stats.bump(conn, user_id, now, created=1)
+    events.record(conn, events.CREATED, user_id, cursor.lastrowid, now, now)
+    return cursor.lastrowid
+
+async def add_task(user_id, task_text):
+    """Add a new task for user"""
+    task_id = await _add_task(user_id, task_text)
+    invalidate_user_tasks(user_id)
+    return task_id
+
+@writer
+def _add_tasks(conn, user_id, task_texts):
+    now = int(time.time())
+    first_id = (conn.execute("SELECT max(id) FROM tasks").fetchone()[0] or 0) + 1
+    conn.executemany(
+        "INSERT INTO tasks (user_id, task, created_at, updated_at) VALUES (?, ?, ?, ?)",
+        [(user_id, text, now, now) for text in task_texts]
+    )
+    stats.bump(conn, user_id, now, created=len(task_texts))
+    events.add_tasks_since(conn, first_id, now)
+
+async def add_tasks(user_id, task_texts):
+    """Add several tasks for a user in a single transaction"""
+    await _add_tasks(user_id, task_texts)
+    invalidate_user_tasks(user_id)
+
+@reader
+def _fetch_task_page(conn, user_id, status, cursor, newer, limit):
+    # Keyset pagination on (created_at, id): each page starts right after
+    # the cursor row, so deep pages cost the same as the first one
+    sql = "SELECT id, task, status, created_at, due_at FROM tasks WHERE user_id = ?"
+    params = [user_id]
+    if status is not None:
+        sql += " AND status = ?"
+        params.append(status)
+    if cursor is not None:
+        sql += " AND (created_at, id) > (?, ?)" if newer else " AND (created_at, id) < (?, ?)"
+        params.extend(cursor)
+    sql += " ORDER BY created_at ASC, id ASC" if newer else " ORDER BY created_at DESC, id DESC"
+    sql += " LIMIT ?"
+    params.append(limit + 1)
+
+    rows = conn.execute(sql, params).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if newer:
+        rows.reverse()
+    return rows, more
+
+async def get_task_page(user_id, status=None, cursor=None, newer=False, limit=PAGE_SIZE):
+    """Get one page of a user's tasks, newest first.
+
+    cursor is the (created_at, id) of the first row of the current page
+    (newer=True) or of its last row (newer=False). Returns
+    (rows, has_newer, has_older); the first page is cached.
+    """
+    if cursor is None:
+        key = (user_id, status)
+        page = task_list_cache.get(key)
+        if page is None:
+            token = task_list_cache.token()
+            rows, more = await _fetch_task_page(user_id, status, None, False, limit)
+            page = (rows, False, more)
+            task_list_cache.set(key, page, token)
+        return page
+
+    rows, more = await _fetch_task_page(user_id, status, tuple(cursor), newer, limit)
+    if newer:
+        return rows, more, True
+    return rows, True, more
+
+def _task_state(conn, task_id, user_id=None):
+    """Get (user_id, status, created_at, task) of a task, or None.
+
+    With user_id, tasks of other users are treated as missing.
+    """
+    sql = "SELECT user_id, status, created_at, task FROM tasks WHERE id = ?"
+    params = [task_id]
+    if user_id is not None:
+        sql += " AND user_id = ?"
+        params.append(user_id)
+    return conn.execute(sql, params).fetchone()
+
+def _cancel_task_reminders(conn, task_id):
+    """Stop the pending reminders linked to a task (its due date reminder)"""
+    conn.execute("UPDATE reminders SET completed = 1 WHERE task_id = ? AND completed = 0", (task_id,))
+
+# Task and reminder ids are only unique within a shard (see storage.py),
+# so the helpers below always look them up through their owner.
+@writer
+def _update_task_status(conn, user_id, task_id, status):
+    state = _task_state(conn, task_id, user_id)
+    if state is None:
+        return None
+    user_id, old_status, created_at, task_text = state
+    now = int(time.time())
+    conn.execute(
+        "UPDATE tasks SET status = ?, updated_at = ? WHERE id = ?",
+        (status, now, task_id)
+    )
+    # Keep the /history rollup in step with completions
+    was_completed = old_status == "completed"
+    if was_completed != (status == "completed"):
+        stats.bump(conn, user_id, created_at, completed=-1 if was_completed else 1)
+        events.record(conn, events.REOPENED if was_completed else events.COMPLETED, user_id, task_id, created_at, now)
+    if status == "completed":
+        _cancel_task_reminders(conn, task_id)
+    return task_text
+
+async def update_task_status(user_id, task_id, status):
+    """Update the status of one of user_id's tasks.
+
+    Returns the task text, or None if there is no such task.
+    """
+    task_text = await _update_task_status(user_id, task_id, status)
+    if task_text is not None:
+        invalidate_user_tasks(user_id)
+    return task_text
+
+@writer
+def _update_task_text(conn, user_id, task_id, new_text):
+    state = _task_state(conn, task_id, user_id)
+    if state is None:
+        return 0
+    now = int(time.time())
+    conn.execute("UPDATE tasks SET task = ?, updated_at = ? WHERE id = ?", (new_text, now, task_id))
+    events.record(conn, events.EDITED, user_id, task_id, state[2], now)
+    return 1
+
+async def update_task_text(user_id, task_id, new_text):
+    """Update the text of one of user_id's tasks"""
+    if await _update_task_text(user_id, task_id, new_text):
+        invalidate_user_tasks(user_id)
+
+@writer
+def _delete_task(conn, user_id, task_id):
+    state = _task_state(conn, task_id, user_id)
+    if state is None:
+        return None
+    user_id, status, created_at, task_text = state
+    conn.execute("DELETE FROM tasks WHERE id = ?", (task_id,))
+    _cancel_task_reminders(conn, task_id)
+    stats.bump(conn, user_id, created_at, created=-1, completed=-(status == "completed"))
+    events.record(conn, events.DELETED, user_id, task_id, created_at, int(time.time()))
+    return task_text
+
+async def delete_task(user_id, task_id):
+    """Delete one of user_id's tasks.
+
+    Returns the task text, or None if there is no such task.
+    """
+    task_text = await _delete_task(user_id, task_id)
+    if task_text is not None:
+        invalidate_user_tasks(user_id)
+    return task_text
+
+@writer
+def _delete_all_user_tasks(conn, user_id):
+    stats.subtract_user(conn, user_id)
+    events.delete_user(conn, user_id, int(time.time()))
+    conn.execute("DELETE FROM tasks WHERE user_id = ?", (user_id,))
+    conn.execute("DELETE FROM tasks_archive WHERE user_id = ?", (user_id,))
+    conn.execute(
+        "UPDATE reminders SET completed = 1 WHERE user_id = ? AND task_id IS NOT NULL AND completed = 0",
+        (user_id,)
+    )
+
+async def delete_all_user_tasks(user_id):
+    """Delete all tasks for a user, archived ones included"""
+    await _delete_all_user_tasks(user_id)
+    invalidate_user_tasks(user_id)
+
+def _insert_reminder(conn, user_id, reminder_text, minutes, task_id=None, chat_id=None, due_at=None, repeat=None):
+    now = int(time.time())
+    if due_at is None:
+        due_at = now + minutes * 60
+    cursor = conn.execute(
+        "INSERT INTO reminders (user_id, task_id, reminder_text, reminder_time, created_at, due_at, chat_id, repeat) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (user_id, task_id, reminder_text, minutes, now, due_at, chat_id, repeat)
+    )
+    return cursor.lastrowid
+
+@writer
+def add_reminder(conn, user_id, reminder_text, minutes, task_id=None, chat_id=None, due_at=None, repeat=None):
+    """Add a reminder due at an absolute time (defaults to now + minutes).
+
+    repeat is a recurrence rule (see recurrence.py); due_at is its first firing.
+    """
+    return _insert_reminder(conn, user_id, reminder_text, minutes, task_id, chat_id, due_at, repeat)
+
+@writer
+def complete_reminder(conn, user_id, reminder_id):
+    """Mark a reminder of user_id as completed; returns whether it was pending"""
+    cursor = conn.execute(
+        "UPDATE reminders SET completed = 1 WHERE id = ? AND user_id = ? AND completed = 0",
+        (reminder_id, user_id)
+    )
+    return cursor.rowcount > 0
+
+@reader
+def get_pending_reminders(conn, user_id, limit=MAX_LISTED_REMINDERS):
+    """Get (id, text, due_at, repeat) of a user's pending reminders, soonest first"""
+    cursor = conn.execute(
+        "SELECT id, reminder_text, due_at, repeat FROM reminders "
+        "WHERE user_id = ? AND completed = 0 ORDER BY due_at LIMIT ?",
+        (user_id, limit)
+    )
+    return cursor.fetchall()
+
+@writer
+def _set_task_due(conn, user_id, task_id, due_at, chat_id):
+    state = _task_state(conn, task_id, user_id)
+    if state is None:
+        return None, None
+    task_text = state[3]
+    now = int(time.time())
+    conn.execute("UPDATE tasks SET due_at = ?, updated_at = ? WHERE id = ?", (due_at, now, task_id))
+    events.record(conn, events.DUE_SET, user_id, task_id, state[2], now)
+    # A task has at most one due date reminder: replace the old one
+    _cancel_task_reminders(conn, task_id)
+    if due_at is None:
+        return task_text, None
+    minutes = max(0, (due_at - int(time.time())) // 60)
+    reminder_id = _insert_reminder(
+        conn, user_id, f"Task #{task_id} is due: {task_text}", minutes,
+        task_id=task_id, chat_id=chat_id, due_at=due_at
+    )
+    return task_text, reminder_id
+
+async def set_task_due(user_id, task_id, due_at, chat_id=None):
+    """Set (or with None clear) the due date of one of user_id's tasks.
+
+    A reminder linked to the task fires at the due time. Returns the task
+    text, or None if there is no such task.
+    """
+    task_text, reminder_id = await _set_task_due(user_id, task_id, due_at, chat_id)
+    if task_text is not None:
+        invalidate_user_tasks(user_id)
+    if reminder_id is not None:
+        reminder_scheduler.schedule(due_at, get_pool().shard_for(user_id))
+    return task_text
+
+async def get_task_history(user_id, days=30, granularity="day"):
+    """Get task history for analytics from the daily rollup (see stats.py)"""
+    return await stats.get_history(user_id, days, granularity)
+
+# /start command
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    user = await get_user(user_id)
+
+    if not user:
+        await update.message.reply_text("👋 Welcome! Please enter your full name to register:")
+        return REGISTRATION  # Directly move to the registration step
+    else:
+        await update.message.reply_text(
+            f"👋 Welcome back, {user[1]}!\n\n"
+            "Use /addtask to add a task, /showtask to view tasks, and /deletetask to remove them.\n"
+            "For more commands, use /help"
+        )
+
+async def process_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    name = update.message.text
+    username = update.effective_user.username or "Not provided"
+
+    # Register user in database
+    await register_user(user_id, name, username)
+
+    await update.message.reply_text(
+        f"✅ Registration successful, {name}!\n\n"
+        "Use /addtask to add a task, /showtask to view tasks, and /help for all commands."
+    )
+    return ConversationHandler.END
+
+# Registration command
+async def register(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "📝 Let's get you registered!\n"
+        "Please send your full name:"
+    )
+    return REGISTRATION
+
+# Handle registration info
+async def process_registration(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    name = update.message.text
+    username = update.effective_user.username or "Not provided"
+    
+    # Register user in database
+    await register_user(user_id, name, username)
+    
+    await update.message.reply_text(
+        f"✅ Registration successful, {name}!\n\n"
+        "Use /addtask to add a task, /showtask to view tasks, and /help for all commands."
+    )
+    return ConversationHandler.END
+
+# /addtask command - Start adding tasks
+async def addtask(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    user = await get_user(user_id)
+    
+    # Check if user is registered
+    if not user:
+        await update.message.reply_text("⚠️ You need to register first. Please use /register")
+        return ConversationHandler.END
+    
+    await update.message.reply_text(
+        "📌 Send me tasks one by one, or paste a list with one task per line "
+        "(a .txt file works too). Type /donetask when finished."
+    )
+    return ADDING_TODO
+
+# Store a burst of task messages and answer with one summary
+async def store_task_batch(user_id, tasks, message):
+    await add_tasks(user_id, tasks)
+    
+    if message is None:
+        return
+    if len(tasks) == 1:
+        await message.reply_text(f"✅ Task added: {tasks[0]}")
+        return
+    shown = "\n".join(f"• {task}" for task in tasks[:MAX_LISTED_TASKS])
+    if len(tasks) > MAX_LISTED_TASKS:
+        shown += f"\n…and {len(tasks) - MAX_LISTED_TASKS} more"
+    await message.reply_text(f"✅ Added {len(tasks)} tasks:\n{shown}")
+
+# Messages sent within a short window are stored and answered together
+task_batcher = TaskBatcher(store_task_batch)
+
+# Any command sees the tasks just sent: store what is still waiting in
+# the coalescing window before the command's own handler runs
+async def flush_pending_tasks(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user is not None:
+        await task_batcher.flush(str(update.effective_user.id))
+
+# Handle task addition (one task per line)
+async def add_todo_item(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    tasks = split_tasks(update.message.text)
+    
+    if tasks:
+        task_batcher.add(user_id, tasks, update.message)
+    return ADDING_TODO
+
+# Handle a text file with one task per line
+async def add_todo_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    document = update.message.document
+    
+    if document.file_size and document.file_size > MAX_UPLOAD_BYTES:
+        await update.message.reply_text("⚠️ That file is too large. Please send at most 1 MB of tasks.")
+        return ADDING_TODO
+    
+    file = await document.get_file()
+    data = await file.download_as_bytearray()
+    tasks = split_tasks(data.decode("utf-8", errors="replace"))
+    
+    if tasks:
+        task_batcher.add(user_id, tasks, update.message)
+        await task_batcher.flush(user_id)
+    else:
+        await update.message.reply_text("📭 No tasks found in that file.")
+    return ADDING_TODO
+
+# /donetask command - Stop adding tasks
+async def donetask(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    # Store anything still waiting in the coalescing window first
+    await task_batcher.flush(str(update.effective_user.id))
+    await update.message.reply_text("🛑 Task entry stopped. Use /showtask to see your tasks.")
+    return ConversationHandler.END
+
+# Local date and time for due dates and reminders
+def format_time(timestamp):
+    local = time.localtime(timestamp)
+    if local.tm_year != time.localtime().tm_year:
+        return time.strftime("%a %d %b %Y %H:%M", local)
+    return time.strftime("%a %d %b %H:%M", local)
+
+# Render one /showtask page and its Newer/Older buttons
+def render_task_page(rows, status, has_newer, has_older):
+    title = f"📋 Your {status} tasks:" if status else "📋 Your tasks:"
+    task_list = "\n".join(
+        f"#{task_id} {shorten(task, MAX_TASK_PREVIEW)} - [{task_status}]"
+        + (f" ⏰ due {format_time(due_at)}" if due_at and task_status != "completed" else "")
+        for task_id, task, task_status, _, due_at in rows
+    )
+    text = f"{title}\n{task_list}\n\nUse /complete [#] or /deletetask [#] with the numbers shown."
+
+    # callback data: tasks:<filter>:<n(ewer)|o(lder)>:<created_at>:<id>
+    filter_code = status[0] if status else "a"
+    buttons = []
+    if has_newer:
+        created_at, task_id = rows[0][3], rows[0][0]
+        buttons.append(InlineKeyboardButton("◀️ Newer", callback_data=f"tasks:{filter_code}:n:{created_at}:{task_id}"))
+    if has_older:
+        created_at, task_id = rows[-1][3], rows[-1][0]
+        buttons.append(InlineKeyboardButton("Older ▶️", callback_data=f"tasks:{filter_code}:o:{created_at}:{task_id}"))
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+# Parse a task or reminder number as shown by the bot ("12" or "#12").
+# Ids are SQLite rowids: anything outside 1..2^63-1 can't be one, and
+# sqlite3 would raise OverflowError on it.
+def parse_task_id(arg):
+    task_id = int(arg.lstrip("#"))
+    if not 0 < task_id < 2 ** 63:
+        raise ValueError(f"not a valid id: {arg}")
+    return task_id
+
+# /showtask command - Show tasks one page at a time
+async def showtask(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    user = await get_user(user_id)
+    
+    # Check if user is registered
+    if not user:
+        await update.message.reply_text("⚠️ You need to register first. Please use /register")
+        return
+    
+    # Optional filter: /showtask [pending|completed]
+    status = context.args[0].lower() if context.args else None
+    if status not in TASK_FILTERS:
+        await update.message.reply_text("⚠️ Usage: /showtask [pending|completed]")
+        return
+    
+    # Get the first page from the database
+    rows, has_newer, has_older = await get_task_page(user_id, status)
+    
+    if rows:
+        text, markup = render_task_page(rows, status, has_newer, has_older)
+        await update.message.reply_text(text, reply_markup=markup)
+    else:
+        await update.message.reply_text("📭 No tasks available.")
+
+# Handle the Newer/Older buttons under a /showtask page
+async def showtask_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    user_id = str(query.from_user.id)
+    await query.answer()
+    
+    _, filter_code, direction, created_at, task_id = query.data.split(":")
+    status = {"a": None, "p": "pending", "c": "completed"}[filter_code]
+    rows, has_newer, has_older = await get_task_page(
+        user_id, status, cursor=(int(created_at), int(task_id)), newer=direction == "n"
+    )
+    
+    if rows:
+        text, markup = render_task_page(rows, status, has_newer, has_older)
+        await query.edit_message_text(text, reply_markup=markup)
+    else:
+        await query.edit_message_text("📭 No more tasks.")
+
+# /complete command - Mark a task as completed
+async def complete(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    user = await get_user(user_id)
+    
+    # Check if user is registered
+    if not user:
+        await update.message.reply_text("⚠️ You need to register first. Please use /register")
+        return
+    
+    # Get task number (as shown by /showtask) from command
+    args = context.args
+    if not args:
+        await update.message.reply_text("⚠️ Usage: /complete [task_number]")
+        return
+    
+    try:
+        task_id = parse_task_id(args[0])
+        
+        # Update task status in database, if it is one of the user's tasks
+        task_text = await update_task_status(user_id, task_id, "completed")
+        
+        if task_text is not None:
+            await update.message.reply_text(f"✅ Marked task as completed: {task_text}")
+        else:
+            await update.message.reply_text("⚠️ Invalid task number.")
+    except ValueError:
+        await update.message.reply_text("❌ Please provide a valid task number.")
+
+# /deletetask command - Delete a specific task or all tasks
+async def deletetask(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    user = await get_user(user_id)
+    
+    # Check if user is registered
+    if not user:
+        await update.message.reply_text("⚠️ You need to register first. Please use /register")
+        return
+    
+    args = context.args
+    if not args:
+        await update.message.reply_text("⚠️ Usage: /deletetask [task_number] or /deletetask all")
+        return
+
+    if args[0].lower() == "all":
+        # Delete all tasks from database
+        await delete_all_user_tasks(user_id)
+        await update.message.reply_text("🗑️ All tasks deleted.")
+    else:
+        try:
+            task_id = parse_task_id(args[0])
+            
+            # Delete task from database, if it is one of the user's tasks
+            task_text = await delete_task(user_id, task_id)
+            
+            if task_text is not None:
+                await update.message.reply_text(f"🗑️ Deleted task: {task_text}")
+            else:
+                await update.message.reply_text("⚠️ Invalid task number.")
+        except ValueError:
+            await update.message.reply_text("❌ Please provide a valid task number.")
+
+# /export [csv|jsonl] - Send all tasks and reminders back as a file
+async def export_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    user = await get_user(user_id)
+
+    # Check if user is registered
+    if not user:
+        await update.message.reply_text("⚠️ You need to register first. Please use /register")
+        return
+
+    # Export and import code is only loaded once someone uses it
+    import transfer
+
+    fmt = context.args[0].lower() if context.args else "csv"
+    if fmt not in transfer.FORMATS:
+        await update.message.reply_text("⚠️ Usage: /export [csv|jsonl]")
+        return
+
+    # Rows are streamed to a temporary file chunk by chunk, see transfer.py
+    with tempfile.TemporaryFile() as out:
+        tasks, reminders = await transfer.export_user(user_id, out, fmt)
+        if not tasks and not reminders:
+            await update.message.reply_text("📭 Nothing to export yet.")
+            return
+        if out.tell() > transfer.MAX_EXPORT_BYTES:
+            await update.message.reply_text("⚠️ Your export is larger than Telegram allows (50 MB).")
+            return
+        out.seek(0)
+        await update.message.reply_document(
+            document=out,
+            filename=f"todo-export.{fmt}",
+            caption=f"📦 {tasks} tasks and {reminders} reminders"
+        )
+
+# /import command - Ask for a file made by /export
+async def import_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    user = await get_user(user_id)
+
+    # Check if user is registered
+    if not user:
+        await update.message.reply_text("⚠️ You need to register first. Please use /register")
+        return ConversationHandler.END
+
+    await update.message.reply_text(
+        "📥 Send me a CSV or JSON-lines file as made by /export. "
+        "Its tasks and reminders are added to yours. Type /end to cancel."
+    )
+    return IMPORTING
+
+# Handle the uploaded /import file
+async def import_file(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    document = update.message.document
+    import transfer
+
+    if document.file_size and document.file_size > transfer.MAX_IMPORT_BYTES:
+        await update.message.reply_text("⚠️ That file is too large. Please send at most 20 MB.")
+        return IMPORTING
+
+    file = await document.get_file()
+    shard = get_pool().shard_for(user_id)
+    with tempfile.TemporaryFile() as data:
+        await file.download_to_memory(out=data)
+        data.seek(0)
+        fmt = transfer.detect_format(document.file_name, data.read(64))
+        data.seek(0)
+        tasks, reminders, skipped = await transfer.import_user(
+            user_id, data, fmt,
+            chat_id=str(update.effective_chat.id),
+            schedule=lambda reminder_id, due_at: reminder_scheduler.schedule(due_at, shard)
+        )
+    invalidate_user_tasks(user_id)
+
+    text = f"✅ Imported {tasks} tasks and {reminders} reminders."
+    if skipped:
+        text += f"\n⚠️ Skipped {skipped} rows that could not be read."
+    await update.message.reply_text(text)
+    return ConversationHandler.END
+
+# Render one page of /search results and its More button
+def render_search_page(text, rows, offset, has_more):
+    results = "\n".join(
+        f"#{task_id} {shorten(task, MAX_TASK_PREVIEW)} - [{status}]"
+        for task_id, task, status in rows
+    )
+    message = f"🔎 Results for \"{text}\" ({offset + 1}-{offset + len(rows)}):\n{results}"
+    buttons = []
+    if offset > 0:
+        buttons.append(InlineKeyboardButton("◀️ Back", callback_data=f"search:{max(0, offset - search.PAGE_SIZE)}"))
+    if has_more:
+        buttons.append(InlineKeyboardButton("More ▶️", callback_data=f"search:{offset + search.PAGE_SIZE}"))
+    return message, InlineKeyboardMarkup([buttons]) if buttons else None
+
+# /search command - Find tasks by words (prefixes match too)
+async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    user = await get_user(user_id)
+    
+    # Check if user is registered
+    if not user:
+        await update.message.reply_text("⚠️ You need to register first. Please use /register")
+        return
+    
+    text = " ".join(context.args)
+    if not text:
+        await update.message.reply_text("⚠️ Usage: /search [words]")
+        return
+    
+    rows, has_more = await search.search_tasks(user_id, text)
+    if rows:
+        # Remember the query for the More/Back buttons
+        context.user_data["search_query"] = text
+        message, markup = render_search_page(text, rows, 0, has_more)
+        await update.message.reply_text(message, reply_markup=markup)
+    else:
+        await update.message.reply_text(f"📭 No tasks match \"{text}\".")
+
+# Handle the More/Back buttons under /search results
+async def search_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    user_id = str(query.from_user.id)
+    await query.answer()
+    
+    text = context.user_data.get("search_query")
+    if not text:
+        await query.edit_message_text("⌛ This search has expired. Please use /search again.")
+        return
+    
+    offset = int(query.data.split(":")[1])
+    rows, has_more = await search.search_tasks(user_id, text, offset)
+    if rows:
+        message, markup = render_search_page(text, rows, offset, has_more)
+        await query.edit_message_text(message, reply_markup=markup)
+    else:
+        await query.edit_message_text("📭 No more results.")
+
+# /remind command - Set a one-off or recurring reminder
+async def remind(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    user = await get_user(user_id)
+    
+    # Check if user is registered
+    if not user:
+        await update.message.reply_text("⚠️ You need to register first. Please use /register")
+        return
+    
+    args = context.args
+    if len(args) < 2:
+        await update.message.reply_text(
+            "⚠️ Usage: /remind [minutes] [message]\n"
+            "or /remind every [2h/3 days/week] [message]\n"
+            "or /remind cron [min hour day month weekday] [message]"
+        )
+        return
+
+    now = int(time.time())
+    if args[0].lower() in ("every", "cron"):
+        try:
+            repeat, used = recurrence.parse_rule(args)
+        except ValueError as error:
+            await update.message.reply_text(f"❌ {error}")
+            return
+        reminder_text = " ".join(args[used:])
+        if not reminder_text:
+            await update.message.reply_text("⚠️ Please add a message after the repeat rule.")
+            return
+        # An interval first fires one interval from now, a cron rule at its next match
+        kind, _, spec = repeat.partition(" ")
+        due_at = now + int(spec) if kind == "every" else recurrence.next_after(repeat, now, now)
+        minutes = (due_at - now) // 60
+        reply = f"🔁 Reminder set {recurrence.describe(repeat)}, next at {format_time(due_at)}: {reminder_text}"
+    else:
+        try:
+            minutes = int(args[0])
+        except ValueError:
+            await update.message.reply_text("❌ Please provide a valid number for minutes.")
+            return
+        repeat = None
+        reminder_text = " ".join(args[1:])
+        due_at = now + minutes * 60
+        reply = f"⏳ Reminder set for {minutes} minutes: {reminder_text}"
+
+    # Add reminder to database
+    await add_reminder(
+        user_id, reminder_text, minutes,
+        chat_id=str(update.effective_chat.id), due_at=due_at, repeat=repeat
+    )
+    await update.message.reply_text(reply)
+
+    # The scheduler reads due reminders from the database; it only needs to
+    # know if this one is due before whatever it is waiting for
+    reminder_scheduler.schedule(due_at, get_pool().shard_for(user_id))
+
+# /reminders command - List pending reminders
+async def reminders_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    user = await get_user(user_id)
+
+    # Check if user is registered
+    if not user:
+        await update.message.reply_text("⚠️ You need to register first. Please use /register")
+        return
+
+    rows = await get_pending_reminders(user_id)
+    if not rows:
+        await update.message.reply_text("📭 No pending reminders.")
+        return
+    reminder_list = "\n".join(
+        f"#{reminder_id} {format_time(due_at)} "
+        + (f"({recurrence.describe(repeat)}) " if repeat else "")
+        + shorten(text, MAX_TASK_PREVIEW)
+        for reminder_id, text, due_at, repeat in rows
+    )
+    await update.message.reply_text(
+        f"⏰ Your reminders:\n{reminder_list}\n\nUse /cancelremind [#] to stop one."
+    )
+
+# /cancelremind command - Stop a pending or recurring reminder
+async def cancelremind(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+
+    if not context.args:
+        await update.message.reply_text("⚠️ Usage: /cancelremind [reminder_number]")
+        return
+    try:
+        reminder_id = parse_task_id(context.args[0])
+    except ValueError:
+        await update.message.reply_text("❌ Please provide a valid reminder number.")
+        return
+
+    if await complete_reminder(user_id, reminder_id):
+        await update.message.reply_text(f"🔕 Reminder #{reminder_id} cancelled.")
+    else:
+        await update.message.reply_text("⚠️ Invalid reminder number. See /reminders.")
+
+# /due command - Set or clear a task's due date
+async def due(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    user = await get_user(user_id)
+
+    # Check if user is registered
+    if not user:
+        await update.message.reply_text("⚠️ You need to register first. Please use /register")
+        return
+
+    args = context.args
+    if len(args) < 2:
+        await update.message.reply_text(
+            "⚠️ Usage: /due [task_number] [2026-05-01 14:30 / 14:30 / 3d / 2h / off]"
+        )
+        return
+    try:
+        task_id = parse_task_id(args[0])
+    except ValueError:
+        await update.message.reply_text("❌ Please provide a valid task number.")
+        return
+
+    if args[1].lower() == "off":
+        due_at = None
+    else:
+        try:
+            due_at, _ = recurrence.parse_due(args[1:], time.time())
+        except ValueError as error:
+            await update.message.reply_text(f"❌ {error}")
+            return
+        if due_at <= time.time():
+            await update.message.reply_text("⚠️ That time has already passed.")
+            return
+
+    task_text = await set_task_due(user_id, task_id, due_at, chat_id=str(update.effective_chat.id))
+    if task_text is None:
+        await update.message.reply_text("⚠️ Invalid task number.")
+    elif due_at is None:
+        await update.message.reply_text(f"🗓️ Due date removed: {task_text}")
+    else:
+        await update.message.reply_text(f"🗓️ Due {format_time(due_at)}: {task_text}")
+
+# /history command - Show task history
+async def history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user_id = str(update.effective_user.id)
+    user = await get_user(user_id)
+    
+    # Check if user is registered
+    if not user:
+        await update.message.reply_text("⚠️ You need to register first. Please use /register")
+        return
+    
+    # Optional arguments: /history [days] [day|week|month]
+    days = 30
+    granularity = "day"
+    for arg in context.args:
+        if arg.isdigit():
+            days = max(1, min(int(arg), stats.MAX_DAYS))
+        elif arg.lower() in stats.GRANULARITIES:
+            granularity = arg.lower()
+        else:
+            await update.message.reply_text("⚠️ Usage: /history [days] [day|week|month]")
+            return
+    
+    # Get the user's name from the database
+    user_name = user[1]  # Index 1 contains the name field from the users table
+    
+    # Get history from database
+    history_data = await get_task_history(user_id, days, granularity)
+    
+    if history_data:
+        history_text = await jobs.run(
+            reports.render_history, user_name, days, history_data, size=len(history_data)
+        )
+        await update.message.reply_text(history_text)
+    else:
+        await update.message.reply_text(f"📭 No task history available for {user_name} in the last {days} days.")
+
+# /broadcast command - Admins only: message every registered user
+async def broadcast_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in settings.admins:
+        await update.message.reply_text("⛔ /broadcast is for admins only.")
+        return
+
+    _, _, text = update.message.text.partition(" ")
+    text = text.strip()
+    if not text:
+        await update.message.reply_text(
+            "⚠️ Usage: /broadcast [message]\n"
+            "/broadcast status - progress of the running broadcast\n"
+            "/broadcast cancel - stop it"
+        )
+        return
+
+    if text.lower() == "status":
+        current = broadcaster.current
+        if current is None:
+            await update.message.reply_text("📭 No broadcast has run since the bot started.")
+            return
+        state = "running" if broadcaster.running else "cancelled" if current.cancelled else "finished"
+        await update.message.reply_text(
+            f"📣 Broadcast #{current.id} ({state}): {current.done}/{current.total} users, "
+            f"{current.failed} failed, {current.rate():.0f} messages/s"
+        )
+        return
+
+    if text.lower() == "cancel":
+        cancelled = await broadcaster.cancel()
+        if cancelled is None:
+            await update.message.reply_text("📭 No broadcast is running.")
+        return
+
+    if broadcaster.running:
+        await update.message.reply_text(
+            f"⚠️ Broadcast #{broadcaster.current.id} is still running. "
+            "Use /broadcast status or /broadcast cancel."
+        )
+        return
+    started = await broadcaster.broadcast(text, update.effective_chat.id)
+    await update.message.reply_text(
+        f"📣 Broadcast #{started.id} started for {started.total} users. "
+        "I'll report here when it's done."
+    )
+
+# /stats command - Admins only: task activity of all users, from the task event log
+async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id not in settings.admins:
+        await update.message.reply_text("⛔ /stats is for admins only.")
+        return
+
+    days = 30
+    if context.args:
+        if len(context.args) > 1 or not context.args[0].isdigit():
+            await update.message.reply_text("⚠️ Usage: /stats [days]")
+            return
+        days = max(1, min(int(context.args[0]), stats.MAX_DAYS))
+
+    # Imported here: only admins asking for /stats need NumPy loaded
+    import analytics
+
+    # Big shards are summarized in the job pool's worker processes
+    summary = await analytics.summarize(days, jobs=jobs)
+    if not summary.events:
+        await update.message.reply_text(f"📭 No task activity in the last {days} days.")
+        return
+    await update.message.reply_text(
+        reports.render_event_stats(summary, events.KINDS, analytics.TASK_COUNT_LABELS)
+    )
+
+# Report the end of a broadcast to the admin who started it
+async def report_broadcast(app, chat_id, broadcast):
+    summary = broadcast.summary()
+    title = "🚫 Broadcast #{id} cancelled" if broadcast.cancelled else "✅ Broadcast #{id} finished"
+    await app.bot.send_message(
+        chat_id=chat_id,
+        text=f"{title.format(**summary)}: {summary['sent']} sent, {summary['failed']} failed "
+             f"of {summary['total']} users in {summary['seconds']:.0f}s ({summary['per_second']:.0f}/s)."
+    )
+
+# /help command - Show available commands
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    help_text = (
+        "📚 **To-Do Bot Commands**\n\n"
+        "/register - Register with the bot\n"
+        "/addtask - Start adding tasks\n"
+        "/donetask - Finish adding tasks\n"
+        "/showtask [pending/completed] - View your tasks, page by page\n"
+        "/complete [#] - Mark a task as completed\n"
+        "/deletetask [#/all] - Delete a specific task or all tasks\n"
+        "/search [words] - Find tasks by words\n"
+        "/export [csv/jsonl] - Download all your tasks and reminders\n"
+        "/import - Add tasks and reminders from an exported file\n"
+        "/remind [min] [msg] - Set a reminder\n"
+        "/remind every [2h/day/week] [msg] - Set a recurring reminder\n"
+        "/reminders - List your pending reminders\n"
+        "/cancelremind [#] - Stop a reminder\n"
+        "/due [#] [date/time/3d/off] - Set a task's due date\n"
+        "/end - End of Conversation\n"
+        "/history [days] [day/week/month] - View your task history\n"
+        "/help - Show this help message\n\n"
+        "🌟 **Tips**:\n"
+        "• All your tasks are saved in the database\n"
+        "• Your task history is preserved for analytics\n"
+        "• You can see your productivity trends with /history"
+    )
+    await update.message.reply_text(help_text)
+
+# Handle unknown commands
+async def unknown(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "🤖 Sorry, I didn't understand that command.\n"
+        "Use /help to see available commands."
+    )
+
+# Handle unknown text messages
+async def unknown_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await update.message.reply_text(
+        "❓ I'm not sure what you mean.\n"
+        "Use /help to see available commands."
+    )
+    # /end command - Ends any ongoing conversation
+async def end(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    await task_batcher.flush(str(update.effective_user.id))
+    await update.message.reply_text("🚫 Conversation ended. See you Again!!!")
+    return ConversationHandler.END
+
+# Start the reminder scheduler once the bot is ready
+async def on_startup(app: Application):
+    async def send(chat_id, text):
+        # Reminder bursts queue behind interactive replies
+        await app.bot.send_message(chat_id=chat_id, text=text, rate_limit_args=PRIORITY_REMINDER)
+
+    await reminder_scheduler.start(send)
+
+    async def send_bulk(chat_id, text):
+        # Broadcasts queue behind replies and reminders
+        await app.bot.send_message(chat_id=chat_id, text=text, rate_limit_args=PRIORITY_BULK)
+
+    await broadcaster.start(send_bulk, notify=lambda chat_id, broadcast: report_broadcast(app, chat_id, broadcast))
+    maintenance.start()
+    app.persistence.start(app)
+    if settings.metrics_port:
+        app.bot_data["metrics_server"] = await metrics.serve(settings.metrics_listen, settings.metrics_port)
+
+# Stop the scheduler and close pooled database connections when the bot stops
+async def on_shutdown(app: Application):
+    server = app.bot_data.pop("metrics_server", None)
+    if server is not None:
+        server.close()
+        await server.wait_closed()
+    await reminder_scheduler.stop()
+    # An unfinished broadcast resumes from its checkpoint on the next start
+    await broadcaster.stop()
+    await maintenance.stop()
+    await app.persistence.stop()
+    # Tasks still in the coalescing window are stored, unanswered: the bot
+    # can't send any more
+    await task_batcher.flush_all()
+    # Running report jobs finish before the database goes away
+    await jobs.shutdown()
+    logger.info("User cache: %s", user_cache.stats())
+    logger.info("Task list cache: %s", task_list_cache.stats())
+    close_pool()
+
+# Queue depths and scheduler state, read whenever /metrics is scraped
+def register_gauges(app, update_processor, outbox):
+    gauge = metrics.REGISTRY.gauge
+    gauge("bot_update_queue_depth", "Updates fetched but not dispatched yet", app.update_queue.qsize)
+    gauge("bot_outbox_queue_depth", "Outgoing requests waiting for the global rate limit", outbox.queue_depth)
+    gauge("bot_reminders_pending", "Reminders scheduled and not fired yet", lambda: len(reminder_scheduler))
+    gauge("bot_reminders_fired", "Reminders fired since start", lambda: reminder_scheduler.fired)
+    gauge("bot_user_cache_hit_rate", "Hit rate of the user cache", lambda: user_cache.stats()["hit_rate"])
+    if isinstance(update_processor, UserOrderedUpdateProcessor):
+        gauge("bot_updates_in_flight", "Updates running or waiting for their user's turn",
+              lambda: update_processor.pending)
+        gauge("bot_updates_dropped", "Updates dropped from flooding users since start",
+              lambda: update_processor.dropped)
+
+# Build the Application with all handlers registered, starting the app
+# first (see init_app) if that has not happened yet
+def build_application(token=None, update_processor=None, base_url=None):
+    init_app()
+    token = token or settings.bot_token
+    if not token:
+        raise ConfigError("❌ ERROR: Bot token not found in environment variables.")
+    outbox = OutboxRateLimiter()
+    # Conversations survive restarts and end after a while idle, see persistence.py
+    persistence = SQLitePersistence(
+        flush_interval=settings.persistence_flush_ms / 1000, ttl=settings.conversation_ttl_minutes * 60
+    )
+    builder = (
+        Application.builder().token(token)
+        # Every outgoing request goes through the rate-limited outbox
+        .rate_limiter(outbox)
+        .persistence(persistence)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if update_processor is not None:
+        # Concurrent handlers need as many HTTP connections to send replies
+        builder = (
+            builder.concurrent_updates(update_processor)
+            .connection_pool_size(update_processor.workers)
+        )
+    if base_url is not None:
+        builder = builder.base_url(base_url)
+    app = builder.build()
+
+    # Runs first for every command, see flush_pending_tasks
+    app.add_handler(MessageHandler(filters.COMMAND, flush_pending_tasks), group=-1)
+
+    # Add command handlers
+    app.add_handler(CommandHandler("start", start))
+    app.add_handler(CommandHandler("showtask", showtask))
+    app.add_handler(CallbackQueryHandler(showtask_page, pattern=r"^tasks:"))
+    app.add_handler(CommandHandler("complete", complete))
+    app.add_handler(CommandHandler("deletetask", deletetask))
+    app.add_handler(CommandHandler("search", search_command))
+    app.add_handler(CallbackQueryHandler(search_page, pattern=r"^search:"))
+    app.add_handler(CommandHandler("export", export_command))
+    app.add_handler(CommandHandler("remind", remind))
+    app.add_handler(CommandHandler("reminders", reminders_command))
+    app.add_handler(CommandHandler("cancelremind", cancelremind))
+    app.add_handler(CommandHandler("due", due))
+    app.add_handler(CommandHandler("history", history))
+    app.add_handler(CommandHandler("broadcast", broadcast_command))
+    app.add_handler(CommandHandler("stats", stats_command))
+    app.add_handler(CommandHandler("help", help_command))
+
+    # Registration conversation handler
+    registration_handler = ConversationHandler(
+        entry_points=[CommandHandler("register", register)],
+        states={REGISTRATION: [MessageHandler(filters.TEXT & ~filters.COMMAND, process_registration)]},
+        fallbacks=[CommandHandler("start", start),CommandHandler("end", end)],
+        name="registration",
+        persistent=True,
+    )
+    app.add_handler(registration_handler)
+
+    # Task addition conversation handler
+    task_handler = ConversationHandler(
+        entry_points=[CommandHandler("addtask", addtask)],
+        states={ADDING_TODO: [
+            MessageHandler(filters.TEXT & ~filters.COMMAND, add_todo_item),
+            MessageHandler(filters.Document.TEXT, add_todo_file),
+        ]},
+        fallbacks=[CommandHandler("donetask", donetask), CommandHandler("end", end)],
+        name="add_task",
+        persistent=True,
+    )
+    app.add_handler(task_handler)
+
+    # File import conversation handler
+    import_handler = ConversationHandler(
+        entry_points=[CommandHandler("import", import_command)],
+        states={IMPORTING: [MessageHandler(filters.Document.ALL, import_file)]},
+        fallbacks=[CommandHandler("end", end)],
+        name="import",
+        persistent=True,
+    )
+    app.add_handler(import_handler)
+    persistence.track(registration_handler, task_handler, import_handler)
+
+    # /end outside a conversation; registered after the conversation
+    # handlers, so that inside one their /end fallback ends it
+    app.add_handler(CommandHandler("end", end))
+
+    # Handle unknown text messages
+    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, unknown_text))
+
+    # Handle unknown commands
+    app.add_handler(MessageHandler(filters.COMMAND, unknown))
+
+    # Count and time every handler, see metrics.py
+    metrics.instrument_application(app)
+    register_gauges(app, update_processor, outbox)
+    return app
+
+# Main function to set up the bot
+def main():
+    # Enable logging
+    logging.basicConfig(
+        format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO
+    )
+    config = load_settings().check()
+    print("✅ Bot token loaded successfully!")
+    init_app(config)
+
+    # Updates run concurrently, but each user's updates stay in order
+    processor = UserOrderedUpdateProcessor(
+        config.update_workers, config.max_pending_updates, config.max_pending_per_user,
+        shards=config.db_shards
+    )
+
+    if config.bot_mode == "webhook":
+        # Webhook support needs aiohttp, so only import it when asked for
+        from webhook import run_webhook
+
+        app = build_application(update_processor=processor)
+        asyncio.run(run_webhook(
+            app, processor, config.webhook_url,
+            listen=config.webhook_listen, port=config.webhook_port, secret_token=config.webhook_secret
+        ))
+        return
+
+    app = build_application(update_processor=processor)
+    logging.info("🚀 Bot is now running...")
+    app.run_polling()
+
+
+if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,276 @@
+"""Admin /broadcast: one message to every registered user.
+
+Broadcaster reads user ids from `users` in keyset-paginated chunks
+(user_id > last seen, CHUNK_SIZE at a time), so memory use does not grow
+with the number of users. Each chunk is sent with at most `concurrency`
+requests in flight. Sends go through the outbox (outbox.py) at
+PRIORITY_BULK: they keep to Telegram's rate limits, wait out 429 answers
+and queue behind interactive replies and reminders.
+
+Every shard's `broadcasts` table records the last user id of each
+finished chunk, so a broadcast interrupted by a restart is resumed where
+it stopped; at most the chunk that was in flight is sent twice. Users who
+blocked the bot, or can't be reached, count as failed.
+"""
+import asyncio
+import logging
+import time
+
+from metrics import REGISTRY
+from storage import get_pool, shard_reader, shard_writer
+
+logger = logging.getLogger(__name__)
+
+# Users read per query and checkpoint
+CHUNK_SIZE = 1000
+# Send requests in flight at once
+CONCURRENCY = 64
+# Seconds between progress lines in the log
+LOG_INTERVAL = 30
+
+MESSAGES = REGISTRY.counter("bot_broadcast_messages_total", "Broadcast messages by result", ("result",))
+
+
+def create_table(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS broadcasts (
+        id INTEGER PRIMARY KEY,
+        text TEXT NOT NULL,
+        created_by TEXT NOT NULL,
+        created_at INTEGER NOT NULL,
+        last_user_id TEXT NOT NULL DEFAULT '',
+        sent INTEGER NOT NULL DEFAULT 0,
+        failed INTEGER NOT NULL DEFAULT 0,
+        finished_at INTEGER,
+        cancelled INTEGER NOT NULL DEFAULT 0
+    )
+    ''')
+
+
+# A broadcast has a row in every shard (same id) with that shard's progress
+@shard_writer
+def create_broadcast(conn, broadcast_id, text, created_by, now):
+    conn.execute(
+        "INSERT INTO broadcasts (id, text, created_by, created_at) VALUES (?, ?, ?, ?)",
+        (broadcast_id, text, created_by, now)
+    )
+
+@shard_reader
+def get_next_id(conn):
+    return (conn.execute("SELECT max(id) FROM broadcasts").fetchone()[0] or 0) + 1
+
+@shard_reader
+def get_unfinished(conn):
+    """Get (id, text, created_by, created_at, last_user_id, sent, failed) of unfinished broadcasts"""
+    cursor = conn.execute(
+        "SELECT id, text, created_by, created_at, last_user_id, sent, failed FROM broadcasts "
+        "WHERE finished_at IS NULL ORDER BY id"
+    )
+    return cursor.fetchall()
+
+@shard_reader
+def get_user_chunk(conn, after, limit):
+    """Get the next `limit` user ids after `after`, in user_id order (the primary key)"""
+    cursor = conn.execute("SELECT user_id FROM users WHERE user_id > ? ORDER BY user_id LIMIT ?", (after, limit))
+    return [row[0] for row in cursor]
+
+@shard_reader
+def count_users(conn, after=""):
+    return conn.execute("SELECT count(*) FROM users WHERE user_id > ?", (after,)).fetchone()[0]
+
+@shard_writer
+def save_progress(conn, broadcast_id, last_user_id, sent, failed):
+    conn.execute(
+        "UPDATE broadcasts SET last_user_id = ?, sent = sent + ?, failed = failed + ? WHERE id = ?",
+        (last_user_id, sent, failed, broadcast_id)
+    )
+
+@shard_writer
+def finish_broadcast(conn, broadcast_id, now, cancelled=False):
+    conn.execute(
+        "UPDATE broadcasts SET finished_at = ?, cancelled = ? WHERE id = ? AND finished_at IS NULL",
+        (now, int(cancelled), broadcast_id)
+    )
+
+
+class Broadcast:
+    """Progress of one broadcast in this process"""
+
+    def __init__(self, broadcast_id, text, created_by, total, sent=0, failed=0):
+        self.id = broadcast_id
+        self.text = text
+        self.created_by = created_by
+        self.total = total
+        # Totals including earlier runs of a resumed broadcast
+        self.sent = sent
+        self.failed = failed
+        # This run only, for its throughput
+        self.started = time.perf_counter()
+        self.run_sent = 0
+        self.run_failed = 0
+        self.cancelled = False
+        self.task = None
+
+    @property
+    def done(self):
+        return self.sent + self.failed
+
+    def rate(self):
+        elapsed = time.perf_counter() - self.started
+        return (self.run_sent + self.run_failed) / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        return {
+            "id": self.id, "total": self.total, "sent": self.sent, "failed": self.failed,
+            "seconds": round(time.perf_counter() - self.started, 1), "per_second": round(self.rate(), 1),
+            "cancelled": self.cancelled,
+        }
+
+
+class Broadcaster:
+    """Runs one broadcast at a time over every shard.
+
+    send is an async callable taking (chat_id, text); notify, if given, is
+    called with (created_by, Broadcast) when a broadcast ends.
+    """
+
+    def __init__(self, chunk_size=CHUNK_SIZE, concurrency=CONCURRENCY, clock=time.time):
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self.clock = clock
+        self.current = None
+        self._send = None
+        self._notify = None
+
+    async def start(self, send, notify=None):
+        """Resume a broadcast a restart interrupted, if any"""
+        self._send = send
+        self._notify = notify
+        unfinished = {}
+        pool = get_pool()
+        for shard in range(len(pool.shards)):
+            for broadcast_id, text, created_by, _, last_user_id, sent, failed in await get_unfinished.on_shard(shard):
+                entry = unfinished.setdefault(broadcast_id, [text, created_by, {}, 0, 0])
+                entry[2][shard] = last_user_id
+                entry[3] += sent
+                entry[4] += failed
+        for broadcast_id, (text, created_by, cursors, sent, failed) in sorted(unfinished.items()):
+            if self.current is not None:
+                # Only one runs at a time; older leftovers are closed
+                logger.warning("Dropping unfinished broadcast %d, %d is resumed", broadcast_id, self.current.id)
+                for shard in cursors:
+                    await finish_broadcast.on_shard(shard, broadcast_id, int(self.clock()), True)
+                continue
+            total = sent + failed
+            for shard, last_user_id in cursors.items():
+                total += await count_users.on_shard(shard, last_user_id)
+            self.current = Broadcast(broadcast_id, text, created_by, total, sent, failed)
+            logger.info("Resuming broadcast %d: %d of %d users done", broadcast_id, sent + failed, total)
+            self.current.task = asyncio.create_task(self._run(self.current, cursors))
+
+    async def stop(self):
+        """Stop sending; the broadcast resumes from its checkpoints on the next start"""
+        if self.current is not None and self.current.task is not None:
+            self.current.task.cancel()
+            try:
+                await self.current.task
+            except asyncio.CancelledError:
+                pass
+        self.current = None
+
+    @property
+    def running(self):
+        return self.current is not None and not self.current.task.done()
+
+    async def broadcast(self, text, created_by):
+        """Start sending text to every user; returns the Broadcast"""
+        if self.running:
+            raise RuntimeError(f"broadcast {self.current.id} is still running")
+        pool = get_pool()
+        shards = range(len(pool.shards))
+        # The same id in every shard
+        broadcast_id = max([await get_next_id.on_shard(shard) for shard in shards])
+        now = int(self.clock())
+        total = 0
+        for shard in shards:
+            await create_broadcast.on_shard(shard, broadcast_id, text, str(created_by), now)
+            total += await count_users.on_shard(shard)
+        self.current = Broadcast(broadcast_id, text, str(created_by), total)
+        logger.info("Broadcast %d started for %d users", broadcast_id, total)
+        self.current.task = asyncio.create_task(self._run(self.current, {shard: "" for shard in shards}))
+        return self.current
+
+    async def cancel(self):
+        """Cancel the running broadcast for good; returns it, or None"""
+        broadcast = self.current
+        if not self.running:
+            return None
+        broadcast.cancelled = True
+        broadcast.task.cancel()
+        try:
+            await broadcast.task
+        except asyncio.CancelledError:
+            pass
+        return broadcast
+
+    async def _run(self, broadcast, cursors):
+        slots = asyncio.Semaphore(self.concurrency)
+        logger_task = asyncio.create_task(self._log_progress(broadcast))
+        try:
+            # Shards are sent concurrently; the outbox keeps the overall pace
+            await asyncio.gather(*(
+                self._run_shard(broadcast, shard, after, slots) for shard, after in cursors.items()
+            ))
+        except asyncio.CancelledError:
+            if not broadcast.cancelled:
+                # Stopped with the bot: the checkpoints stay for the next start
+                raise
+            for shard in cursors:
+                await finish_broadcast.on_shard(shard, broadcast.id, int(self.clock()), True)
+            logger.info("Broadcast %d cancelled: %s", broadcast.id, broadcast.summary())
+        else:
+            for shard in cursors:
+                await finish_broadcast.on_shard(shard, broadcast.id, int(self.clock()))
+            logger.info("Broadcast %d finished: %s", broadcast.id, broadcast.summary())
+        finally:
+            logger_task.cancel()
+        if self._notify is not None:
+            try:
+                await self._notify(broadcast.created_by, broadcast)
+            except Exception:
+                logger.exception("Could not report broadcast %d", broadcast.id)
+
+    async def _run_shard(self, broadcast, shard, after, slots):
+        while True:
+            user_ids = await get_user_chunk.on_shard(shard, after, self.chunk_size)
+            if not user_ids:
+                return
+            results = await asyncio.gather(*(self._send_one(user_id, broadcast.text, slots) for user_id in user_ids))
+            sent = sum(results)
+            failed = len(results) - sent
+            after = user_ids[-1]
+            await save_progress.on_shard(shard, broadcast.id, after, sent, failed)
+            broadcast.sent += sent
+            broadcast.failed += failed
+            broadcast.run_sent += sent
+            broadcast.run_failed += failed
+
+    async def _send_one(self, user_id, text, slots):
+        async with slots:
+            try:
+                await self._send(int(user_id), text)
+            except asyncio.CancelledError:
+                raise
+            except Exception as exc:
+                # Blocked the bot, deleted account, or still flooded after retries
+                logger.debug("Broadcast to %s failed: %s", user_id, exc)
+                MESSAGES.inc("failed")
+                return False
+        MESSAGES.inc("sent")
+        return True
+
+    async def _log_progress(self, broadcast):
+        while True:
+            await asyncio.sleep(LOG_INTERVAL)
+            logger.info("Broadcast %d: %d/%d done, %d failed, %.0f/s",
+                        broadcast.id, broadcast.done, broadcast.total, broadcast.failed, broadcast.rate())
@@ -0,0 +1,81 @@
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Small in-process LRU cache with a per-entry TTL and hit/miss counters.
+
+    Not thread-safe: it is only used from the event loop thread.
+    """
+
+    def __init__(self, maxsize=1024, ttl=300.0, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        # Bumped on every invalidation; the value at each key's latest
+        # invalidation is kept for the last maxsize keys, see token()/set()
+        self._generation = 0
+        self._invalidated = OrderedDict()
+        # Tokens older than this are refused for any key: clear() was
+        # called, or the key's invalidation was forgotten
+        self._floor = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < self.clock():
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def token(self):
+        """Take before loading a value from the database, pass to set()"""
+        return self._generation
+
+    def set(self, key, value, token=None):
+        """Store a value, unless this key was invalidated since token was taken.
+
+        This keeps a slow read that raced with a write from caching stale
+        data, without refusing fills of keys nobody wrote to.
+        """
+        if token is not None and (token < self._floor or self._invalidated.get(key, 0) > token):
+            return
+        self._data[key] = (self.clock() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def invalidate(self, key):
+        self._generation += 1
+        self._data.pop(key, None)
+        self._invalidated[key] = self._generation
+        self._invalidated.move_to_end(key)
+        if len(self._invalidated) > self.maxsize:
+            _, self._floor = self._invalidated.popitem(last=False)
+
+    def clear(self):
+        self._generation += 1
+        self._floor = self._generation
+        self._invalidated.clear()
+        self._data.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0,
+        }
@@ -1,20 +1,194 @@
-import sqlite3
-
-# Connect to the database
-conn = sqlite3.connect("users.db")
-cursor = conn.cursor()
-
-# Create users table
-cursor.execute("""
-CREATE TABLE IF NOT EXISTS users (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    name TEXT,
-    email TEXT
-)
-""")
-conn.commit()
-
-# Save user data
-def save_user(name, email):
-    cursor.execute("INSERT INTO users (name, email) VALUES (?, ?)", (name, email))
-    conn.commit()
+"""Name/email contacts, kept in the bot's own database.
+
+This module used to open a separate users.db at import time, with one
+module-level connection and a shared cursor for every caller. Its rows
+now live in the `contacts` table of todo_bot.db and go through the same
+storage pool as everything else (storage.py: one connection per pool
+thread, nothing opened on import).
+
+Contacts are keyed by their email, lower-cased: a unique index keeps one
+row per address, and with DB_SHARDS > 1 the email picks the shard the way
+a user id does. save_user() and upsert_users() insert a contact or update
+the one with that email; bulk upserts take one executemany per shard and
+chunk.
+
+An existing users.db is merged once, by botfinal.init_app(), and renamed
+to users.db.merged. It can also be merged by hand, with the bot stopped:
+
+    python database.py merge [users.db] [todo_bot.db]
+"""
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+from storage import get_pool, reader, shard_reader, writer
+
+logger = logging.getLogger(__name__)
+
+LEGACY_DB = "users.db"
+# Rows per executemany when upserting or merging in bulk
+CHUNK_SIZE = 1000
+
+
+def create_tables(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS contacts (
+        id INTEGER PRIMARY KEY,
+        name TEXT,
+        email TEXT,
+        created_at INTEGER NOT NULL,
+        updated_at INTEGER NOT NULL
+    )
+    ''')
+    conn.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_contacts_email ON contacts (email)")
+    # Telegram usernames ignore case. Not unique: a username freed by one
+    # account can be taken by another before the first re-registers.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_username ON users (username COLLATE NOCASE)")
+
+
+def normalize_email(email):
+    """Lower-cased and stripped, or None for a blank address"""
+    email = (email or "").strip().lower()
+    return email or None
+
+
+def _upsert_contacts(conn, rows, now):
+    # Contacts without an email never conflict and are always added
+    conn.executemany(
+        "INSERT INTO contacts (name, email, created_at, updated_at) VALUES (?, ?, ?, ?) "
+        "ON CONFLICT (email) DO UPDATE SET name = excluded.name, updated_at = excluded.updated_at",
+        [(name, email, now, now) for name, email in rows]
+    )
+    return len(rows)
+
+
+def _by_shard(rows):
+    """Group (name, email) rows by the shard of their normalized email"""
+    pool = get_pool()
+    shards = {}
+    for name, email in rows:
+        email = normalize_email(email)
+        shards.setdefault(pool.shard_for(email or ""), []).append((name, email))
+    return shards
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+@writer
+def _save_contact(conn, key, name, email):
+    _upsert_contacts(conn, [(name, email)], int(time.time()))
+
+async def save_user(name, email):
+    """Add a contact, or rename the one with this email"""
+    email = normalize_email(email)
+    await _save_contact(email or "", name, email)
+
+async def upsert_users(rows, chunk_size=CHUNK_SIZE):
+    """Add or update (name, email) rows, e.g. for an onboarding import.
+
+    rows can be any iterable and is read chunk_size rows at a time, each
+    chunk written in one transaction per shard. Returns the rows written.
+    """
+    pool = get_pool()
+    now = int(time.time())
+    written = 0
+    for chunk in _chunks(rows, chunk_size):
+        for shard, shard_rows in _by_shard(chunk).items():
+            written += await pool.shards[shard].write(_upsert_contacts, shard_rows, now)
+    return written
+
+@reader
+def _fetch_contact(conn, email):
+    cursor = conn.execute(
+        "SELECT id, name, email, created_at, updated_at FROM contacts WHERE email = ?", (email,)
+    )
+    return cursor.fetchone()
+
+async def find_contact(email):
+    """Get (id, name, email, created_at, updated_at) of the contact with this email, or None"""
+    email = normalize_email(email)
+    return await _fetch_contact(email) if email else None
+
+@shard_reader
+def _fetch_user_by_username(conn, username):
+    cursor = conn.execute(
+        "SELECT user_id, name, username, registered_on FROM users WHERE username = ? COLLATE NOCASE "
+        "ORDER BY registered_on DESC LIMIT 1",
+        (username,)
+    )
+    return cursor.fetchone()
+
+async def find_user_by_username(username):
+    """Get the registered user with this Telegram username (any case, with or without @), or None.
+
+    Users are sharded by id, so every shard is asked; if the username
+    moved between accounts, the latest registration wins.
+    """
+    username = username.strip().lstrip("@")
+    found = None
+    for shard in range(len(get_pool().shards)):
+        row = await _fetch_user_by_username.on_shard(shard, username)
+        if row is not None and (found is None or (row[3] or 0) > (found[3] or 0)):
+            found = row
+    return found
+
+
+def merge_legacy(path=LEGACY_DB):
+    """Copy the contacts of an old users.db into the pool's database, then rename the file.
+
+    Blocking, for startup and scripts. Returns the rows merged; 0 when
+    there is no such file.
+    """
+    if not path or not os.path.exists(path):
+        return 0
+    started = time.perf_counter()
+    pool = get_pool()
+    now = int(time.time())
+    merged = 0
+    source = sqlite3.connect(path)
+    try:
+        if source.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'users'").fetchone():
+            # In id order, so of two rows with the same email the later one wins
+            cursor = source.execute("SELECT name, email FROM users ORDER BY id")
+            while True:
+                chunk = cursor.fetchmany(CHUNK_SIZE)
+                if not chunk:
+                    break
+                for shard, shard_rows in _by_shard(chunk).items():
+                    merged += pool.shards[shard].run_write(_upsert_contacts, shard_rows, now)
+    finally:
+        source.close()
+    os.replace(path, path + ".merged")
+    logger.info("Merged %d contacts from %s in %.1fs (renamed to %s.merged)",
+                merged, path, time.perf_counter() - started, path)
+    return merged
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "merge":
+        sys.exit("Usage: python database.py merge [users.db] [database]")
+    from migrations import migrate
+    from settings import load_settings
+    from storage import close_pool, init_pool
+
+    # The shard count must be the bot's, contacts are hashed over the shards
+    config = load_settings()
+    legacy = sys.argv[2] if len(sys.argv) > 2 else LEGACY_DB
+    db_file = sys.argv[3] if len(sys.argv) > 3 else config.db_file
+    shards = config.db_shards
+    init_pool(db_file, readers=1, shards=shards).run_write_all(migrate)
+    try:
+        print(f"Merged {merge_legacy(legacy)} contacts from {legacy} into {db_file} ({shards} shards)")
+    finally:
+        close_pool()
@@ -0,0 +1,101 @@
+import asyncio
+import logging
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+from storage import shard_index
+
+logger = logging.getLogger(__name__)
+
+# Handlers running at the same time
+DEFAULT_WORKERS = 16
+# Updates accepted but not finished yet (running or waiting their turn)
+DEFAULT_MAX_PENDING = 10000
+# Updates one user may have waiting; a flood beyond this is dropped
+DEFAULT_MAX_PER_USER = 20
+
+
+def ordering_key(update):
+    """Updates with the same key are processed one after another"""
+    if isinstance(update, Update):
+        if update.effective_user is not None:
+            return update.effective_user.id
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+    return None
+
+
+class UserOrderedUpdateProcessor(BaseUpdateProcessor):
+    """Processes updates concurrently while keeping each user's updates in order.
+
+    Every update waits for the previous update of the same user to finish
+    before it takes one of `workers` slots, so a slow handler only delays
+    its own user and conversation states can't race. PTB's own semaphore
+    (max_pending) only bounds how many updates may be in flight.
+
+    A user who already has max_per_user updates waiting is flooding; further
+    updates from them are dropped until the backlog drains.
+
+    With a sharded database (see storage.py) each update is routed to the
+    shard owning its user, and every shard gets its own share of the
+    workers, so a busy shard can't hold all of them while its writer is the
+    bottleneck and the other shards sit idle.
+    """
+
+    def __init__(self, workers=DEFAULT_WORKERS, max_pending=DEFAULT_MAX_PENDING,
+                 max_per_user=DEFAULT_MAX_PER_USER, shards=1):
+        super().__init__(max_concurrent_updates=max_pending)
+        self.workers = workers
+        self.max_per_user = max_per_user
+        self.shards = shards
+        self.pending = 0
+        self.dropped = 0
+        # One semaphore per shard, splitting the workers between them
+        self._slots = [asyncio.Semaphore(max(1, workers // shards)) for _ in range(shards)]
+        # ordering key -> future resolved when that key's latest update is done
+        self._tails = {}
+        # ordering key -> number of that key's updates not finished yet
+        self._per_user = {}
+
+    async def do_process_update(self, update, coroutine):
+        key = ordering_key(update)
+        if key is not None and self._per_user.get(key, 0) >= self.max_per_user:
+            coroutine.close()
+            self.dropped += 1
+            logger.debug("Dropped update from %s: %d updates already waiting", key, self.max_per_user)
+            return
+
+        previous = self._tails.get(key) if key is not None else None
+        done = asyncio.get_running_loop().create_future()
+        if key is not None:
+            self._tails[key] = done
+            self._per_user[key] = self._per_user.get(key, 0) + 1
+        self.pending += 1
+        started = False
+        try:
+            if previous is not None:
+                await asyncio.shield(previous)
+            # Updates without a user (channel posts, polls) go to shard 0
+            async with self._slots[shard_index(key, self.shards) if key is not None else 0]:
+                started = True
+                await coroutine
+        finally:
+            self.pending -= 1
+            if not started:
+                coroutine.close()
+            done.set_result(None)
+            if key is not None:
+                if self._tails.get(key) is done:
+                    del self._tails[key]
+                remaining = self._per_user[key] - 1
+                if remaining:
+                    self._per_user[key] = remaining
+                else:
+                    del self._per_user[key]
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,121 @@
+"""Append-only log of task changes, for cross-user analytics.
+
+The task writers in botfinal.py (and imports, see transfer.py) overwrite
+rows of `tasks` in place; each of them also appends one row per changed
+task to `task_events`, in the same transaction. Rows are never updated.
+An event is five integers: when, whose, which task, what happened, and
+when that task was created, so time-to-complete needs no join with
+`tasks` (whose rows may be gone).
+
+analytics.py reads the log in id order, BATCH_SIZE events at a time.
+Rows are only ever appended: there is no index to keep up but the rowid.
+"""
+from storage import shard_reader
+
+# Event kinds, stored as small integers
+CREATED = 1
+COMPLETED = 2
+REOPENED = 3
+EDITED = 4
+DELETED = 5
+DUE_SET = 6
+
+KINDS = {
+    CREATED: "created",
+    COMPLETED: "completed",
+    REOPENED: "reopened",
+    EDITED: "edited",
+    DELETED: "deleted",
+    DUE_SET: "due date set",
+}
+
+# Events per reader call
+BATCH_SIZE = 100_000
+
+
+def create_table(conn):
+    # No index but the rowid: ids follow time, see first_id_since()
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS task_events (
+        id INTEGER PRIMARY KEY,
+        at INTEGER NOT NULL,
+        user_id INTEGER NOT NULL,
+        task_id INTEGER NOT NULL,
+        kind INTEGER NOT NULL,
+        created_at INTEGER NOT NULL
+    )
+    ''')
+
+
+def record(conn, kind, user_id, task_id, created_at, now):
+    """Append one event, inside the caller's transaction"""
+    conn.execute(
+        "INSERT INTO task_events (at, user_id, task_id, kind, created_at) VALUES (?, ?, ?, ?, ?)",
+        (now, int(user_id), task_id, kind, created_at)
+    )
+
+
+def _record_tasks(conn, kind, now, where, params, table="tasks"):
+    conn.execute(
+        "INSERT INTO task_events (at, user_id, task_id, kind, created_at) "
+        f"SELECT ?, CAST(user_id AS INTEGER), id, ?, created_at FROM {table} WHERE {where} ORDER BY id",
+        (now, kind, *params)
+    )
+
+
+def add_tasks_since(conn, first_id, now):
+    """Log the tasks with id >= first_id as created (after a bulk insert, like stats.add_tasks_since)"""
+    _record_tasks(conn, CREATED, now, "id >= ?", (first_id,))
+
+
+def delete_user(conn, user_id, now):
+    """Log all of a user's tasks, archived ones included, as deleted (before deleting them)"""
+    _record_tasks(conn, DELETED, now, "user_id = ?", (user_id,))
+    _record_tasks(conn, DELETED, now, "user_id = ?", (user_id,), table="tasks_archive")
+
+
+@shard_reader
+def first_id_since(conn, since):
+    """Id to read from for the events at or after `since` (epoch seconds), or None if there are none.
+
+    Events are appended as they happen, so `at` grows with the id and a
+    binary search over the rowid finds the start without an index on `at`.
+    """
+    low, high = conn.execute("SELECT min(id), max(id) FROM task_events").fetchone()
+    if high is None or conn.execute("SELECT at FROM task_events WHERE id = ?", (high,)).fetchone()[0] < since:
+        return None
+    while low < high:
+        middle = (low + high) // 2
+        # Ids can have gaps; take the next event that exists
+        row = conn.execute(
+            "SELECT id, at FROM task_events WHERE id >= ? ORDER BY id LIMIT 1", (middle,)
+        ).fetchone()
+        if row[1] < since:
+            low = row[0] + 1
+        else:
+            high = middle
+    return low
+
+
+@shard_reader
+def last_id(conn):
+    """Id of the latest event, or None"""
+    return conn.execute("SELECT max(id) FROM task_events").fetchone()[0]
+
+
+@shard_reader
+def get_batch(conn, first_id, limit=BATCH_SIZE, load=list):
+    """Get the (at, user_id, kind, created_at) events with ids from first_id to first_id + limit - 1.
+
+    load turns the cursor into the batch, in the reader thread: a list of
+    rows by default, analytics.py reads it straight into columns. Returns
+    the batch and the id of the next one, None after the last event.
+    Rows are never deleted, so ids are dense and a batch is an id range:
+    the id column itself isn't read, a fifth less to convert.
+    """
+    batch = load(conn.execute(
+        "SELECT at, user_id, kind, created_at FROM task_events WHERE id >= ? AND id < ?",
+        (first_id, first_id + limit)
+    ))
+    last_id = conn.execute("SELECT max(id) FROM task_events").fetchone()[0]
+    return batch, first_id + limit if last_id is not None and last_id >= first_id + limit else None
@@ -0,0 +1,102 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Messages from the same user arriving within this many seconds are stored
+# together and answered with one reply
+COALESCE_WINDOW = 1.0
+
+# Upper bound on lines buffered for one user before flushing early
+MAX_PENDING_LINES = 1000
+
+# Leading list markers that are stripped from pasted lines
+BULLETS = ("- ", "* ", "• ", "☐ ", "[ ] ")
+
+
+def split_tasks(text):
+    """Turn a message or uploaded file into a list of task texts, one per line"""
+    tasks = []
+    for line in text.splitlines():
+        line = line.strip()
+        for bullet in BULLETS:
+            if line.startswith(bullet):
+                line = line[len(bullet):].strip()
+                break
+        if line:
+            tasks.append(line)
+    return tasks
+
+
+class TaskBatcher:
+    """Coalesces task messages per user and stores each burst in one batch.
+
+    flush is an async callable taking (user_id, tasks, message); it gets
+    every task buffered during the window and the last message received,
+    so it can store them in one transaction and answer with one reply.
+    flush_all() passes None for the message: on shutdown nobody is answered.
+
+    A user's batches are stored one after the other, and flush(user_id)
+    returns once all of theirs are stored, including one a timer started.
+    """
+
+    def __init__(self, flush, window=COALESCE_WINDOW):
+        self.window = window
+        self._flush = flush
+        self._pending = {}
+        self._timers = {}
+        self._flushing = set()
+        # The latest store of each user, which waits for the one before it
+        self._storing = {}
+
+    def add(self, user_id, tasks, message):
+        """Buffer tasks for a user; they are flushed once the window closes"""
+        pending = self._pending.get(user_id)
+        if pending is None:
+            pending = self._pending[user_id] = [[], message]
+            loop = asyncio.get_running_loop()
+            self._timers[user_id] = loop.call_later(self.window, self._schedule_flush, user_id)
+        pending[0].extend(tasks)
+        pending[1] = message
+        if len(pending[0]) >= MAX_PENDING_LINES:
+            self._schedule_flush(user_id)
+
+    def _schedule_flush(self, user_id):
+        task = asyncio.create_task(self.flush(user_id))
+        # Keep a reference until the flush is done
+        self._flushing.add(task)
+        task.add_done_callback(self._flushing.discard)
+
+    async def flush(self, user_id, reply=True):
+        """Store everything buffered for a user right away"""
+        timer = self._timers.pop(user_id, None)
+        if timer is not None:
+            timer.cancel()
+        pending = self._pending.pop(user_id, None)
+        store = self._storing.get(user_id)
+        if pending and pending[0]:
+            tasks, message = pending
+            store = asyncio.create_task(self._store(store, user_id, tasks, message if reply else None))
+            self._storing[user_id] = store
+            store.add_done_callback(lambda done: self._forget(user_id, done))
+        if store is not None:
+            # The store goes on even if the caller is cancelled
+            await asyncio.shield(store)
+
+    async def flush_all(self):
+        """Store everything buffered for every user and wait for it (on shutdown)"""
+        await asyncio.gather(*(self.flush(user_id, reply=False) for user_id in list(self._pending)))
+        if self._storing:
+            await asyncio.wait(list(self._storing.values()))
+
+    async def _store(self, previous, user_id, tasks, message):
+        if previous is not None:
+            await asyncio.wait([previous])
+        try:
+            await self._flush(user_id, tasks, message)
+        except Exception:
+            logger.exception("Failed to store %d tasks for user %s", len(tasks), user_id)
+
+    def _forget(self, user_id, store):
+        if self._storing.get(user_id) is store:
+            del self._storing[user_id]
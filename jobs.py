@@ -0,0 +1,83 @@
+"""Worker processes for CPU-heavy render and analytics jobs.
+
+Building a long report on the event loop stalls every other user's update
+while it runs. JobPool.run() hands such a job to a worker process and
+returns its result as an awaitable; jobs smaller than `threshold` items
+run inline, where shipping them to another process costs more than it
+saves. Job functions must be module-level (see reports.py) and take plain
+data, e.g. rows already read from the database or a file to open: the
+admin /stats summarizes each shard in a worker (analytics.summarize_file).
+"""
+import asyncio
+import logging
+import os
+import time
+
+from metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+# Worker processes; 0 runs every job inline
+DEFAULT_WORKERS = min(2, os.cpu_count() or 1)
+# Jobs over fewer items (rows, lines, events) than this run on the event loop
+INLINE_THRESHOLD = 2000
+# Modules the workers' server process imports once, for every worker
+PRELOAD = ["reports", "analytics"]
+
+JOBS = REGISTRY.counter("bot_jobs_total", "Render and analytics jobs, by where they ran", ("where",))
+JOB_SECONDS = REGISTRY.histogram("bot_job_seconds", "Render and analytics job latency in seconds", ("where",))
+
+
+class JobPool:
+    """Lazily started process pool with an inline path for small jobs"""
+
+    def __init__(self, workers=DEFAULT_WORKERS, threshold=INLINE_THRESHOLD):
+        self.workers = workers
+        self.threshold = threshold
+        self._executor = None
+        self._closed = False
+
+    def _get_executor(self):
+        if self._executor is None:
+            # Imported here so that a bot without workers never loads them
+            import multiprocessing
+            from concurrent.futures import ProcessPoolExecutor
+
+            # Forking the bot itself would copy the state of its database,
+            # HTTP and executor threads mid-flight. Workers are forked from a
+            # clean server process instead, with the job modules preloaded.
+            context = multiprocessing.get_context("forkserver")
+            context.set_forkserver_preload(PRELOAD)
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=context)
+        return self._executor
+
+    async def run(self, fn, *args, size=0):
+        """Run fn(*args), in a worker process when size reaches the threshold"""
+        started = time.perf_counter()
+        where = "inline"
+        if self.workers and not self._closed and size >= self.threshold:
+            where = "process"
+            from concurrent.futures.process import BrokenProcessPool
+
+            loop = asyncio.get_running_loop()
+            try:
+                result = await loop.run_in_executor(self._get_executor(), fn, *args)
+            except BrokenProcessPool:
+                # A worker died (e.g. killed for memory); start a fresh pool next time
+                logger.warning("Job pool broke while running %s, running it inline", fn.__name__)
+                self._executor = None
+                where = "inline"
+                result = fn(*args)
+        else:
+            result = fn(*args)
+        JOBS.inc(where)
+        JOB_SECONDS.observe(time.perf_counter() - started, where)
+        return result
+
+    async def shutdown(self):
+        """Let running jobs finish and cancel queued ones; later jobs run inline"""
+        self._closed = True
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
+            logger.info("Job pool stopped")
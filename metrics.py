@@ -0,0 +1,252 @@
+"""Prometheus-style metrics for the bot: counters, gauges and histograms.
+
+Everything lives in the process-wide REGISTRY and is served as plain text
+(Prometheus exposition format) by serve(), for example on
+http://127.0.0.1:9100/metrics. No client library is needed; recording a
+sample is a dict lookup, a bisect and a few additions under a lock.
+"""
+import asyncio
+import bisect
+import functools
+import logging
+import threading
+import time
+
+from telegram.ext import CommandHandler, ConversationHandler
+
+logger = logging.getLogger(__name__)
+
+# Latency buckets in seconds, from a cached lookup to a slow history query
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic count per label set"""
+
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        for labels, value in items:
+            yield self.name, _labels(self.labelnames, labels), value
+
+
+class Gauge:
+    """Current value per label set, or read from a callback when scraped"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help, labelnames=(), callback=None):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.callback = callback
+        self._values = {}
+
+    def set(self, value, *labels):
+        self._values[labels] = value
+
+    def samples(self):
+        if self.callback is not None:
+            try:
+                yield self.name, "", self.callback()
+            except Exception:
+                logger.exception("Gauge %s callback failed", self.name)
+            return
+        for labels, value in list(self._values.items()):
+            yield self.name, _labels(self.labelnames, labels), value
+
+
+class Histogram:
+    """Latency distribution per label set, with Prometheus' cumulative buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (+Inf last), sum]
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            series[0][index] += 1
+            series[1] += value
+
+    def count(self, *labels):
+        series = self._series.get(labels)
+        return sum(series[0]) if series else 0
+
+    def samples(self):
+        with self._lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self._series.items()]
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else _number(bound)
+                yield self.name + "_bucket", _labels(self.labelnames, labels, f'le="{le}"'), cumulative
+            yield self.name + "_sum", _labels(self.labelnames, labels), total
+            yield self.name + "_count", _labels(self.labelnames, labels), cumulative
+
+
+class Registry:
+    """Named metrics, created on first use and rendered together"""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def _get(self, cls, name, *args, **kwargs):
+        metric = self._metrics.get(name)
+        if metric is None:
+            metric = self._metrics[name] = cls(name, *args, **kwargs)
+        return metric
+
+    def counter(self, name, help, labelnames=()):
+        return self._get(Counter, name, help, labelnames)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get(Histogram, name, help, labelnames, buckets)
+
+    def gauge(self, name, help, callback=None, labelnames=()):
+        """Gauge read from callback() at scrape time; re-registering replaces the callback"""
+        metric = self._get(Gauge, name, help, labelnames)
+        metric.callback = callback
+        return metric
+
+    def render(self):
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_REQUESTS = REGISTRY.counter(
+    "bot_handler_requests_total", "Updates handled, per handler", ("handler",))
+HANDLER_ERRORS = REGISTRY.counter(
+    "bot_handler_errors_total", "Handlers that raised, per handler", ("handler",))
+HANDLER_SECONDS = REGISTRY.histogram(
+    "bot_handler_seconds", "Handler latency in seconds", ("handler",))
+DB_REQUESTS = REGISTRY.counter(
+    "bot_db_requests_total", "Database helper calls", ("helper",))
+DB_ERRORS = REGISTRY.counter(
+    "bot_db_errors_total", "Database helper calls that raised", ("helper",))
+DB_SECONDS = REGISTRY.histogram(
+    "bot_db_seconds", "Database helper run time in seconds, without pool queueing", ("helper",))
+
+
+def instrument(name, callback):
+    """Wrap an async handler callback to count, time and record errors under name"""
+    @functools.wraps(callback)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await callback(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - started, name)
+            HANDLER_REQUESTS.inc(name)
+
+    wrapper.instrumented = True
+    return wrapper
+
+
+def handler_name(handler):
+    """Metric label for a handler: the command for commands, else the callback name"""
+    if isinstance(handler, CommandHandler):
+        return "/" + min(handler.commands)
+    return handler.callback.__name__
+
+
+def instrument_handlers(handlers):
+    """Instrument every handler in place, including those inside conversations"""
+    for handler in handlers:
+        if isinstance(handler, ConversationHandler):
+            nested = list(handler.entry_points) + list(handler.fallbacks)
+            for state_handlers in handler.states.values():
+                nested += state_handlers
+            instrument_handlers(nested)
+        elif not getattr(handler.callback, "instrumented", False):
+            handler.callback = instrument(handler_name(handler), handler.callback)
+
+
+def instrument_application(app):
+    for handlers in app.handlers.values():
+        instrument_handlers(handlers)
+
+
+async def _handle_scrape(reader, writer, registry):
+    try:
+        request = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Skip the headers, nothing in them matters here
+        while (await asyncio.wait_for(reader.readline(), timeout=5)) not in (b"\r\n", b"\n", b""):
+            pass
+        parts = request.decode("latin-1").split()
+        if len(parts) >= 2 and parts[0] == "GET" and parts[1].split("?")[0] == "/metrics":
+            status, body = "200 OK", registry.render().encode()
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            "Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            "Connection: close\r\n\r\n".encode() + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(host="127.0.0.1", port=9100, registry=REGISTRY):
+    """Start the /metrics HTTP endpoint; close the returned server to stop it"""
+    server = await asyncio.start_server(
+        lambda reader, writer: _handle_scrape(reader, writer, registry), host, port
+    )
+    logger.info("Metrics served on http://%s:%d/metrics", host, port)
+    return server
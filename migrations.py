@@ -0,0 +1,216 @@
+import logging
+import time
+
+import broadcast
+import database
+import events
+import persistence
+import retention
+import search
+import stats
+
+logger = logging.getLogger(__name__)
+
+
+def _create_base_tables(conn):
+    """The original users/tasks/reminders schema"""
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS users (
+        user_id TEXT PRIMARY KEY,
+        name TEXT NOT NULL,
+        username TEXT,
+        registered_on TIMESTAMP
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS tasks (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        task TEXT NOT NULL,
+        created_at TIMESTAMP,
+        updated_at TIMESTAMP,
+        status TEXT DEFAULT 'pending',
+        FOREIGN KEY (user_id) REFERENCES users (user_id)
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS reminders (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id TEXT NOT NULL,
+        task_id INTEGER,
+        reminder_text TEXT NOT NULL,
+        reminder_time INTEGER NOT NULL,
+        created_at TIMESTAMP,
+        completed BOOLEAN DEFAULT 0,
+        FOREIGN KEY (user_id) REFERENCES users (user_id),
+        FOREIGN KEY (task_id) REFERENCES tasks (id)
+    )
+    ''')
+
+
+def _add_reminder_due_times(conn):
+    """Absolute due times (epoch seconds) and chat ids for reminders"""
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(reminders)")]
+    if "due_at" not in columns:
+        conn.execute("ALTER TABLE reminders ADD COLUMN due_at INTEGER")
+    if "chat_id" not in columns:
+        conn.execute("ALTER TABLE reminders ADD COLUMN chat_id TEXT")
+    # Older rows only stored the delay in minutes
+    conn.execute(
+        "UPDATE reminders SET due_at = CAST(strftime('%s', created_at, 'utc') AS INTEGER) + reminder_time * 60 "
+        "WHERE due_at IS NULL"
+    )
+
+
+def _add_indexes(conn):
+    """Indexes for per-user task lists, status filters and due reminders"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_user_created ON tasks (user_id, created_at)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_user_status ON tasks (user_id, status)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reminders_due ON reminders (completed, due_at)")
+
+
+def _epoch_timestamps(conn):
+    """Store timestamps as integer epoch seconds instead of local-time strings"""
+    def to_epoch(table, column):
+        conn.execute(
+            f"UPDATE {table} SET {column} = CAST(strftime('%s', {column}, 'utc') AS INTEGER) "
+            f"WHERE typeof({column}) = 'text'"
+        )
+
+    to_epoch("users", "registered_on")
+    to_epoch("tasks", "created_at")
+    to_epoch("tasks", "updated_at")
+    to_epoch("reminders", "created_at")
+
+
+def _daily_stats_rollup(conn):
+    """Precomputed per-user daily counts for /history"""
+    stats.backfill(conn)
+
+
+def _status_page_index(conn):
+    """Keyset pages filtered by status: (user_id, status, created_at)"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_user_status_created ON tasks (user_id, status, created_at)")
+    # Covered by the new index
+    conn.execute("DROP INDEX IF EXISTS idx_tasks_user_status")
+
+
+def _task_search_index(conn):
+    """FTS5 index over task texts, kept in sync by triggers"""
+    search.rebuild(conn)
+
+
+def _reminder_user_index(conn):
+    """Per-user reminder scans (/export) in (created_at, id) order"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_reminders_user_created ON reminders (user_id, created_at)")
+
+
+def _recurring_reminders(conn):
+    """Repeat rules for reminders, due dates for tasks and the reminders linked to them"""
+    if "repeat" not in [row[1] for row in conn.execute("PRAGMA table_info(reminders)")]:
+        conn.execute("ALTER TABLE reminders ADD COLUMN repeat TEXT")
+    if "due_at" not in [row[1] for row in conn.execute("PRAGMA table_info(tasks)")]:
+        conn.execute("ALTER TABLE tasks ADD COLUMN due_at INTEGER")
+    # Completing or deleting a task cancels its pending reminders
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_reminders_task ON reminders (task_id) WHERE task_id IS NOT NULL"
+    )
+
+
+def _task_archive(conn):
+    """tasks_archive, where retention.py moves old completed tasks"""
+    retention.create_archive(conn)
+
+
+def _conversation_state(conn):
+    """Conversation and user_data state kept across restarts, see persistence.py"""
+    persistence.create_tables(conn)
+
+
+def _broadcasts(conn):
+    """Progress of admin broadcasts, see broadcast.py"""
+    broadcast.create_table(conn)
+
+
+def _task_events(conn):
+    """Append-only task change log, see events.py"""
+    events.create_table(conn)
+
+
+def _contacts(conn):
+    """Name/email contacts formerly kept in users.db, and username lookups, see database.py"""
+    database.create_tables(conn)
+
+
+def _archive_user_index(conn):
+    """Per-user archive scans (/export, /deletetask all) in (created_at, id) order"""
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_tasks_archive_user_created ON tasks_archive (user_id, created_at)")
+
+
+def _reminder_send_attempts(conn):
+    """Failed sends of each reminder, so the scheduler gives up after a few"""
+    if "send_attempts" not in [row[1] for row in conn.execute("PRAGMA table_info(reminders)")]:
+        conn.execute("ALTER TABLE reminders ADD COLUMN send_attempts INTEGER NOT NULL DEFAULT 0")
+
+
+# Ordered list of (version, description, migration). Append only: never
+# renumber or edit a migration that has shipped.
+MIGRATIONS = [
+    (1, "create base tables", _create_base_tables),
+    (2, "reminder due times", _add_reminder_due_times),
+    (3, "task and reminder indexes", _add_indexes),
+    (4, "integer epoch timestamps", _epoch_timestamps),
+    (5, "daily stats rollup", _daily_stats_rollup),
+    (6, "status page index", _status_page_index),
+    (7, "task search index", _task_search_index),
+    (8, "reminder user index", _reminder_user_index),
+    (9, "recurring reminders and task due dates", _recurring_reminders),
+    (10, "task archive", _task_archive),
+    (11, "conversation state", _conversation_state),
+    (12, "broadcasts", _broadcasts),
+    (13, "task events", _task_events),
+    (14, "contacts and username index", _contacts),
+    (15, "archive user index", _archive_user_index),
+    (16, "reminder send attempts", _reminder_send_attempts),
+]
+
+
+def current_version(conn):
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS schema_version ("
+        "version INTEGER PRIMARY KEY, description TEXT, applied_at INTEGER)"
+    )
+    row = conn.execute("SELECT max(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn, target=None):
+    """Apply pending migrations in order, each in its own transaction.
+
+    Returns the schema version the database ends up at.
+    """
+    # Lets retention.py hand free pages back; only takes effect on a new
+    # file (or after `python retention.py vacuum`)
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    version = current_version(conn)
+    conn.commit()
+    for number, description, migration in MIGRATIONS:
+        if number <= version or (target is not None and number > target):
+            continue
+        started = time.perf_counter()
+        conn.execute("BEGIN")
+        try:
+            migration(conn)
+            conn.execute(
+                "INSERT INTO schema_version (version, description, applied_at) VALUES (?, ?, ?)",
+                (number, description, int(time.time()))
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            logger.exception("Migration %d (%s) failed", number, description)
+            raise
+        version = number
+        logger.info("Applied migration %d: %s (%.0f ms)",
+                    number, description, (time.perf_counter() - started) * 1000)
+    return version
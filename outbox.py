@@ -0,0 +1,181 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+
+from telegram.error import RetryAfter
+from telegram.ext import BaseRateLimiter
+
+logger = logging.getLogger(__name__)
+
+# Send priorities, lower goes first. Pass one as rate_limit_args=... to any
+# bot method; requests without it count as interactive replies.
+PRIORITY_INTERACTIVE = 0
+PRIORITY_REMINDER = 5
+PRIORITY_BULK = 10
+
+# Telegram's documented limits: about 30 messages/sec overall, one message
+# per second in a private chat and 20 per minute in a group
+GLOBAL_RATE = 30.0
+PRIVATE_CHAT_RATE = 1.0
+GROUP_CHAT_RATE = 20 / 60
+CHAT_BURST = 3
+
+# How often a request is retried after a 429 (RetryAfter) answer
+MAX_RETRIES = 3
+# Per-chat buckets kept in memory; an evicted bucket starts over full
+MAX_CHAT_BUCKETS = 10000
+
+
+class TokenBucket:
+    """Token bucket that hands out reservations instead of blocking"""
+
+    def __init__(self, rate, capacity, clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+
+    def reserve(self):
+        """Take one token; returns how long to wait before using it"""
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+
+class OutboxRateLimiter(BaseRateLimiter):
+    """Outbound queue for every Bot API request the bot makes.
+
+    Requests first wait for their chat's token bucket, then queue for the
+    global bucket, which is handed out in priority order: interactive
+    replies overtake queued reminder or broadcast bursts. A 429 answer pauses
+    all sending for the requested time and the request is retried.
+    """
+
+    def __init__(self, global_rate=GLOBAL_RATE, private_rate=PRIVATE_CHAT_RATE,
+                 group_rate=GROUP_CHAT_RATE, burst=CHAT_BURST, max_retries=MAX_RETRIES):
+        self.global_rate = global_rate
+        self.private_rate = private_rate
+        self.group_rate = group_rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+        self.wait_time = 0.0
+        self._global = TokenBucket(global_rate, burst)
+        self._chats = OrderedDict()
+        self._queue = []
+        self._counter = itertools.count()
+        self._paused_until = 0.0
+        self._wakeup = None
+        self._pump_task = None
+
+    async def initialize(self):
+        # PTB initializes the bot, and so its rate limiter, more than once
+        if self._pump_task is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._pump_task = asyncio.create_task(self._pump())
+
+    async def shutdown(self):
+        if self._pump_task is None:
+            return
+        self._pump_task.cancel()
+        try:
+            await self._pump_task
+        except asyncio.CancelledError:
+            pass
+        self._pump_task = None
+        logger.info("Outbox: %s", self.stats())
+
+    def queue_depth(self):
+        return len(self._queue)
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "retried": self.retried,
+            "failed": self.failed,
+            "queued": len(self._queue),
+            "avg_wait_ms": round(self.wait_time / self.sent * 1000, 1) if self.sent else 0.0,
+        }
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Negative ids (and @channel names) are groups and channels
+            is_group = isinstance(chat_id, str) or chat_id < 0
+            bucket = TokenBucket(self.group_rate if is_group else self.private_rate, self.burst)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > MAX_CHAT_BUCKETS:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    async def _pump(self):
+        """Release queued requests at the global rate, highest priority first"""
+        while True:
+            if not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            pause = self._paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+                continue
+            delay = self._global.reserve()
+            if delay:
+                await asyncio.sleep(delay)
+            while self._queue:
+                _, _, waiter = heapq.heappop(self._queue)
+                if not waiter.done():
+                    waiter.set_result(None)
+                    break
+
+    async def _acquire(self, chat_id, priority):
+        delay = self._chat_bucket(chat_id).reserve()
+        if delay:
+            await asyncio.sleep(delay)
+        waiter = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._queue, (priority, next(self._counter), waiter))
+        self._wakeup.set()
+        await waiter
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get("chat_id")
+        if isinstance(chat_id, str) and chat_id.lstrip("-").isdigit():
+            chat_id = int(chat_id)
+        priority = PRIORITY_INTERACTIVE if rate_limit_args is None else rate_limit_args
+
+        for attempt in range(self.max_retries + 1):
+            if chat_id is not None:
+                queued = time.monotonic()
+                await self._acquire(chat_id, priority)
+                self.wait_time += time.monotonic() - queued
+            try:
+                result = await callback(*args, **kwargs)
+            except RetryAfter as exc:
+                retry_after = exc.retry_after
+                seconds = retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else retry_after
+                self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+                if attempt == self.max_retries:
+                    self.failed += 1
+                    logger.warning("%s to %s failed after %d retries", endpoint, chat_id, attempt)
+                    raise
+                self.retried += 1
+                logger.info("Flood limit hit on %s, retrying in %.1fs", endpoint, seconds)
+                await asyncio.sleep(seconds)
+                continue
+            except Exception:
+                self.failed += 1
+                raise
+            if chat_id is not None:
+                self.sent += 1
+            return result
@@ -0,0 +1,306 @@
+"""Conversation and user_data persistence on the bot's SQLite database.
+
+python-telegram-bot collects the conversation states and user_data that
+changed and hands them to SQLitePersistence every `flush_interval`
+seconds. They are buffered and written in one transaction per shard, so
+a busy bot does a few writes per interval instead of one per update. Rows
+live in the shard of their user (conversation_state, user_state).
+
+On start the states are read back, so a restart or deploy no longer drops
+users in the middle of /register or /addtask. Anything idle for longer
+than `ttl` seconds is not restored, and while the bot runs expire() ends
+such conversations and drops such user_data, keeping memory bounded by
+the number of recently active users rather than all users ever seen.
+"""
+import asyncio
+import json
+import logging
+import time
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from metrics import REGISTRY
+from storage import get_pool, shard_reader, shard_writer
+
+logger = logging.getLogger(__name__)
+
+# Seconds between writes of the changed state
+FLUSH_INTERVAL = 0.5
+# Conversations and user_data idle this long are dropped
+TTL = 3600
+
+ROWS_WRITTEN = REGISTRY.counter("bot_persistence_rows_total", "Conversation and user_data rows written or deleted")
+FLUSH_SECONDS = REGISTRY.histogram("bot_persistence_flush_seconds", "Duration of a persistence flush in seconds")
+
+
+def create_tables(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS conversation_state (
+        name TEXT NOT NULL,
+        conv_key TEXT NOT NULL,
+        user_id TEXT NOT NULL,
+        state TEXT NOT NULL,
+        updated_at INTEGER NOT NULL,
+        PRIMARY KEY (name, conv_key)
+    )
+    ''')
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS user_state (
+        user_id TEXT PRIMARY KEY,
+        data TEXT NOT NULL,
+        updated_at INTEGER NOT NULL
+    )
+    ''')
+    conn.execute(
+        "CREATE INDEX IF NOT EXISTS idx_conversation_state_updated ON conversation_state (updated_at)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_user_state_updated ON user_state (updated_at)")
+
+
+@shard_reader
+def load_conversations(conn, name, since):
+    """Get (conv_key, state, updated_at) of a conversation's users active since `since`"""
+    cursor = conn.execute(
+        "SELECT conv_key, state, updated_at FROM conversation_state WHERE name = ? AND updated_at >= ?",
+        (name, int(since))
+    )
+    return cursor.fetchall()
+
+@shard_reader
+def load_user_data(conn, since):
+    """Get (user_id, data, updated_at) of users active since `since`"""
+    cursor = conn.execute("SELECT user_id, data, updated_at FROM user_state WHERE updated_at >= ?", (int(since),))
+    return cursor.fetchall()
+
+@shard_writer
+def save_state(conn, conversations, users, now):
+    """Write buffered changes; a None state or data deletes the row"""
+    conn.executemany(
+        "DELETE FROM conversation_state WHERE name = ? AND conv_key = ?",
+        [(name, conv_key) for name, conv_key, _, state in conversations if state is None]
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO conversation_state (name, conv_key, user_id, state, updated_at) "
+        "VALUES (?, ?, ?, ?, ?)",
+        [(name, conv_key, user_id, state, now)
+         for name, conv_key, user_id, state in conversations if state is not None]
+    )
+    conn.executemany(
+        "DELETE FROM user_state WHERE user_id = ?",
+        [(user_id,) for user_id, data in users if data is None]
+    )
+    conn.executemany(
+        "INSERT OR REPLACE INTO user_state (user_id, data, updated_at) VALUES (?, ?, ?)",
+        [(user_id, data, now) for user_id, data in users if data is not None]
+    )
+
+@shard_writer
+def purge_state(conn, cutoff):
+    """Delete state idle since before cutoff; returns rows deleted"""
+    deleted = conn.execute("DELETE FROM conversation_state WHERE updated_at < ?", (cutoff,)).rowcount
+    return deleted + conn.execute("DELETE FROM user_state WHERE updated_at < ?", (cutoff,)).rowcount
+
+
+def _user_of(key):
+    # Conversation keys end with the user id (per_user=True, the default)
+    return str(key[-1] if isinstance(key, tuple) else key)
+
+
+class SQLitePersistence(BasePersistence):
+    """Stores user_data and ConversationHandler states, nothing else.
+
+    Conversation handlers must be persistent, named, and passed to track()
+    so that idle conversations can be ended; start() runs the expiry.
+    """
+
+    def __init__(self, flush_interval=FLUSH_INTERVAL, ttl=TTL, clock=time.time):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=flush_interval
+        )
+        self.ttl = ttl
+        self.clock = clock
+        self.handlers = {}
+        # Changes waiting for the next write: {(name, key): state} and {user_id: data}
+        self._conversations = {}
+        self._users = {}
+        # Last activity of every conversation and user in memory, and the
+        # users with a user_state row
+        self._active = {}
+        self._stored = set()
+        self._write_lock = asyncio.Lock()
+        self._write_task = None
+        self._sweeper = None
+
+    def track(self, *handlers):
+        for handler in handlers:
+            self.handlers[handler.name] = handler
+
+    def _queue(self, buffer, item, value):
+        buffer[item] = value
+        # All changes of one Application.update_persistence() run are
+        # buffered by the time the write starts
+        if self._write_task is None:
+            self._write_task = asyncio.create_task(self._write())
+
+    async def _write(self):
+        async with self._write_lock:
+            self._write_task = None
+            conversations, self._conversations = self._conversations, {}
+            users, self._users = self._users, {}
+            if not conversations and not users:
+                return
+            started = time.perf_counter()
+            pool = get_pool()
+            shards = {}
+            for (name, key), state in conversations.items():
+                user_id = _user_of(key)
+                shards.setdefault(pool.shard_for(user_id), ([], []))[0].append(
+                    (name, json.dumps(key), user_id, None if state is None else json.dumps(state))
+                )
+            for user_id, data in users.items():
+                shards.setdefault(pool.shard_for(str(user_id)), ([], []))[1].append((str(user_id), data))
+            now = int(self.clock())
+            for shard, (shard_conversations, shard_users) in shards.items():
+                await save_state.on_shard(shard, shard_conversations, shard_users, now)
+            ROWS_WRITTEN.inc(amount=len(conversations) + len(users))
+            FLUSH_SECONDS.observe(time.perf_counter() - started)
+
+    async def get_conversations(self, name):
+        conversations = {}
+        for shard in range(len(get_pool().shards)):
+            for conv_key, state, updated_at in await load_conversations.on_shard(shard, name, self.clock() - self.ttl):
+                key = tuple(json.loads(conv_key))
+                conversations[key] = json.loads(state)
+                self._active[(name, key)] = updated_at
+        logger.info("Restored %d %s conversations", len(conversations), name)
+        return conversations
+
+    async def update_conversation(self, name, key, new_state):
+        if new_state is None:
+            self._active.pop((name, key), None)
+        else:
+            self._active[(name, key)] = self.clock()
+        self._queue(self._conversations, (name, key), new_state)
+
+    async def get_user_data(self):
+        user_data = {}
+        for shard in range(len(get_pool().shards)):
+            for user_id, data, updated_at in await load_user_data.on_shard(shard, self.clock() - self.ttl):
+                user_data[int(user_id)] = json.loads(data)
+                self._active[int(user_id)] = updated_at
+                self._stored.add(int(user_id))
+        return user_data
+
+    async def update_user_data(self, user_id, data):
+        # Every user who sends an update is handed over, most with empty data
+        self._active[user_id] = self.clock()
+        if not data:
+            if user_id in self._stored:
+                self._stored.discard(user_id)
+                self._queue(self._users, user_id, None)
+            return
+        try:
+            encoded = json.dumps(data)
+        except (TypeError, ValueError):
+            logger.warning("user_data of %s is not JSON serializable, not saved", user_id)
+            return
+        self._stored.add(user_id)
+        self._queue(self._users, user_id, encoded)
+
+    async def drop_user_data(self, user_id):
+        self._active.pop(user_id, None)
+        if user_id in self._stored:
+            self._stored.discard(user_id)
+            self._queue(self._users, user_id, None)
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    def expire(self, application):
+        """End conversations and drop user_data idle for longer than the TTL.
+
+        The Application then reports them as deleted, which removes their
+        rows on the next write. Returns (conversations, users) expired.
+        """
+        cutoff = self.clock() - self.ttl
+        expired = [item for item, active in self._active.items() if active < cutoff]
+        conversations = 0
+        for item in expired:
+            del self._active[item]
+            if isinstance(item, tuple):
+                name, key = item
+                # ConversationHandler has no public way to end a conversation
+                # from outside, and its conversation_timeout needs a JobQueue
+                self.handlers[name]._conversations.pop(key, None)
+                conversations += 1
+            else:
+                application.drop_user_data(item)
+        return conversations, len(expired) - conversations
+
+    async def purge(self):
+        """Delete rows idle for longer than the TTL from every shard, e.g. left from before a restart"""
+        cutoff = int(self.clock() - self.ttl)
+        deleted = 0
+        for shard in range(len(get_pool().shards)):
+            deleted += await purge_state.on_shard(shard, cutoff)
+        return deleted
+
+    def start(self, application, interval=None):
+        """Expire idle state every `interval` seconds (default: a tenth of the TTL, at most a minute)"""
+        interval = interval or min(self.ttl / 10, 60)
+        self._sweeper = asyncio.create_task(self._sweep(application, interval))
+
+    async def stop(self):
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    async def _sweep(self, application, interval):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                conversations, users = self.expire(application)
+                purged = await self.purge()
+            except Exception:
+                logger.exception("Expiring conversation state failed")
+                continue
+            if conversations or users or purged:
+                logger.info("Expired %d conversations and %d users' data (%d rows deleted)",
+                            conversations, users, purged)
+
+    async def flush(self):
+        # Called by the Application on shutdown, after its last update_persistence()
+        await self._write()
+
+    # Only user_data and conversations are stored (see store_data)
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
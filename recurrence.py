@@ -0,0 +1,185 @@
+"""Repeat rules for recurring reminders and due dates for tasks.
+
+A rule is stored in `reminders.repeat` as text, in one of two forms:
+
+    every <seconds>                   a fixed interval, e.g. "every 7200"
+    cron <min> <hour> <dom> <mon> <dow>   five cron fields, in server local time
+
+parse_rule() turns what users type after /remind ("every 2h", "every 3 days",
+"cron 0 9 * * 1-5") into one of these, and next_after() gives the first fire
+time after a reminder has fired. Fire times are absolute epoch seconds, so
+the scheduler only ever reads the earliest ones off the due-time index.
+"""
+import functools
+import re
+import time
+from datetime import date, datetime, timedelta
+
+# Shortest interval a reminder may repeat at
+MIN_INTERVAL = 60
+# A cron rule that does not fire within this many days is rejected
+MAX_CRON_DAYS = 366 * 4
+
+UNITS = {
+    "m": 60, "min": 60, "mins": 60, "minute": 60, "minutes": 60,
+    "h": 3600, "hour": 3600, "hours": 3600,
+    "d": 86400, "day": 86400, "days": 86400,
+    "w": 604800, "week": 604800, "weeks": 604800,
+}
+INTERVAL = re.compile(r"^(\d+)\s*([a-z]+)$")
+RELATIVE = re.compile(r"^(\d+)([mhdw])$")
+
+# (name, low, high) of the five cron fields
+CRON_FIELDS = (("minute", 0, 59), ("hour", 0, 23), ("day of month", 1, 31), ("month", 1, 12), ("day of week", 0, 7))
+
+
+def parse_rule(args):
+    """(rule, words used) for the repeat rule at the start of args.
+
+    Raises ValueError with a message for the user if it can't be read.
+    """
+    if not args:
+        raise ValueError("missing repeat rule")
+    kind = args[0].lower()
+    if kind == "every":
+        # "every 2h", "every 2 hours", "every day"
+        for used in (2, 3):
+            spec = " ".join(args[1:used]).lower()
+            if spec in UNITS:
+                spec = "1 " + spec
+            match = INTERVAL.match(spec)
+            if match and match.group(2) in UNITS:
+                seconds = int(match.group(1)) * UNITS[match.group(2)]
+                if seconds < MIN_INTERVAL:
+                    raise ValueError("reminders can repeat at most once a minute")
+                return f"every {seconds}", used
+        raise ValueError("use e.g. every 30m, every 2h, every 3 days or every week")
+    if kind == "cron":
+        if len(args) < 6:
+            raise ValueError("cron needs five fields: minute hour day-of-month month day-of-week")
+        rule = "cron " + " ".join(args[1:6])
+        if next_after(rule, 0, time.time()) is None:
+            raise ValueError("that cron rule never fires")
+        return rule, 6
+    raise ValueError("a repeat rule starts with every or cron")
+
+
+def _cron_field(text, name, low, high):
+    values = set()
+    for part in text.split(","):
+        try:
+            value_range, _, step = part.partition("/")
+            if value_range == "*":
+                first, last = low, high
+            elif "-" in value_range:
+                first, last = (int(value) for value in value_range.split("-", 1))
+            else:
+                first = last = int(value_range)
+                if step:
+                    last = high
+            step = int(step) if step else 1
+            if not low <= first <= last <= high or step < 1:
+                raise ValueError(part)
+        except ValueError:
+            raise ValueError(f"bad cron {name}: {part}") from None
+        values.update(range(first, last + 1, step))
+    return values
+
+
+@functools.lru_cache(maxsize=1024)
+def parse_cron(expression):
+    """(minutes, hours, days, months, weekdays, match either day) of a cron expression"""
+    fields = expression.split()
+    if len(fields) != 5:
+        raise ValueError("cron needs five fields: minute hour day-of-month month day-of-week")
+    minutes, hours, days, months, weekdays = (
+        _cron_field(text, *spec) for text, spec in zip(fields, CRON_FIELDS)
+    )
+    # Both 0 and 7 are Sunday
+    weekdays = {day % 7 for day in weekdays}
+    # Like cron: with both day fields restricted, a day matching either fires
+    any_day = fields[2] != "*" and fields[4] != "*"
+    return sorted(minutes), sorted(hours), days, months, weekdays, any_day
+
+
+def _cron_next(expression, after):
+    minutes, hours, days, months, weekdays, any_day = parse_cron(expression)
+    start = datetime.fromtimestamp(after).replace(second=0, microsecond=0) + timedelta(minutes=1)
+    day = start.date()
+    for _ in range(MAX_CRON_DAYS):
+        if day.month in months:
+            day_match = day.day in days
+            weekday_match = (day.weekday() + 1) % 7 in weekdays
+            if (day_match or weekday_match) if any_day else (day_match and weekday_match):
+                for hour in hours:
+                    for minute in minutes:
+                        candidate = datetime(day.year, day.month, day.day, hour, minute)
+                        if candidate >= start:
+                            return int(candidate.timestamp())
+        day += timedelta(days=1)
+    return None
+
+
+def next_after(rule, due_at, now):
+    """The first fire time of rule after now, for a reminder that was due at due_at.
+
+    Occurrences missed while the bot was down are skipped, not caught up.
+    Returns None if the rule never fires again.
+    """
+    now = int(now)
+    kind, _, spec = rule.partition(" ")
+    if kind == "every":
+        interval = max(int(spec), MIN_INTERVAL)
+        if due_at > now:
+            return due_at
+        return due_at + ((now - due_at) // interval + 1) * interval
+    if kind == "cron":
+        return _cron_next(spec, now)
+    raise ValueError(f"unknown repeat rule: {rule}")
+
+
+def is_valid(rule):
+    try:
+        return next_after(rule, 0, time.time()) is not None
+    except (TypeError, ValueError):
+        return False
+
+
+def describe(rule):
+    """Short text for a stored rule: "every 2h", "cron 0 9 * * 1-5" """
+    kind, _, spec = rule.partition(" ")
+    if kind != "every":
+        return rule
+    seconds = int(spec)
+    for unit, size in (("w", 604800), ("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds % size == 0:
+            return f"every {seconds // size}{unit}"
+    return f"every {seconds}s"
+
+
+def parse_due(args, now):
+    """(due_at, words used) for a due date: 2026-05-01 [14:30], 14:30, 3d, 2h, 45m.
+
+    Dates and times are in server local time; a date alone is due at 09:00.
+    """
+    if not args:
+        raise ValueError("missing due date")
+    now = int(now)
+    match = RELATIVE.match(args[0].lower())
+    if match:
+        return now + int(match.group(1)) * UNITS[match.group(2)], 1
+    clock = args[1] if len(args) > 1 and ":" in args[1] else None
+    try:
+        if ":" in args[0]:
+            hour, minute = (int(value) for value in args[0].split(":"))
+            today = datetime.fromtimestamp(now)
+            due = today.replace(hour=hour, minute=minute, second=0, microsecond=0)
+            if due.timestamp() <= now:
+                due += timedelta(days=1)
+            return int(due.timestamp()), 1
+        day = date.fromisoformat(args[0])
+        hour, minute = (int(value) for value in clock.split(":")) if clock else (9, 0)
+        due = datetime(day.year, day.month, day.day, hour, minute)
+    except ValueError:
+        raise ValueError("use e.g. 2026-05-01, 2026-05-01 14:30, 14:30, 3d, 2h or 45m")
+    return int(due.timestamp()), 2 if clock else 1
@@ -0,0 +1,50 @@
+"""Text reports built from rows already read from the database.
+
+Plain module-level functions over plain data, so they can run inline or in
+a worker process of jobs.JobPool.
+"""
+import time
+
+
+def render_history(user_name, days, rows):
+    """/history text for (period, total, completed) rows"""
+    lines = [f"📊 Task history for {user_name} (last {days} days):\n"]
+    for period, total, completed in rows:
+        completion_rate = round((completed / total) * 100) if total > 0 else 0
+        lines.append(f"📅 {period}: {total} tasks, {completed} completed ({completion_rate}%)")
+    return "\n".join(lines) + "\n"
+
+
+def format_duration(seconds):
+    """Roughly, in the largest unit that fits: 45s, 12 min, 3.5 h, 2.0 d"""
+    for unit, size in (("d", 86400), ("h", 3600)):
+        if seconds >= size:
+            return f"{seconds / size:.1f} {unit}"
+    if seconds >= 60:
+        return f"{seconds / 60:.0f} min"
+    return f"{seconds:.0f}s"
+
+
+def render_event_stats(summary, kind_names, bucket_labels):
+    """/stats text for an analytics.Summary"""
+    lines = [f"📈 Task activity, last {summary.days} days (UTC):\n"]
+    kinds = ", ".join(f"{kind_names[kind]} {count:,}" for kind, count in enumerate(summary.kinds)
+                      if kind in kind_names)
+    lines.append(f"🧾 {summary.events:,} events: {kinds}")
+    if summary.users:
+        busiest = max(range(summary.days), key=summary.active.__getitem__)
+        day = time.strftime("%Y-%m-%d", time.gmtime(summary.origin + busiest * 86400))
+        lines.append(
+            f"👥 {summary.users:,} active users, {sum(summary.active) / summary.days:,.0f} a day on average, "
+            f"most on {day} ({summary.active[busiest]:,})"
+        )
+    median = summary.completion_time(0.5)
+    if median is not None:
+        lines.append(
+            f"⏱️ Time to complete: median ~{format_duration(median)}, "
+            f"90% within ~{format_duration(summary.completion_time(0.9))}"
+        )
+    if any(summary.task_counts):
+        counts = ", ".join(f"{label}: {count:,}" for label, count in zip(bucket_labels, summary.task_counts))
+        lines.append(f"🗂️ Users by tasks created: {counts}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,280 @@
+"""Background data retention: archive old tasks, purge fired reminders, compact.
+
+Once every interval, MaintenanceJob goes through every shard and:
+
+1. moves completed tasks not touched for `archive_after` seconds from
+   `tasks` into `tasks_archive` (same columns, plus archived_at). The
+   /history rollup keeps counting them and /export includes them;
+   /showtask and /search only see live tasks.
+2. deletes reminders that fired (or were cancelled) more than
+   `reminder_retention` seconds ago.
+3. returns free pages to the file system with PRAGMA incremental_vacuum.
+4. refreshes the planner statistics with a sampled ANALYZE per table.
+
+Every step is a run of small write transactions (at most SCAN_SIZE tasks,
+CHUNK_SIZE reminders or VACUUM_PAGES pages each) with a short pause in
+between, so user writes queued on the same writer thread never wait long.
+Archiving walks `tasks` in id ranges instead of needing its own index.
+
+Incremental vacuum needs auto_vacuum=INCREMENTAL, which new database files
+get (see migrations.migrate). Older files are converted once, with the bot
+stopped, by a full VACUUM:
+
+    python retention.py vacuum [todo_bot.db]
+    python retention.py run [todo_bot.db]       # one maintenance pass now
+"""
+import asyncio
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+from metrics import REGISTRY
+from storage import get_pool, shard_reader, shard_writer
+
+logger = logging.getLogger(__name__)
+
+DAY = 86400
+# Completed tasks older than this are archived; fired reminders older than
+# REMINDER_RETENTION are deleted
+ARCHIVE_AFTER = 90 * DAY
+REMINDER_RETENTION = 30 * DAY
+# Reminders deleted per transaction, task ids looked at per archive transaction
+CHUNK_SIZE = 500
+SCAN_SIZE = 500
+# Pages (4 KiB by default) freed per incremental_vacuum call
+VACUUM_PAGES = 256
+# Rows sampled per index by ANALYZE (PRAGMA analysis_limit)
+ANALYSIS_LIMIT = 1000
+# Pause between chunks, leaving the writer thread to user writes
+CHUNK_PAUSE = 0.01
+
+ANALYZED_TABLES = ("tasks", "reminders", "user_daily_stats", "users", "tasks_archive")
+
+ARCHIVED = REGISTRY.counter("bot_tasks_archived_total", "Completed tasks moved to tasks_archive")
+PURGED = REGISTRY.counter("bot_reminders_purged_total", "Fired reminders deleted")
+RECLAIMED = REGISTRY.counter("bot_db_reclaimed_bytes_total", "Bytes returned to the file system by maintenance")
+MAINTENANCE_SECONDS = REGISTRY.histogram("bot_maintenance_seconds", "Duration of a maintenance pass in seconds")
+
+
+def create_archive(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS tasks_archive (
+        id INTEGER PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        task TEXT NOT NULL,
+        created_at INTEGER,
+        updated_at INTEGER,
+        status TEXT,
+        due_at INTEGER,
+        archived_at INTEGER NOT NULL
+    )
+    ''')
+
+
+@shard_reader
+def last_task_id(conn):
+    return conn.execute("SELECT max(id) FROM tasks").fetchone()[0] or 0
+
+@shard_writer
+def archive_tasks(conn, after, last, cutoff, scan=SCAN_SIZE):
+    """Archive the old completed tasks among the next `scan` ids in (after, last].
+
+    Returns (last id looked at or None at the end, [user ids of archived tasks]).
+    """
+    end = conn.execute(
+        "SELECT max(id) FROM (SELECT id FROM tasks WHERE id > ? AND id <= ? ORDER BY id LIMIT ?)",
+        (after, last, scan)
+    ).fetchone()[0]
+    if end is None:
+        return None, []
+    where = "id > ? AND id <= ? AND status = 'completed' AND updated_at < ?"
+    params = (after, end, cutoff)
+    user_ids = [row[0] for row in conn.execute(f"SELECT user_id FROM tasks WHERE {where}", params)]
+    if user_ids:
+        conn.execute(
+            "INSERT OR REPLACE INTO tasks_archive "
+            "(id, user_id, task, created_at, updated_at, status, due_at, archived_at) "
+            f"SELECT id, user_id, task, created_at, updated_at, status, due_at, ? FROM tasks WHERE {where}",
+            (int(time.time()), *params)
+        )
+        conn.execute(f"DELETE FROM tasks WHERE {where}", params)
+    return end, user_ids
+
+@shard_writer
+def purge_reminders(conn, cutoff, limit=CHUNK_SIZE):
+    """Delete up to `limit` completed reminders due before cutoff; returns how many"""
+    cursor = conn.execute(
+        "DELETE FROM reminders WHERE id IN "
+        "(SELECT id FROM reminders WHERE completed = 1 AND due_at < ? LIMIT ?)",
+        (cutoff, limit)
+    )
+    return cursor.rowcount
+
+@shard_writer
+def incremental_vacuum(conn, pages=VACUUM_PAGES):
+    """Free up to `pages` pages at the end of the file; returns free pages left"""
+    # Each step of the pragma frees one page, and execute() only steps a
+    # statement without result columns once; executescript() runs it through
+    conn.executescript(f"PRAGMA incremental_vacuum({int(pages)})")
+    return conn.execute("PRAGMA freelist_count").fetchone()[0]
+
+@shard_writer
+def analyze_table(conn, table):
+    """Refresh one table's planner statistics from a bounded sample"""
+    conn.execute(f"PRAGMA analysis_limit = {ANALYSIS_LIMIT}")
+    conn.execute(f"ANALYZE {table}")
+
+@shard_writer
+def checkpoint(conn):
+    """Copy the WAL into the database file without waiting for readers"""
+    conn.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchall()
+
+@shard_reader
+def space_info(conn):
+    """Get (page size, pages, free pages, auto_vacuum mode)"""
+    return tuple(
+        conn.execute(f"PRAGMA {name}").fetchone()[0]
+        for name in ("page_size", "page_count", "freelist_count", "auto_vacuum")
+    )
+
+
+class MaintenanceJob:
+    """Runs a maintenance pass over every shard once per interval.
+
+    on_archived, if given, is called with the ids of users whose tasks
+    were archived, e.g. to drop cached task lists.
+    """
+
+    def __init__(self, interval, archive_after=ARCHIVE_AFTER, reminder_retention=REMINDER_RETENTION,
+                 on_archived=None, clock=time.time):
+        self.interval = interval
+        self.archive_after = archive_after
+        self.reminder_retention = reminder_retention
+        self.on_archived = on_archived
+        self.clock = clock
+        self.last_report = None
+        self._task = None
+
+    def start(self):
+        if self.interval > 0:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            # The first pass waits too, keeping startup fast
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Maintenance pass failed")
+
+    async def run_once(self):
+        """One pass over every shard; returns the totals it logged"""
+        started = time.perf_counter()
+        report = {"archived": 0, "purged": 0, "reclaimed_bytes": 0, "free_pages": 0}
+        for shard in range(len(get_pool().shards)):
+            for key, value in (await self._maintain_shard(shard)).items():
+                report[key] += value
+        elapsed = time.perf_counter() - started
+        MAINTENANCE_SECONDS.observe(elapsed)
+        report["seconds"] = round(elapsed, 3)
+        self.last_report = report
+        logger.info(
+            "Maintenance: archived %d tasks, purged %d reminders, reclaimed %.1f MiB "
+            "(%d free pages left for reuse) in %.1fs",
+            report["archived"], report["purged"], report["reclaimed_bytes"] / 2 ** 20,
+            report["free_pages"], elapsed
+        )
+        return report
+
+    async def _maintain_shard(self, shard):
+        now = int(self.clock())
+        _, pages_before, _, _ = await space_info.on_shard(shard)
+
+        archived, after = 0, 0
+        cutoff = now - self.archive_after
+        # Tasks added during the pass are new, no need to chase them
+        last = await last_task_id.on_shard(shard)
+        while after is not None:
+            after, user_ids = await archive_tasks.on_shard(shard, after, last, cutoff)
+            if user_ids:
+                archived += len(user_ids)
+                if self.on_archived is not None:
+                    self.on_archived(set(user_ids))
+            await asyncio.sleep(CHUNK_PAUSE)
+        ARCHIVED.inc(amount=archived)
+
+        purged = 0
+        cutoff = now - self.reminder_retention
+        while True:
+            deleted = await purge_reminders.on_shard(shard, cutoff)
+            purged += deleted
+            if deleted < CHUNK_SIZE:
+                break
+            await asyncio.sleep(CHUNK_PAUSE)
+        PURGED.inc(amount=purged)
+
+        for table in ANALYZED_TABLES:
+            await analyze_table.on_shard(shard, table)
+            await asyncio.sleep(CHUNK_PAUSE)
+
+        _, _, free_pages, auto_vacuum = await space_info.on_shard(shard)
+        # 2 = INCREMENTAL; other files keep their free pages for reuse
+        if auto_vacuum == 2:
+            while free_pages:
+                left = await incremental_vacuum.on_shard(shard)
+                # User writes may reuse or free pages meanwhile; stop once a call makes no headway
+                if left >= free_pages:
+                    break
+                free_pages = left
+                await asyncio.sleep(CHUNK_PAUSE)
+        # The file itself shrinks once the WAL is checkpointed
+        await checkpoint.on_shard(shard)
+
+        page_size, pages_after, _, _ = await space_info.on_shard(shard)
+        reclaimed = max(0, pages_before - pages_after) * page_size
+        RECLAIMED.inc(amount=reclaimed)
+        return {"archived": archived, "purged": purged, "reclaimed_bytes": reclaimed, "free_pages": free_pages}
+
+
+def vacuum(db_file):
+    """Switch a database file to incremental auto-vacuum with a full VACUUM.
+
+    Rewrites the whole file and blocks writers while it runs: stop the bot first.
+    """
+    conn = sqlite3.connect(db_file)
+    size_before = os.path.getsize(db_file)
+    conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    conn.execute("VACUUM")
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    conn.close()
+    return size_before - os.path.getsize(db_file)
+
+
+if __name__ == "__main__":
+    from migrations import migrate
+    from storage import close_pool, init_pool
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ("vacuum", "run"):
+        sys.exit("Usage: python retention.py vacuum|run [database]")
+    db_file = sys.argv[2] if len(sys.argv) > 2 else "todo_bot.db"
+    if sys.argv[1] == "vacuum":
+        print(f"Vacuumed {db_file}, reclaimed {vacuum(db_file) / 2 ** 20:.1f} MiB")
+    else:
+        logging.basicConfig(format="%(asctime)s - %(levelname)s - %(message)s", level=logging.INFO)
+        init_pool(db_file, readers=1).run_write_all(migrate)
+        try:
+            print(asyncio.run(MaintenanceJob(interval=0).run_once()))
+        finally:
+            close_pool()
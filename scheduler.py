@@ -0,0 +1,222 @@
+import asyncio
+import logging
+import time
+
+from telegram.error import BadRequest, Forbidden
+
+import recurrence
+from storage import get_pool, shard_reader, shard_writer
+
+logger = logging.getLogger(__name__)
+
+# How many due reminders are fired (and completed or moved on) per DB round trip
+BATCH_SIZE = 500
+# Pending counts and next due times are re-read from the database this often
+REFRESH_INTERVAL = 600
+# Wait before retrying after the database failed
+RETRY_DELAY = 5
+# A one-shot reminder whose send failed for a passing reason (rate limit,
+# timeout, network) is tried again this much later, doubling with every
+# failure, or when Telegram says if that is later
+SEND_RETRY_DELAY = 60
+# Failed sends after which a one-shot reminder is given up (about two
+# hours of retries)
+MAX_SEND_ATTEMPTS = 8
+
+
+# Reminder helpers used by the scheduler, all range reads of
+# idx_reminders_due (completed, due_at).
+@shard_reader
+def next_due(conn):
+    """Get (pending reminders, earliest due_at or None)"""
+    cursor = conn.execute("SELECT count(*), min(due_at) FROM reminders WHERE completed = 0")
+    return cursor.fetchone()
+
+@shard_reader
+def earliest_due(conn):
+    """Get the earliest due_at of a pending reminder, or None"""
+    cursor = conn.execute("SELECT min(due_at) FROM reminders WHERE completed = 0")
+    return cursor.fetchone()[0]
+
+@shard_reader
+def get_due_reminders(conn, now, limit):
+    """Get (id, chat_id, text, due_at, repeat, send_attempts) of reminders due by now, earliest first"""
+    cursor = conn.execute(
+        "SELECT id, coalesce(chat_id, user_id), reminder_text, due_at, repeat, send_attempts FROM reminders "
+        "WHERE completed = 0 AND due_at <= ? ORDER BY due_at LIMIT ?",
+        (now, limit)
+    )
+    return cursor.fetchall()
+
+@shard_writer
+def advance_reminders(conn, done_ids, moved, retried=()):
+    """Complete one-shot reminders, move recurring ones to (due_at, id) and
+    retry failed ones at (due_at, id), in one transaction"""
+    conn.executemany(
+        "UPDATE reminders SET completed = 1 WHERE id = ?",
+        [(reminder_id,) for reminder_id in done_ids]
+    )
+    # A reminder cancelled while it was being sent stays cancelled
+    conn.executemany("UPDATE reminders SET due_at = ? WHERE id = ? AND completed = 0", moved)
+    conn.executemany(
+        "UPDATE reminders SET due_at = ?, send_attempts = send_attempts + 1 WHERE id = ? AND completed = 0",
+        retried
+    )
+
+
+def retry_delay(error, attempts=0):
+    """Seconds until a send that failed after `attempts` earlier failures is tried again"""
+    retry_after = getattr(error, "retry_after", None) or 0
+    seconds = retry_after.total_seconds() if hasattr(retry_after, "total_seconds") else retry_after
+    return int(max(SEND_RETRY_DELAY * 2 ** attempts, seconds))
+
+
+class ReminderScheduler:
+    """Fires reminders at their absolute due time from a single timer task.
+
+    Nothing per reminder is kept in memory: `reminders.due_at` holds the next
+    fire time of every pending reminder, and each wake-up reads the due ones
+    off the (completed, due_at) index with one range query per shard. Only
+    the earliest due time of each shard is cached, to know how long to sleep.
+    Recurring reminders get their next due_at written back instead of being
+    completed. A one-shot reminder is only completed once it was sent or
+    can never be (blocked bot, chat gone); otherwise its due_at is pushed
+    back by SEND_RETRY_DELAY, doubled for each failure so far, and after
+    MAX_SEND_ATTEMPTS failures it is completed unsent. Everything lives in
+    the database, so restarts lose nothing.
+
+    `pending` is exact after each refresh; in between it counts scheduled
+    and fired reminders but not cancelled ones.
+    """
+
+    def __init__(self, batch_size=BATCH_SIZE, clock=time.time):
+        self.batch_size = batch_size
+        self.clock = clock
+        self.fired = 0
+        self.pending = 0
+        self._next = {}
+        self._refreshed_at = None
+        self._send = None
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def __len__(self):
+        return self.pending
+
+    @property
+    def next_due(self):
+        """Earliest due time over all shards, or None with nothing pending"""
+        return min((due_at for due_at in self._next.values() if due_at is not None), default=None)
+
+    async def start(self, send):
+        """Read when reminders are due and start the timer.
+
+        send is an async callable taking (chat_id, text).
+        """
+        self._send = send
+        await self.refresh()
+        logger.info("Reminder scheduler started with %d pending reminders", self.pending)
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def refresh(self):
+        """Re-read every shard's pending count and earliest due time"""
+        pending = 0
+        for shard in range(len(get_pool().shards)):
+            count, due_at = await next_due.on_shard(shard)
+            pending += count
+            self._next[shard] = due_at
+        self.pending = pending
+        self._refreshed_at = self.clock()
+
+    def schedule(self, due_at, shard=0):
+        """Note a reminder that is already stored in the given shard"""
+        self.pending += 1
+        current = self._next.get(shard)
+        # Only an earlier deadline changes how long the timer has to sleep
+        if current is None or due_at < current:
+            self._next[shard] = due_at
+            self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                if self.clock() - self._refreshed_at >= REFRESH_INTERVAL:
+                    await self.refresh()
+                await self.fire_due()
+            except Exception:
+                logger.exception("Reminder scheduler failed, retrying in %ds", RETRY_DELAY)
+                await asyncio.sleep(RETRY_DELAY)
+                continue
+
+            wake_at = self._refreshed_at + REFRESH_INTERVAL
+            if self.next_due is not None:
+                wake_at = min(wake_at, self.next_due)
+            delay = wake_at - self.clock()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=delay)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def fire_due(self):
+        """Fire every reminder due by now; returns how many were sent"""
+        now = int(self.clock())
+        sent = 0
+        for shard, due_at in list(self._next.items()):
+            if due_at is None or due_at > now:
+                continue
+            while True:
+                rows = await get_due_reminders.on_shard(shard, now, self.batch_size)
+                if rows:
+                    await self._fire(shard, rows, now)
+                    sent += len(rows)
+                if len(rows) < self.batch_size:
+                    break
+            # schedule() may lower this while the query runs; keep the earlier
+            self._next[shard] = None
+            due_at = await earliest_due.on_shard(shard)
+            if self._next[shard] is None or (due_at is not None and due_at < self._next[shard]):
+                self._next[shard] = due_at
+        return sent
+
+    async def _fire(self, shard, rows, now):
+        """Send one batch of due reminders of a shard and move them on"""
+        results = await asyncio.gather(
+            *(self._send(chat_id, f"⏰ REMINDER: {text}") for _, chat_id, text, _, _, _ in rows),
+            return_exceptions=True
+        )
+        done_ids, moved, retried = [], [], []
+        for (reminder_id, _, _, due_at, repeat, attempts), result in zip(rows, results):
+            if isinstance(result, Exception):
+                logger.warning("Reminder %s could not be delivered: %s", reminder_id, result)
+                # BadRequest and Forbidden won't go away; anything else (the
+                # outbox already retried 429s) may, and a one-shot reminder
+                # is tried again, a few times. A recurring one moves on to
+                # its next time.
+                if not repeat and not isinstance(result, (BadRequest, Forbidden)):
+                    if attempts + 1 < MAX_SEND_ATTEMPTS:
+                        retried.append((now + retry_delay(result, attempts), reminder_id))
+                        continue
+                    logger.warning("Giving up on reminder %s after %d failed sends", reminder_id, attempts + 1)
+            try:
+                next_at = recurrence.next_after(repeat, due_at, now) if repeat else None
+            except ValueError:
+                logger.warning("Reminder %s has an unreadable repeat rule %r", reminder_id, repeat)
+                next_at = None
+            if next_at is None:
+                done_ids.append(reminder_id)
+            else:
+                moved.append((next_at, reminder_id))
+        await advance_reminders.on_shard(shard, done_ids, moved, retried)
+        self.fired += len(rows)
+        self.pending -= len(done_ids)
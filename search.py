@@ -0,0 +1,135 @@
+"""Full-text task search backed by an SQLite FTS5 index.
+
+`tasks_fts` is a contentless FTS5 table with one row per task (same rowid).
+Next to the task text it indexes an owner token ("u<user_id>"), so a search
+only ever walks the posting lists of that user. Triggers on `tasks` keep
+it in sync with every insert, text update and delete.
+
+Rebuild the index for an existing database with:
+
+    python search.py rebuild [todo_bot.db]
+"""
+import re
+import sqlite3
+import sys
+import unicodedata
+
+from storage import reader
+
+# Results per /search page, and how deep paging may go
+PAGE_SIZE = 10
+MAX_RESULTS = 100
+# Search terms used from one query
+MAX_TERMS = 8
+# Newest matches that get ranked. FTS5's bm25() reads the whole posting list
+# of every term across all users to weigh it, which costs tens of ms on a
+# large index; ranking a bounded set of this user's matches here does not.
+MAX_CANDIDATES = 200
+
+TOKEN = re.compile(r"\w+", re.UNICODE)
+
+
+def create_index(conn):
+    conn.execute('''
+    CREATE VIRTUAL TABLE IF NOT EXISTS tasks_fts USING fts5(
+        task, owner,
+        content = '',
+        prefix = '2 3',
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_insert AFTER INSERT ON tasks BEGIN
+        INSERT INTO tasks_fts (rowid, task, owner) VALUES (new.id, new.task, 'u' || new.user_id);
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_delete AFTER DELETE ON tasks BEGIN
+        INSERT INTO tasks_fts (tasks_fts, rowid, task, owner) VALUES ('delete', old.id, old.task, 'u' || old.user_id);
+    END
+    ''')
+    conn.execute('''
+    CREATE TRIGGER IF NOT EXISTS tasks_fts_update AFTER UPDATE OF task, user_id ON tasks BEGIN
+        INSERT INTO tasks_fts (tasks_fts, rowid, task, owner) VALUES ('delete', old.id, old.task, 'u' || old.user_id);
+        INSERT INTO tasks_fts (rowid, task, owner) VALUES (new.id, new.task, 'u' || new.user_id);
+    END
+    ''')
+
+
+def rebuild(conn):
+    """Re-index every task from scratch"""
+    create_index(conn)
+    conn.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('delete-all')")
+    conn.execute("INSERT INTO tasks_fts (rowid, task, owner) SELECT id, task, 'u' || user_id FROM tasks")
+    conn.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('optimize')")
+    return conn.execute("SELECT count(*) FROM tasks").fetchone()[0]
+
+
+def match_expression(user_id, text, prefix=False):
+    """FTS5 query for the user's tasks containing every word. With prefix,
+    the last word may be incomplete ("dent" finds "dentist")."""
+    terms = TOKEN.findall(text)[:MAX_TERMS]
+    if not terms:
+        return None
+    words = [f'task:"{term}"' for term in terms]
+    if prefix:
+        words[-1] += "*"
+    return f'owner:"u{user_id}" AND ' + " AND ".join(words)
+
+
+def fold(text):
+    """Lower-case words without diacritics, the way the index tokenizes"""
+    text = unicodedata.normalize("NFKD", text.casefold())
+    return TOKEN.findall("".join(c for c in text if not unicodedata.combining(c)))
+
+
+def rank(rows, text):
+    """Order (id, task, status) rows: most query words matched whole, then
+    shortest task, then newest"""
+    terms = set(fold(text)[:MAX_TERMS])
+
+    def key(row):
+        words = fold(row[1])
+        return -len(terms.intersection(words)), len(words), -row[0]
+
+    return sorted(rows, key=key)
+
+
+def _candidates(conn, expression):
+    cursor = conn.execute(
+        """
+        SELECT tasks.id, tasks.task, tasks.status
+        FROM tasks_fts JOIN tasks ON tasks.id = tasks_fts.rowid
+        WHERE tasks_fts MATCH ?
+        ORDER BY tasks_fts.rowid DESC
+        LIMIT ?
+        """,
+        (expression, MAX_CANDIDATES)
+    )
+    return cursor.fetchall()
+
+
+@reader
+def search_tasks(conn, user_id, text, offset=0, limit=PAGE_SIZE):
+    """Get (id, task, status) of the best matches, best first, plus whether more exist"""
+    expression = match_expression(user_id, text)
+    if expression is None:
+        return [], False
+    rows = _candidates(conn, expression)
+    if not rows:
+        # Only 2 and 3 letter prefixes are indexed and a longer prefix merges
+        # whole posting lists, so whole words are tried first
+        rows = _candidates(conn, match_expression(user_id, text, prefix=True))
+    rows = rank(rows, text)[:MAX_RESULTS]
+    return rows[offset:offset + limit], offset + limit < len(rows)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "rebuild":
+        sys.exit("Usage: python search.py rebuild [database]")
+    db_file = sys.argv[2] if len(sys.argv) > 2 else "todo_bot.db"
+    conn = sqlite3.connect(db_file)
+    with conn:
+        count = rebuild(conn)
+    conn.close()
+    print(f"Rebuilt tasks_fts: {count} tasks indexed")
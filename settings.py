@@ -0,0 +1,105 @@
+"""Typed bot configuration, read from the environment (and file.env).
+
+Nothing is read when this module is imported: botfinal.main() calls
+load_settings() once, and tools or benchmarks can build a Settings
+directly, e.g. Settings(bot_token="123:fake", db_shards=2).
+"""
+import dataclasses
+import os
+
+ENV_FILE = "file.env"
+
+
+class ConfigError(ValueError):
+    """A setting is missing or has an unusable value"""
+
+
+@dataclasses.dataclass(frozen=True)
+class Settings:
+    bot_token: str = None
+    # Update delivery: "polling" or "webhook"
+    bot_mode: str = "polling"
+    # Webhook settings, only used when bot_mode is "webhook"
+    webhook_url: str = None
+    webhook_listen: str = "127.0.0.1"
+    webhook_port: int = 8443
+    webhook_secret: str = None
+    # Concurrent update handling (see dispatch.py), used in both modes
+    update_workers: int = 16
+    max_pending_updates: int = 10000
+    max_pending_per_user: int = 20
+    # Prometheus-style /metrics endpoint (see metrics.py), off while the port is 0
+    metrics_port: int = 0
+    metrics_listen: str = "127.0.0.1"
+    # Log database helpers slower than this many milliseconds (0 = off)
+    slow_query_ms: int = 0
+    # Heavy render and analytics jobs (see jobs.py): worker processes (0 = all
+    # inline) and the job size, in rows, from which they leave the event loop
+    job_workers: int = 2
+    job_inline_threshold: int = 2000
+    # Background maintenance (see retention.py): hours between passes (0 = off),
+    # age in days after which completed tasks are archived and fired reminders deleted
+    maintenance_interval_hours: float = 24.0
+    archive_after_days: int = 90
+    reminder_retention_days: int = 30
+    # Conversation and user_data persistence (see persistence.py): milliseconds
+    # between writes, and minutes of inactivity after which a conversation ends
+    persistence_flush_ms: int = 500
+    conversation_ttl_minutes: int = 60
+    # Comma-separated Telegram user ids allowed to use /broadcast
+    admin_ids: str = ""
+    # Contacts database of older versions, merged into db_file once at startup
+    # (see database.py); empty to skip
+    legacy_users_db: str = "users.db"
+    # Users are hashed over db_shards database files (see storage.py); split an
+    # existing database first with `python sharding.py split todo_bot.db N`
+    db_file: str = "todo_bot.db"
+    db_shards: int = 1
+
+    @classmethod
+    def from_env(cls, env=None):
+        """Settings from environment variables named like the fields, in upper case"""
+        env = os.environ if env is None else env
+        values = {}
+        for field in dataclasses.fields(cls):
+            raw = env.get(field.name.upper())
+            if raw is None or raw == "":
+                continue
+            try:
+                values[field.name] = field.type(raw)
+            except ValueError:
+                raise ConfigError(f"❌ ERROR: {field.name.upper()} must be a number, got {raw!r}.") from None
+        if "bot_mode" in values:
+            values["bot_mode"] = values["bot_mode"].lower()
+        return cls(**values)
+
+    @property
+    def admins(self):
+        """admin_ids as a set of ints"""
+        return {int(part) for part in self.admin_ids.replace(" ", "").split(",") if part}
+
+    def check(self):
+        """Raise ConfigError unless the bot can run with these settings"""
+        if not self.bot_token:
+            raise ConfigError("❌ ERROR: Bot token not found in environment variables.")
+        if self.bot_mode not in ("polling", "webhook"):
+            raise ConfigError(f"❌ ERROR: BOT_MODE must be polling or webhook, got {self.bot_mode!r}.")
+        if self.bot_mode == "webhook" and not self.webhook_url:
+            raise ConfigError("❌ ERROR: WEBHOOK_URL is required when BOT_MODE=webhook.")
+        if self.db_shards < 1:
+            raise ConfigError("❌ ERROR: DB_SHARDS must be at least 1.")
+        try:
+            self.admins
+        except ValueError:
+            raise ConfigError(f"❌ ERROR: ADMIN_IDS must be comma-separated user ids, got {self.admin_ids!r}.") from None
+        return self
+
+
+def load_settings(env_file=ENV_FILE):
+    """Read env_file into the environment (without overriding it), then the settings"""
+    if env_file and os.path.exists(env_file):
+        # Only the bot itself needs python-dotenv
+        from dotenv import load_dotenv
+
+        load_dotenv(env_file)
+    return Settings.from_env()
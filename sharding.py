@@ -0,0 +1,74 @@
+"""Split a single todo_bot.db into shard files for DB_SHARDS=N.
+
+Every user's rows (profile, tasks, archived tasks, reminders, daily stats,
+conversation state, task events) are copied to the shard their user id
+hashes to (storage.shard_index), and contacts to the shard of their email,
+keeping task and reminder ids, so the numbers users see in /showtask don't
+change. The search index of each shard is filled by
+its triggers as tasks are copied. The source database is left untouched
+apart from being migrated first.
+
+    python sharding.py split [todo_bot.db] N
+"""
+import os
+import sqlite3
+import sys
+import time
+
+from migrations import migrate
+from storage import shard_files, shard_index
+
+# Tables holding per-user rows, copied as whole rows
+USER_TABLES = (
+    "users", "tasks", "tasks_archive", "reminders", "user_daily_stats", "conversation_state", "user_state",
+    "task_events",
+)
+# Tables sharded by something else than the user id, and that key (see database.py)
+KEYED_TABLES = {"contacts": "coalesce(email, '')"}
+
+
+def split(db_file, shards):
+    """Write db_file's rows into its shard files; returns rows copied per shard"""
+    targets = shard_files(db_file, shards)
+    existing = [path for path in targets if os.path.exists(path)]
+    if shards < 2 or existing:
+        raise ValueError(f"need at least 2 shards and no existing shard files (found {existing})")
+
+    source = sqlite3.connect(db_file)
+    migrate(source)
+    source.close()
+
+    copied = []
+    for index, path in enumerate(targets):
+        conn = sqlite3.connect(path)
+        migrate(conn)
+        conn.create_function("shard_index", 1, lambda key: shard_index(key, shards), deterministic=True)
+        conn.execute("ATTACH DATABASE ? AS source", (db_file,))
+        rows = 0
+        with conn:
+            for table in USER_TABLES + tuple(KEYED_TABLES):
+                key = KEYED_TABLES.get(table, "user_id")
+                cursor = conn.execute(
+                    f"INSERT INTO main.{table} SELECT * FROM source.{table} WHERE shard_index({key}) = ?",
+                    (index,)
+                )
+                rows += cursor.rowcount
+            conn.execute("INSERT INTO tasks_fts (tasks_fts) VALUES ('optimize')")
+        conn.execute("DETACH DATABASE source")
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.close()
+        copied.append(rows)
+    return copied
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 3 or sys.argv[1] != "split":
+        sys.exit("Usage: python sharding.py split [database] N")
+    db_file = sys.argv[2] if len(sys.argv) > 3 else "todo_bot.db"
+    shards = int(sys.argv[-1])
+    started = time.perf_counter()
+    copied = split(db_file, shards)
+    for path, rows in zip(shard_files(db_file, shards), copied):
+        print(f"{path}: {rows} rows")
+    print(f"Split {db_file} into {shards} shards in {time.perf_counter() - started:.1f}s; "
+          f"start the bot with DB_SHARDS={shards}")
@@ -0,0 +1,148 @@
+"""Per-user daily task counts, kept up to date as tasks change.
+
+`user_daily_stats` holds one row per (user, local day a task was created):
+how many tasks were created that day and how many of those are completed.
+The task writers in botfinal.py call bump()/subtract_user() inside their own
+transaction, so /history only has to range-read at most N rows.
+
+Rebuild the table from the raw tasks with:
+
+    python stats.py backfill [todo_bot.db]
+"""
+import sqlite3
+import sys
+
+from storage import reader
+
+# strftime() formats for each /history granularity
+GRANULARITIES = {
+    "day": "%Y-%m-%d",
+    "week": "%Y-W%W",
+    "month": "%Y-%m",
+}
+
+MAX_DAYS = 366
+
+
+def create_table(conn):
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS user_daily_stats (
+        user_id TEXT NOT NULL,
+        day TEXT NOT NULL,
+        created_count INTEGER NOT NULL DEFAULT 0,
+        completed_count INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (user_id, day)
+    ) WITHOUT ROWID
+    ''')
+
+
+def bump(conn, user_id, created_at, created=0, completed=0):
+    """Add to the counters of the day created_at (epoch seconds) falls on"""
+    conn.execute(
+        """
+        INSERT INTO user_daily_stats (user_id, day, created_count, completed_count)
+        VALUES (?, date(?, 'unixepoch', 'localtime'), ?, ?)
+        ON CONFLICT (user_id, day) DO UPDATE SET
+            created_count = created_count + excluded.created_count,
+            completed_count = completed_count + excluded.completed_count
+        """,
+        (user_id, created_at, created, completed)
+    )
+
+
+def add_tasks_since(conn, first_id):
+    """Add the tasks with id >= first_id to the rollup.
+
+    For bulk inserts: called in the inserting transaction, those are exactly
+    the rows just inserted, and the id range is a primary key range scan.
+    """
+    conn.execute(
+        """
+        INSERT INTO user_daily_stats (user_id, day, created_count, completed_count)
+        SELECT user_id, date(created_at, 'unixepoch', 'localtime'),
+               count(*), sum(status = 'completed')
+        FROM tasks WHERE id >= ?
+        GROUP BY 1, 2
+        ON CONFLICT (user_id, day) DO UPDATE SET
+            created_count = created_count + excluded.created_count,
+            completed_count = completed_count + excluded.completed_count
+        """,
+        (first_id,)
+    )
+
+
+def subtract_user(conn, user_id):
+    """Remove all of a user's tasks, archived ones included, from the rollup (before deleting them)"""
+    conn.execute(
+        """
+        INSERT INTO user_daily_stats (user_id, day, created_count, completed_count)
+        SELECT user_id, date(created_at, 'unixepoch', 'localtime'),
+               -count(*), -sum(status = 'completed')
+        FROM (
+            SELECT user_id, created_at, status FROM tasks WHERE user_id = ?1
+            UNION ALL SELECT user_id, created_at, status FROM tasks_archive WHERE user_id = ?1
+        )
+        GROUP BY 1, 2
+        ON CONFLICT (user_id, day) DO UPDATE SET
+            created_count = created_count + excluded.created_count,
+            completed_count = completed_count + excluded.completed_count
+        """,
+        (user_id,)
+    )
+    conn.execute(
+        "DELETE FROM user_daily_stats WHERE user_id = ? AND created_count <= 0",
+        (user_id,)
+    )
+
+
+def backfill(conn):
+    """Recompute the whole rollup from the tasks table (and the archive)"""
+    create_table(conn)
+    conn.execute("DELETE FROM user_daily_stats")
+    source = "tasks"
+    # Archived tasks (see retention.py) still count towards /history
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'tasks_archive'").fetchone():
+        source = (
+            "(SELECT user_id, created_at, status FROM tasks "
+            "UNION ALL SELECT user_id, created_at, status FROM tasks_archive)"
+        )
+    conn.execute(
+        f"""
+        INSERT INTO user_daily_stats (user_id, day, created_count, completed_count)
+        SELECT user_id, date(created_at, 'unixepoch', 'localtime'),
+               count(*), sum(status = 'completed')
+        FROM {source}
+        GROUP BY 1, 2
+        """
+    )
+    return conn.execute("SELECT count(*) FROM user_daily_stats").fetchone()[0]
+
+
+@reader
+def get_history(conn, user_id, days=30, granularity="day"):
+    """Get (period, created, completed) rows for the last `days` days"""
+    fmt = GRANULARITIES[granularity]
+    days = max(1, min(int(days), MAX_DAYS))
+    cursor = conn.execute(
+        """
+        SELECT strftime(?, day) AS period, sum(created_count), sum(completed_count)
+        FROM user_daily_stats
+        WHERE user_id = ? AND day > date('now', 'localtime', ?)
+        GROUP BY period
+        HAVING sum(created_count) > 0
+        ORDER BY period
+        """,
+        (fmt, user_id, f"-{days} day")
+    )
+    return cursor.fetchall()
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2 or sys.argv[1] != "backfill":
+        sys.exit("Usage: python stats.py backfill [database]")
+    db_file = sys.argv[2] if len(sys.argv) > 2 else "todo_bot.db"
+    conn = sqlite3.connect(db_file)
+    with conn:
+        rows = backfill(conn)
+    conn.close()
+    print(f"Rebuilt user_daily_stats: {rows} rows")
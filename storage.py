@@ -0,0 +1,271 @@
+import asyncio
+import functools
+import logging
+import sqlite3
+import os
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import DB_ERRORS, DB_REQUESTS, DB_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# Default number of reader threads (and reader connections)
+DEFAULT_READERS = 4
+
+
+class ConnectionPool:
+    """Long-lived SQLite connections: one writer thread and N reader threads.
+
+    Every thread owns exactly one connection, opened the first time the
+    thread starts. All writes are serialised through the single writer
+    thread, so SQLite never has to fight over its write lock, while WAL mode
+    lets the readers run next to it.
+
+    Every call is counted and timed per helper (see metrics.py); calls
+    slower than slow_query seconds are logged as well.
+    """
+
+    def __init__(self, db_file, readers=DEFAULT_READERS, busy_timeout=30.0, slow_query=None):
+        self.db_file = db_file
+        self.busy_timeout = busy_timeout
+        self.slow_query = slow_query
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._writer = ThreadPoolExecutor(
+            max_workers=1,
+            thread_name_prefix="db-writer",
+            initializer=self._open_connection,
+            initargs=(False,),
+        )
+        self._readers = ThreadPoolExecutor(
+            max_workers=readers,
+            thread_name_prefix="db-reader",
+            initializer=self._open_connection,
+            initargs=(True,),
+        )
+
+    def _open_connection(self, read_only):
+        """Open the connection owned by the current executor thread"""
+        conn = sqlite3.connect(
+            self.db_file, timeout=self.busy_timeout, check_same_thread=False
+        )
+        if not read_only:
+            # auto_vacuum must be chosen before a new file switches to WAL;
+            # on existing files this is a no-op (see retention.py)
+            conn.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if read_only:
+            conn.execute("PRAGMA query_only=1")
+        self._local.conn = conn
+        with self._lock:
+            self._connections.append(conn)
+
+    def _timed(self, fn, call):
+        name = fn.__name__
+        started = time.perf_counter()
+        try:
+            return call()
+        except Exception:
+            DB_ERRORS.inc(name)
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            DB_SECONDS.observe(elapsed, name)
+            DB_REQUESTS.inc(name)
+            if self.slow_query is not None and elapsed >= self.slow_query:
+                logger.warning("Slow query: %s took %.0f ms", name, elapsed * 1000)
+
+    def _run_read(self, fn, args, kwargs):
+        return self._timed(fn, lambda: fn(self._local.conn, *args, **kwargs))
+
+    def _run_write(self, fn, args, kwargs):
+        conn = self._local.conn
+
+        def call():
+            # One transaction per call: commit on success, roll back on error
+            with conn:
+                return fn(conn, *args, **kwargs)
+
+        return self._timed(fn, call)
+
+    async def read(self, fn, *args, **kwargs):
+        """Run fn(conn, *args) on a reader thread without blocking the loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._readers, self._run_read, fn, args, kwargs
+        )
+
+    async def write(self, fn, *args, **kwargs):
+        """Run fn(conn, *args) in a transaction on the writer thread"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            self._writer, self._run_write, fn, args, kwargs
+        )
+
+    def run_read(self, fn, *args, **kwargs):
+        """Blocking variant of read() for scripts and startup code"""
+        return self._readers.submit(self._run_read, fn, args, kwargs).result()
+
+    def run_write(self, fn, *args, **kwargs):
+        """Blocking variant of write() for scripts and startup code"""
+        return self._writer.submit(self._run_write, fn, args, kwargs).result()
+
+    def close(self):
+        """Wait for queued work, then close every connection"""
+        self._writer.shutdown(wait=True)
+        self._readers.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections.clear()
+
+
+def shard_files(db_file, shards):
+    """Database files of a store split into shards: todo_bot-0.db, todo_bot-1.db, ...
+
+    A single shard is the plain database file.
+    """
+    if shards == 1:
+        return [db_file]
+    root, ext = os.path.splitext(db_file)
+    return [f"{root}-{index}{ext}" for index in range(shards)]
+
+
+def shard_index(key, shards):
+    """Shard that owns a user id; stable across processes and restarts"""
+    if shards == 1:
+        return 0
+    return zlib.crc32(str(key).encode()) % shards
+
+
+class ShardedPool:
+    """One ConnectionPool per shard file, with users hashed to shards.
+
+    Every user's rows (user, tasks, reminders, stats) live in exactly one
+    shard, so per-user helpers only ever touch the shard that owns them and
+    each shard has its own writer thread and write lock.
+    """
+
+    def __init__(self, db_file, shards=1, readers=DEFAULT_READERS, busy_timeout=30.0, slow_query=None):
+        self.db_file = db_file
+        self.shards = [
+            ConnectionPool(path, readers=readers, busy_timeout=busy_timeout, slow_query=slow_query)
+            for path in shard_files(db_file, shards)
+        ]
+
+    def shard_for(self, key):
+        return shard_index(key, len(self.shards))
+
+    def pool_for(self, key):
+        return self.shards[self.shard_for(key)]
+
+    # The first argument of a helper is the user it works for and picks the shard
+    async def read(self, fn, key=None, *args, **kwargs):
+        return await self.pool_for(key).read(fn, key, *args, **kwargs)
+
+    async def write(self, fn, key=None, *args, **kwargs):
+        return await self.pool_for(key).write(fn, key, *args, **kwargs)
+
+    def run_read(self, fn, key=None, *args, **kwargs):
+        return self.pool_for(key).run_read(fn, key, *args, **kwargs)
+
+    def run_write(self, fn, key=None, *args, **kwargs):
+        return self.pool_for(key).run_write(fn, key, *args, **kwargs)
+
+    def run_write_all(self, fn, *args, **kwargs):
+        """Run fn(conn, *args) on every shard's writer, one shard after another"""
+        return [pool.run_write(fn, *args, **kwargs) for pool in self.shards]
+
+    def close(self):
+        for pool in self.shards:
+            pool.close()
+
+
+_pool = None
+
+
+def init_pool(db_file, readers=DEFAULT_READERS, slow_query=None, shards=1):
+    """Create the process-wide pool used by the @reader/@writer helpers"""
+    global _pool
+    if _pool is not None:
+        _pool.close()
+    _pool = ShardedPool(db_file, shards=shards, readers=readers, slow_query=slow_query)
+    logger.info("Storage pool ready for %s (%d shards, %d readers each)", db_file, shards, readers)
+    return _pool
+
+
+def get_pool():
+    if _pool is None:
+        raise RuntimeError("Storage pool is not initialised, call init_pool() first")
+    return _pool
+
+
+def close_pool():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+
+def reader(fn):
+    """Turn fn(conn, user_id, ...) into an awaitable helper that runs on a
+    reader thread of the shard owning user_id.
+
+    The blocking form stays available as helper.sync(...).
+    """
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await get_pool().read(fn, *args, **kwargs)
+
+    wrapper.sync = lambda *args, **kwargs: get_pool().run_read(fn, *args, **kwargs)
+    return wrapper
+
+
+def writer(fn):
+    """Turn fn(conn, user_id, ...) into an awaitable helper that runs on the
+    writer thread of the shard owning user_id.
+
+    The blocking form stays available as helper.sync(...).
+    """
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await get_pool().write(fn, *args, **kwargs)
+
+    wrapper.sync = lambda *args, **kwargs: get_pool().run_write(fn, *args, **kwargs)
+    return wrapper
+
+
+class ShardHelper:
+    """A helper that covers every user of a shard rather than one user.
+
+    There is no user id to pick the shard by, so the only way to run it is
+    helper.on_shard(shard, ...), awaitable. The plain function stays
+    available as helper.__wrapped__, e.g. for a connection of one's own.
+    """
+
+    def __init__(self, fn, write):
+        functools.update_wrapper(self, fn)
+        self._write = write
+
+    def __call__(self, *args, **kwargs):
+        raise TypeError(f"{self.__name__}() covers a whole shard, call {self.__name__}.on_shard(shard, ...)")
+
+    def on_shard(self, shard, *args, **kwargs):
+        pool = get_pool().shards[shard]
+        run = pool.write if self._write else pool.read
+        return run(self.__wrapped__, *args, **kwargs)
+
+
+def shard_reader(fn):
+    """Turn fn(conn, ...) into helper.on_shard(shard, ...), run on a reader thread of that shard"""
+    return ShardHelper(fn, write=False)
+
+
+def shard_writer(fn):
+    """Turn fn(conn, ...) into helper.on_shard(shard, ...), run on the writer thread of that shard"""
+    return ShardHelper(fn, write=True)
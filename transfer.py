@@ -0,0 +1,250 @@
+"""Streaming /export and /import of a user's tasks and reminders.
+
+Exports walk the user's rows in (created_at, id) order along the per-user
+indexes, CHUNK_SIZE rows per reader call, and write them straight to a
+file, so memory use does not grow with the number of rows. Imports read
+the uploaded file IMPORT_BATCH rows at a time and store each batch in one
+write transaction, keeping the /history rollup and the task event log in
+step like add_task does.
+
+Both formats carry the same columns: CSV with a header row, or JSON lines
+with one object per row. `type` is "task" or "reminder".
+"""
+import asyncio
+import csv
+import io
+import json
+import logging
+import time
+
+import events
+import recurrence
+import stats
+from storage import reader, writer
+
+logger = logging.getLogger(__name__)
+
+FORMATS = ("csv", "jsonl")
+COLUMNS = ("type", "id", "text", "status", "created_at", "updated_at", "due_at", "completed", "repeat")
+TASK_STATUSES = ("pending", "completed")
+
+# Rows per reader call when exporting, and per write transaction when importing
+CHUNK_SIZE = 1000
+IMPORT_BATCH = 1000
+# Telegram lets bots download files up to 20 MB and upload up to 50 MB
+MAX_IMPORT_BYTES = 20 * 1024 * 1024
+MAX_EXPORT_BYTES = 50 * 1024 * 1024
+MAX_TEXT_LENGTH = 4096
+# Latest timestamp accepted (9999-12-31): later ones can't be shown as
+# dates, and past 2^63 SQLite can't even store them
+MAX_TIMESTAMP = 253402300799
+
+# Keyset queries: rows after (created_at, id), in COLUMNS order minus type
+EXPORT_QUERIES = {
+    # Archived tasks (see retention.py) are exported with the live ones; an
+    # id is in one table or the other. Each side is cut to a chunk first, so
+    # only two chunks are sorted, not all of the user's remaining rows.
+    "task": """
+        SELECT id, task, status, created_at, updated_at, due_at, NULL, NULL FROM (
+            SELECT * FROM (
+                SELECT id, task, status, created_at, updated_at, due_at
+                FROM tasks WHERE user_id = ?1 AND (created_at, id) > (?2, ?3)
+                ORDER BY created_at, id LIMIT ?4
+            )
+            UNION ALL
+            SELECT * FROM (
+                SELECT id, task, status, created_at, updated_at, due_at
+                FROM tasks_archive WHERE user_id = ?1 AND (created_at, id) > (?2, ?3)
+                ORDER BY created_at, id LIMIT ?4
+            )
+        )
+        ORDER BY created_at, id LIMIT ?4
+    """,
+    "reminder": """
+        SELECT id, reminder_text, NULL, created_at, NULL, due_at, completed, repeat
+        FROM reminders WHERE user_id = ? AND (created_at, id) > (?, ?)
+        ORDER BY created_at, id LIMIT ?
+    """,
+}
+
+
+class RowWriter:
+    """Writes export rows as CSV or JSON lines to a text stream"""
+
+    def __init__(self, out, fmt):
+        self.out = out
+        self.fmt = fmt
+        if fmt == "csv":
+            self._csv = csv.writer(out)
+            self._csv.writerow(COLUMNS)
+
+    def write(self, kind, rows):
+        if self.fmt == "csv":
+            self._csv.writerows((kind, *row) for row in rows)
+        else:
+            self.out.writelines(
+                json.dumps(dict(zip(COLUMNS, (kind, *row))), ensure_ascii=False) + "\n" for row in rows
+            )
+
+
+@reader
+def _export_chunk(conn, user_id, kind, after, limit, rows_out):
+    """Write the next chunk of a user's rows; returns ((created_at, id) of the last, rows written)"""
+    rows = conn.execute(EXPORT_QUERIES[kind], (user_id, *after, limit)).fetchall()
+    rows_out.write(kind, rows)
+    return ((rows[-1][3], rows[-1][0]) if rows else after), len(rows)
+
+
+async def export_user(user_id, out, fmt="csv", chunk_size=CHUNK_SIZE):
+    """Write all of a user's tasks, then reminders, to the binary file out.
+
+    Returns (tasks, reminders) written.
+    """
+    text = io.TextIOWrapper(out, encoding="utf-8", newline="")
+    rows_out = RowWriter(text, fmt)
+    counts = []
+    for kind in ("task", "reminder"):
+        after, total = (-1, -1), 0
+        while True:
+            # Each chunk is its own read, so the export never pins a snapshot
+            after, count = await _export_chunk(user_id, kind, after, chunk_size, rows_out)
+            total += count
+            if count < chunk_size:
+                break
+        counts.append(total)
+    text.flush()
+    text.detach()
+    return tuple(counts)
+
+
+def detect_format(file_name, head):
+    """Format of an uploaded file from its name, else from its first byte"""
+    name = (file_name or "").lower()
+    if name.endswith(".csv"):
+        return "csv"
+    if name.endswith((".jsonl", ".json", ".ndjson")):
+        return "jsonl"
+    return "jsonl" if head.lstrip()[:1] == b"{" else "csv"
+
+
+def _int(value, default=None):
+    """value as a timestamp, default if missing or not a number; ValueError if out of range"""
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return default
+    if not 0 <= number <= MAX_TIMESTAMP:
+        raise ValueError(f"timestamp out of range: {number}")
+    return number
+
+
+def parse_record(record, now):
+    """("task", row) or ("reminder", row) ready to insert, or None if unusable"""
+    try:
+        return _parse_record(record, now)
+    except ValueError:
+        return None
+
+
+def _parse_record(record, now):
+    text = str(record.get("text") or "").strip()[:MAX_TEXT_LENGTH]
+    if not text:
+        return None
+    created_at = _int(record.get("created_at"), now)
+    kind = record.get("type") or "task"
+    if kind == "task":
+        status = record.get("status") if record.get("status") in TASK_STATUSES else "pending"
+        updated_at = _int(record.get("updated_at"), created_at)
+        return "task", (text, status, created_at, updated_at, _int(record.get("due_at")))
+    if kind == "reminder":
+        due_at = _int(record.get("due_at"))
+        if due_at is None:
+            return None
+        completed = 1 if str(record.get("completed")).lower() in ("1", "true") else 0
+        minutes = max(0, (due_at - created_at) // 60)
+        repeat = record.get("repeat") or None
+        if repeat is not None and not recurrence.is_valid(repeat):
+            repeat = None
+        return "reminder", (text, minutes, created_at, due_at, completed, repeat)
+    return None
+
+
+def read_batches(stream, fmt, size=IMPORT_BATCH, now=None):
+    """Yield (tasks, reminders, skipped) for every `size` records of a binary stream"""
+    now = now or int(time.time())
+    text = io.TextIOWrapper(stream, encoding="utf-8", errors="replace", newline="")
+    if fmt == "csv":
+        records = csv.DictReader(text)
+    else:
+        records = (_json_record(line) for line in text if line.strip())
+    tasks, reminders, skipped = [], [], 0
+    for record in records:
+        parsed = parse_record(record, now) if isinstance(record, dict) else None
+        if parsed is None:
+            skipped += 1
+        elif parsed[0] == "task":
+            tasks.append(parsed[1])
+        else:
+            reminders.append(parsed[1])
+        if len(tasks) + len(reminders) + skipped >= size:
+            yield tasks, reminders, skipped
+            tasks, reminders, skipped = [], [], 0
+    if tasks or reminders or skipped:
+        yield tasks, reminders, skipped
+
+
+def _json_record(line):
+    try:
+        return json.loads(line)
+    except ValueError:
+        return None
+
+
+@writer
+def _import_batch(conn, user_id, tasks, reminders, chat_id):
+    """Insert one batch; returns (id, due_at) of the reminders still to fire"""
+    if tasks:
+        first_id = (conn.execute("SELECT max(id) FROM tasks").fetchone()[0] or 0) + 1
+        conn.executemany(
+            "INSERT INTO tasks (user_id, task, status, created_at, updated_at, due_at) VALUES (?, ?, ?, ?, ?, ?)",
+            [(user_id, *task) for task in tasks]
+        )
+        stats.add_tasks_since(conn, first_id)
+        events.add_tasks_since(conn, first_id, int(time.time()))
+    if not reminders:
+        return []
+    first_id = (conn.execute("SELECT max(id) FROM reminders").fetchone()[0] or 0) + 1
+    conn.executemany(
+        "INSERT INTO reminders (user_id, reminder_text, reminder_time, created_at, due_at, completed, repeat, chat_id) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(user_id, *reminder, chat_id) for reminder in reminders]
+    )
+    cursor = conn.execute(
+        "SELECT id, due_at FROM reminders WHERE id >= ? AND completed = 0", (first_id,)
+    )
+    return cursor.fetchall()
+
+
+async def import_user(user_id, stream, fmt, chat_id=None, schedule=None):
+    """Import a file written by export_user (or by hand) for a user.
+
+    Rows get new ids; reminders lose their link to a task. schedule, if
+    given, is called with (reminder_id, due_at) for every pending reminder.
+    Returns (tasks, reminders, skipped).
+    """
+    batches = read_batches(stream, fmt)
+    totals = [0, 0, 0]
+    while True:
+        # Parsing runs off the event loop, one batch at a time
+        batch = await asyncio.to_thread(next, batches, None)
+        if batch is None:
+            break
+        tasks, reminders, skipped = batch
+        pending = await _import_batch(user_id, tasks, reminders, chat_id)
+        if schedule is not None:
+            for reminder_id, due_at in pending:
+                schedule(reminder_id, due_at)
+        totals[0] += len(tasks)
+        totals[1] += len(reminders)
+        totals[2] += skipped
+    return tuple(totals)
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import signal
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+from aiohttp import web
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# How many recent update ids are remembered to drop Telegram's redeliveries
+DEDUPE_WINDOW = 10000
+
+
+class RecentIds:
+    """Bounded set of the most recently seen update ids"""
+
+    def __init__(self, maxlen=DEDUPE_WINDOW):
+        self.maxlen = maxlen
+        self._ids = OrderedDict()
+
+    def add(self, update_id):
+        """Remember update_id; returns False if it was already seen"""
+        if update_id in self._ids:
+            return False
+        self._ids[update_id] = None
+        if len(self._ids) > self.maxlen:
+            self._ids.popitem(last=False)
+        return True
+
+
+class WebhookServer:
+    """aiohttp endpoint that feeds Telegram webhook updates into the Application.
+
+    Updates are deduplicated by update_id. When more than max_pending updates
+    are queued or running, requests are answered with 503 so Telegram retries
+    them later instead of the bot buffering without limit.
+    """
+
+    def __init__(self, app, processor, path="/telegram", secret_token=None, max_pending=None):
+        self.app = app
+        self.processor = processor
+        self.path = path
+        self.secret_token = secret_token
+        self.max_pending = max_pending or processor.max_concurrent_updates
+        self.received = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self._seen = RecentIds()
+        self.web_app = web.Application()
+        self.web_app.router.add_post(path, self.handle)
+
+    def backlog(self):
+        return self.app.update_queue.qsize() + self.processor.pending
+
+    async def handle(self, request):
+        if self.secret_token and request.headers.get("X-Telegram-Bot-Api-Secret-Token") != self.secret_token:
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+        except ValueError:
+            return web.Response(status=400)
+
+        update_id = data.get("update_id")
+        if update_id is None:
+            return web.Response(status=400)
+        if self.backlog() >= self.max_pending:
+            self.rejected += 1
+            return web.Response(status=503)
+        if not self._seen.add(update_id):
+            self.duplicates += 1
+            return web.Response()
+
+        self.received += 1
+        await self.app.update_queue.put(Update.de_json(data, self.app.bot))
+        return web.Response()
+
+
+async def run_webhook(app, processor, webhook_url, listen="127.0.0.1", port=8443, secret_token=None,
+                      register=True, stop_event=None):
+    """Run the Application behind a local webhook endpoint until stopped.
+
+    webhook_url is the public URL Telegram posts to; its path is served
+    locally. With register=False setWebhook is not called (load tests).
+    """
+    path = urlparse(webhook_url).path or "/telegram"
+    server = WebhookServer(app, processor, path=path, secret_token=secret_token)
+
+    if stop_event is None:
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop_event.set)
+
+    async with app:
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+
+        runner = web.AppRunner(server.web_app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, listen, port).start()
+        if register:
+            await app.bot.set_webhook(webhook_url, secret_token=secret_token, allowed_updates=Update.ALL_TYPES)
+        logger.info("🚀 Webhook listening on %s:%d%s", listen, port, path)
+
+        try:
+            await stop_event.wait()
+        finally:
+            await runner.cleanup()
+            await app.stop()
+            logger.info("Webhook stopped: %d updates, %d duplicates, %d rejected",
+                        server.received, server.duplicates, server.rejected)
+
+    if app.post_shutdown:
+        await app.post_shutdown(app)
+    return server